@@ -0,0 +1,77 @@
+import io
+import statistics
+import time
+
+import numpy
+from django.core.management import BaseCommand
+from PIL import Image, ImageDraw
+from registry.proxy.images import mask_image
+
+
+class Command(BaseCommand):
+    help = "Micro benchmark of the security mask compositing for different image sizes and formats."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="256,1024,4096",
+                            help="comma separated edge lengths of the square test images")
+        parser.add_argument("--formats", default="PNG,JPEG",
+                            help="comma separated Pillow formats of the test images")
+        parser.add_argument("--repetitions", type=int, default=10)
+
+    def handle(self, *args, **options):
+        for image_format in options["formats"].upper().split(","):
+            for size in [int(size) for size in options["sizes"].split(",")]:
+                content, mask = self._create_test_data(
+                    size=size, image_format=image_format)
+                self._report(
+                    f"{image_format} {size}x{size} pipeline",
+                    self._measure(lambda: mask_image(content=content, mask=mask), options["repetitions"]))
+                self._report(
+                    f"{image_format} {size}x{size} composite",
+                    self._measure(lambda: self._composite(content=content, mask=mask), options["repetitions"]))
+
+    @staticmethod
+    def _create_test_data(size, image_format):
+        # noise does not compress well, so the encoders have some work to do like with real map images
+        pixels = numpy.random.default_rng(seed=0).integers(
+            0, 256, size=(size, size, 3), dtype=numpy.uint8)
+        out_bytes_stream = io.BytesIO()
+        Image.fromarray(pixels).save(out_bytes_stream, image_format)
+
+        mask = Image.new("L", (size, size), 255)
+        ImageDraw.Draw(mask).ellipse(
+            (size // 8, size // 8, size - size // 8, size - size // 4), fill=0)
+        return out_bytes_stream.getvalue(), mask
+
+    @staticmethod
+    def _composite(content, mask):
+        """Reference implementation with Pillow compositing and a separate encode step."""
+        image = Image.open(io.BytesIO(content))
+        image_format = image.format
+        alpha_layer = Image.new("RGBA", image.size, (255, 0, 0, 0))
+        image = Image.composite(alpha_layer, image, mask.convert("L").resize(image.size))
+        out_bytes_stream = io.BytesIO()
+        try:
+            image.save(out_bytes_stream, image_format, quality=80)
+        except IOError:
+            out_bytes_stream = io.BytesIO()
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[3])
+            background.save(out_bytes_stream, image_format, quality=80)
+        return out_bytes_stream.getvalue()
+
+    @staticmethod
+    def _measure(func, repetitions):
+        func()
+        timings = []
+        for _ in range(repetitions):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    def _report(self, name, timings):
+        self.stdout.write(self.style.SUCCESS(
+            f"{name}: mean {statistics.mean(timings):.2f} ms, median {statistics.median(timings):.2f} ms, "
+            f"max {max(timings):.2f} ms ({len(timings)} runs)"
+        ))
@@ -0,0 +1,330 @@
+import io
+import json
+import platform
+import statistics
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qsl, urlsplit
+
+import django
+from accounts.models.users import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import (setup_databases, setup_test_environment,
+                               teardown_databases, teardown_test_environment)
+from MrMap.settings import BASE_DIR
+from PIL import Image, ImageDraw
+from registry.models.security import AllowedWebMapServiceOperation
+from registry.models.service import WebFeatureService, WebMapService
+
+TEST_DATA = Path(BASE_DIR) / "tests" / "django" / "test_data"
+
+# services of the test fixtures; the unsecured service has no allowed operations
+SECURED_WMS = "cd16cc1f-3abb-4625-bb96-fbe80dbe23e3"
+UNSECURED_WMS = "1b195589-dcfa-403f-9e66-e7e1c0a67024"
+SECURED_WFS = "73cf78c9-6605-47fd-ac4f-1be59265df65"
+
+# wms 1.3.0 bboxes in lat/lon axis order around the allowed areas of the test fixtures in koblenz
+COVERED_BBOX = "50.354,7.584,50.356,7.586"
+INTERSECTING_BBOX = "50.34,7.55,50.38,7.62"
+DISJOINT_BBOX = "10.0,10.0,10.01,10.01"
+
+SCENARIOS = ("unsecured", "secured-covered", "secured-intersecting",
+             "secured-disjoint", "get-feature-info", "get-feature")
+
+
+def get_feature_collection(features: int) -> bytes:
+    """Return a gml 3.2 feature collection of the given count of small polygons inside the allowed area of europe."""
+    members = "".join(
+        f'<wfs:member><ms:Countries gml:id="Countries.{index}"><ms:Geometry>'
+        f'<gml:Polygon gml:id="Countries.{index}.1" srsName="urn:ogc:def:crs:EPSG::4326"><gml:exterior><gml:LinearRing>'
+        f'<gml:posList srsDimension="2">{lat} 7 {lat} 8 {lat + 1} 8 {lat + 1} 7 {lat} 7</gml:posList>'
+        f'</gml:LinearRing></gml:exterior></gml:Polygon></ms:Geometry></ms:Countries></wfs:member>'
+        for index, lat in ((index, 45 + index % 10) for index in range(features))
+    )
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>'
+        f'<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" xmlns:gml="http://www.opengis.net/gml/3.2" '
+        f'xmlns:ms="http://www.someserver.example.com/ms" numberMatched="{features}" numberReturned="{features}">'
+        f'<wfs:boundedBy><gml:Envelope srsName="urn:ogc:def:crs:EPSG::4326"><gml:lowerCorner>45 7</gml:lowerCorner>'
+        f'<gml:upperCorner>55 8</gml:upperCorner></gml:Envelope></wfs:boundedBy>{members}</wfs:FeatureCollection>'
+    ).encode("UTF-8")
+
+
+def get_feature_info() -> bytes:
+    """Return a GetFeatureInfo response, which features are inside the covered bbox."""
+    return (
+        b'<?xml version="1.0" encoding="UTF-8"?>'
+        b'<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs" xmlns:gml="http://www.opengis.net/gml">'
+        b'<gml:boundedBy><gml:Box srsName="EPSG:4326"><gml:coordinates>7.5845,50.3545 7.5855,50.3555</gml:coordinates>'
+        b'</gml:Box></gml:boundedBy></wfs:FeatureCollection>'
+    )
+
+
+def get_mask(width: int, height: int) -> bytes:
+    """Return a mapserver like mask, which allows the left half of the map."""
+    mask = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    ImageDraw.Draw(mask).rectangle((0, 0, width // 2, height), fill=(0, 0, 0, 255))
+    out = io.BytesIO()
+    mask.save(out, "PNG")
+    return out.getvalue()
+
+
+class StubUpstreamHandler(BaseHTTPRequestHandler):
+    """Answers like the remote wms (``/wms``) and wfs (``/wfs``) of the test fixtures and like the mapserver, which
+    renders the security masks (``/mask``)."""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query_params = {key.upper(): value for key, value in parse_qsl(url.query)}
+        operation = query_params.get("REQUEST", "").lower()
+        if url.path == "/mask":
+            self.respond(content=get_mask(width=int(query_params["WIDTH"]), height=int(query_params["HEIGHT"])),
+                         content_type="image/png")
+        elif url.path == "/wms" and operation == "getmap":
+            self.respond(content=self.server.map_image, content_type="image/png")
+        elif url.path == "/wms" and operation == "getfeatureinfo":
+            self.respond(content=get_feature_info(), content_type="text/xml")
+        elif url.path == "/wfs":
+            self.respond(content=self.server.feature_collection,
+                         content_type="application/gml+xml; version=3.2")
+        else:
+            self.respond(content=b"not found", content_type="text/plain", status=404)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.do_GET()
+
+    def respond(self, content: bytes, content_type: str, status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = ("Measures the throughput and latency of the security proxy against local stub upstreams and writes the "
+            "results as json, so regressions can be tracked between releases. The benchmark runs in a separate test "
+            "database with the proxy test fixtures.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                            help=f"comma separated scenarios of {', '.join(SCENARIOS)}")
+        parser.add_argument("--concurrency", default="1,8,32",
+                            help="comma separated counts of concurrent clients")
+        parser.add_argument("--requests", type=int, default=200,
+                            help="requests per scenario and concurrency")
+        parser.add_argument("--warmup", type=int, default=10,
+                            help="requests per scenario before measuring")
+        parser.add_argument("--profile-requests", type=int, default=20,
+                            help="requests per scenario with allocation tracing; 0 disables the allocation profile")
+        parser.add_argument("--features", type=int, default=100,
+                            help="features of the stub GetFeature response")
+        parser.add_argument("--mask-backend", choices=("native", "mapserver"), default="native",
+                            help="security mask backend; mapserver requests the stub mask server")
+        parser.add_argument("--output", help="write the json results to this file instead of stdout")
+        parser.add_argument("--keepdb", action="store_true",
+                            help="keep the test database between runs")
+
+    def handle(self, *args, **options):
+        scenarios = [scenario.strip() for scenario in options["scenarios"].split(",") if scenario.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"unknown scenarios: {', '.join(sorted(unknown))}")
+        concurrencies = [int(concurrency) for concurrency in options["concurrency"].split(",")]
+
+        server = self.start_stub_server(features=options["features"])
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options["keepdb"])
+        try:
+            # answer requests of layers outside of their scale range too, like the proxy tests do
+            with override_settings(
+                PROXY_GET_MAP_PREFLIGHT=False,
+                PROXY_SECURITY_MASK_BACKEND=options["mask_backend"],
+                MAPSERVER_URL=f"{server.url}/mask",
+            ):
+                self.load_fixtures(stub_url=server.url)
+                results = []
+                for scenario in scenarios:
+                    request = self.get_request(scenario=scenario)
+                    self.run(request=request, concurrency=1, count=options["warmup"])
+                    for concurrency in concurrencies:
+                        result = self.run(request=request, concurrency=concurrency, count=options["requests"])
+                        result.update(scenario=scenario, concurrency=concurrency)
+                        if options["profile_requests"]:
+                            result["allocations"] = self.profile(
+                                request=request, count=options["profile_requests"])
+                        results.append(result)
+                        self.stderr.write(
+                            f"{scenario} x{concurrency}: {result['rps']:.1f} rps, "
+                            f"p95 {result['latency_ms']['p95']:.1f} ms, status {result['status_codes']}")
+        finally:
+            connection.close()
+            teardown_databases(old_config, verbosity=0, keepdb=options["keepdb"])
+            teardown_test_environment()
+            server.shutdown()
+
+        report = json.dumps({
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "machine": platform.machine(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            },
+            "options": {key: options[key] for key in (
+                "scenarios", "concurrency", "requests", "warmup", "profile_requests", "features", "mask_backend")},
+            "results": results,
+        }, indent=2)
+        if options["output"]:
+            Path(options["output"]).write_text(report)
+        else:
+            self.stdout.write(report)
+
+    def start_stub_server(self, features: int) -> ThreadingHTTPServer:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StubUpstreamHandler)
+        server.daemon_threads = True
+        server.map_image = (TEST_DATA / "karte_rp.fcgi.png").read_bytes()
+        server.feature_collection = get_feature_collection(features=features)
+        server.url = f"http://127.0.0.1:{server.server_address[1]}"
+        threading.Thread(target=server.serve_forever, name="benchmark-stub-upstream", daemon=True).start()
+        return server
+
+    def load_fixtures(self, stub_url: str) -> None:
+        for fixture in ("test_users.json", "test_keywords.json", "test_wms.json", "test_allowed_wms_operation.json",
+                        "test_wfs_proxy.json", "test_allowed_wfs_operation.json"):
+            call_command("loaddata", fixture, verbosity=0)
+        # the clients of the services are build from the capabilities documents, which point to the stub upstreams
+        for model, pks, file_name, remote_url, stub_path in (
+            (WebMapService, (SECURED_WMS, UNSECURED_WMS), "wms/1.3.0.xml", "http://example.com/wms", "/wms"),
+            (WebFeatureService, (SECURED_WFS,), "wfs/local_mapserver.2.0.0.xml",
+             "http://mrmap-mapserver/cgi-bin/mapserv", "/wfs"),
+        ):
+            capabilities = (TEST_DATA / "capabilities" / file_name).read_text(encoding="UTF-8")
+            capabilities = capabilities.replace(remote_url, f"{stub_url}{stub_path}")
+            for service in model.objects.filter(pk__in=pks):
+                service.xml_backup_file = SimpleUploadedFile(
+                    "capabilities.xml", capabilities.encode("UTF-8"))
+                service.save()
+        AllowedWebMapServiceOperation.objects.filter(secured_service__pk=UNSECURED_WMS).delete()
+
+    def get_request(self, scenario: str) -> dict:
+        """Return the arguments of :meth:`django.test.Client.generic` for the given scenario."""
+        with Image.open(TEST_DATA / "karte_rp.fcgi.png") as image:
+            width, height = image.size
+        get_map = {
+            "VERSION": "1.3.0", "REQUEST": "GetMap", "SERVICE": "WMS", "LAYERS": "node1", "STYLES": "",
+            "CRS": "EPSG:4326", "WIDTH": width, "HEIGHT": height, "FORMAT": "image/png", "TRANSPARENT": "TRUE",
+        }
+        if scenario == "unsecured":
+            return {"method": "GET", "path": f"/mrmap-proxy/wms/{UNSECURED_WMS}", "data": {**get_map, "BBOX": INTERSECTING_BBOX}}
+        if scenario == "get-feature-info":
+            return {"method": "GET", "path": f"/mrmap-proxy/wms/{SECURED_WMS}", "data": {
+                **get_map, "REQUEST": "GetFeatureInfo", "QUERY_LAYERS": "node1", "INFO_FORMAT": "text/xml",
+                "I": width // 2, "J": height // 2, "BBOX": INTERSECTING_BBOX}}
+        if scenario == "get-feature":
+            return {"method": "POST", "path": f"/mrmap-proxy/wfs/{SECURED_WFS}",
+                    "data": (TEST_DATA / "xml_requests" / "get_feature_2.0.0.xml").read_bytes(),
+                    "content_type": "application/xml"}
+        bbox = {"secured-covered": COVERED_BBOX, "secured-intersecting": INTERSECTING_BBOX,
+                "secured-disjoint": DISJOINT_BBOX}[scenario]
+        return {"method": "GET", "path": f"/mrmap-proxy/wms/{SECURED_WMS}", "data": {**get_map, "BBOX": bbox}}
+
+    def send(self, client: Client, request: dict) -> int:
+        if request["method"] == "GET":
+            response = client.get(request["path"], request["data"])
+        else:
+            response = client.post(request["path"], data=request["data"], content_type=request["content_type"])
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        response.close()
+        return response.status_code
+
+    def get_client(self) -> Client:
+        client = Client()
+        client.force_login(User.objects.get(username="User1"))
+        return client
+
+    def run(self, request: dict, concurrency: int, count: int) -> dict:
+        """Send ``count`` requests from ``concurrency`` clients in parallel and return throughput and latencies."""
+        latencies, status_codes = [], {}
+        lock = threading.Lock()
+        remaining = [count]
+
+        def work():
+            client = self.get_client()
+            try:
+                while True:
+                    with lock:
+                        if remaining[0] <= 0:
+                            return
+                        remaining[0] -= 1
+                    start = time.perf_counter()
+                    status_code = self.send(client=client, request=request)
+                    latency = (time.perf_counter() - start) * 1000
+                    with lock:
+                        latencies.append(latency)
+                        status_codes[str(status_code)] = status_codes.get(str(status_code), 0) + 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - start
+
+        percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        return {
+            "requests": len(latencies),
+            "duration_s": round(duration, 3),
+            "rps": len(latencies) / duration if duration else 0,
+            "latency_ms": {
+                "mean": statistics.mean(latencies) if latencies else 0,
+                "p50": percentiles[49] if percentiles else 0,
+                "p95": percentiles[94] if percentiles else 0,
+                "p99": percentiles[98] if percentiles else 0,
+                "max": max(latencies, default=0),
+            },
+            "status_codes": status_codes,
+        }
+
+    def profile(self, request: dict, count: int, top: int = 10) -> dict:
+        """Trace the allocations of ``count`` sequential requests; the tracing is too slow for the timed runs."""
+        client = self.get_client()
+        tracemalloc.start(10)
+        try:
+            before = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            for _ in range(count):
+                self.send(client=client, request=request)
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        statistics_by_line = after.compare_to(before, "lineno")
+        return {
+            "requests": count,
+            "peak_kib": round(peak / 1024, 1),
+            "retained_kib_per_request": round(sum(stat.size_diff for stat in statistics_by_line) / 1024 / count, 1),
+            "top": [
+                {
+                    "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    "size_diff_kib": round(stat.size_diff / 1024, 1),
+                    "count_diff": stat.count_diff,
+                }
+                for stat in statistics_by_line[:top]
+            ],
+        }
@@ -0,0 +1,81 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.gis.db.models import Union
+from django.contrib.gis.geos import Polygon
+from django.core.management import BaseCommand, CommandError
+from registry.models.security import AllowedWebMapServiceOperation
+from registry.proxy.security_mask import (fetch_security_mask_from_mapserver,
+                                          render_security_mask)
+
+
+class Command(BaseCommand):
+    help = "Compares the latency of the native security mask renderer with the mapserver round-trip for a secured wms."
+
+    def add_arguments(self, parser):
+        parser.add_argument("service", help="primary key of the secured web map service")
+        parser.add_argument("--bbox", default="-180,-90,180,90",
+                            help="requested bbox in x/y axis order: minx,miny,maxx,maxy")
+        parser.add_argument("--srid", type=int, default=4326,
+                            help="epsg code of the requested bbox")
+        parser.add_argument("--width", type=int, default=1024)
+        parser.add_argument("--height", type=int, default=1024)
+        parser.add_argument("--repetitions", type=int, default=50)
+
+    def handle(self, *args, **options):
+        allowed_operations = AllowedWebMapServiceOperation.objects.filter(
+            secured_service__pk=options["service"], allowed_area__isnull=False)
+        allowed_area_pks = list(allowed_operations.values_list("pk", flat=True))
+        if not allowed_area_pks:
+            raise CommandError(
+                "the given service has no spatial secured operations.")
+        allowed_area = allowed_operations.aggregate(
+            union=Union("allowed_area"))["union"]
+
+        try:
+            bbox = Polygon.from_bbox(
+                [float(value) for value in options["bbox"].split(",")])
+        except ValueError:
+            raise CommandError("bbox needs to be like minx,miny,maxx,maxy")
+        bbox.srid = options["srid"]
+        width, height = options["width"], options["height"]
+
+        self._report("native", self._measure(
+            lambda: render_security_mask(
+                allowed_area=allowed_area, bbox=bbox, width=width, height=height),
+            options["repetitions"]))
+
+        if not settings.MAPSERVER_URL:
+            self.stdout.write(self.style.WARNING(
+                "MAPSERVER_URL is not configured; skip mapserver backend."))
+            return
+        # wms 1.1.1 uses x/y axis order for all reference systems, so both backends get the same bbox
+        query_params = {
+            "VERSION": "1.1.1",
+            "SRS": f"EPSG:{options['srid']}",
+            "BBOX": options["bbox"],
+        }
+        self._report("mapserver", self._measure(
+            lambda: fetch_security_mask_from_mapserver(
+                query_params=query_params, allowed_area_pks=allowed_area_pks, width=width, height=height),
+            options["repetitions"]))
+
+    @staticmethod
+    def _measure(func, repetitions):
+        # warm up; the first call pays for lazy imports, proj setup and connection establishment
+        func()
+        timings = []
+        for _ in range(repetitions):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    def _report(self, backend, timings):
+        timings = sorted(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(self.style.SUCCESS(
+            f"{backend}: mean {statistics.mean(timings):.2f} ms, median {statistics.median(timings):.2f} ms, "
+            f"p95 {p95:.2f} ms, max {timings[-1]:.2f} ms ({len(timings)} runs)"
+        ))
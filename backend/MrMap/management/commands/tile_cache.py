@@ -0,0 +1,114 @@
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.core.management import BaseCommand, CommandError
+from ows_lib.models.ogc_request import OGCRequest
+from registry.models.service import WebMapService
+from registry.proxy.tiles import (PUBLIC_TILES, TILE_FORMATS,
+                                  TILE_MATRIX_SETS, TileKey, get_map_params,
+                                  split_metatile, tile_cache)
+
+
+class Command(BaseCommand):
+    help = "Seeds or purges the cached tiles of the wmts/xyz facade for a layer of a registered web map service."
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest="action", required=True)
+
+        seed = subparsers.add_parser(
+            "seed", help="request the unrestricted tiles of a layer from the wms and store them in the tile cache")
+        seed.add_argument("service", help="primary key of the web map service")
+        seed.add_argument("layer", help="identifier of the layer")
+        seed.add_argument("--tile-matrix-set", default="WebMercatorQuad",
+                          choices=list(TILE_MATRIX_SETS.keys()))
+        seed.add_argument("--min-zoom", type=int, default=0)
+        seed.add_argument("--max-zoom", type=int, default=10)
+        seed.add_argument("--bbox", default=None,
+                          help="lon/lat bbox to seed: minx,miny,maxx,maxy; default is the bbox of the layer")
+        seed.add_argument("--format", default="png",
+                          choices=sorted(TILE_FORMATS.keys()))
+
+        purge = subparsers.add_parser(
+            "purge", help="remove the cached tiles of a service or of a single layer")
+        purge.add_argument("service", help="primary key of the web map service")
+        purge.add_argument("layer", nargs="?", default=None,
+                           help="identifier of the layer")
+
+    def handle(self, *args, **options):
+        if options["action"] == "purge":
+            tile_cache.purge(
+                service_pk=options["service"], layer=options["layer"])
+            self.stdout.write(self.style.SUCCESS("tiles purged"))
+            return
+
+        try:
+            service = WebMapService.objects.get(pk=options["service"])
+            layer = service.layers.get(identifier=options["layer"])
+        except (WebMapService.DoesNotExist, service.layers.model.DoesNotExist):
+            raise CommandError("the given service or layer does not exist.")
+
+        if options["bbox"]:
+            try:
+                bbox = Polygon.from_bbox(
+                    [float(value) for value in options["bbox"].split(",")])
+            except ValueError:
+                raise CommandError("bbox needs to be like minx,miny,maxx,maxy")
+            bbox.srid = 4326
+        elif layer.bbox_lat_lon:
+            bbox = layer.bbox_lat_lon.clone()
+        else:
+            bbox = Polygon.from_bbox((-180, -90, 180, 90))
+            bbox.srid = 4326
+
+        tile_matrix_set = TILE_MATRIX_SETS[options["tile_matrix_set"]]
+        if tile_matrix_set.crs != 4326:
+            # web mercator is not defined at the poles
+            min_x, min_y, max_x, max_y = bbox.extent
+            bbox = Polygon.from_bbox(
+                (min_x, max(min_y, -85.0511), max_x, min(max_y, 85.0511)))
+            bbox.srid = 4326
+            bbox.transform(tile_matrix_set.crs)
+        mime_type = TILE_FORMATS[options["format"]]
+        meta_size = settings.PROXY_TILE_METATILE_SIZE
+        client = service.client
+        seeded = 0
+
+        for zoom in range(options["min_zoom"], min(options["max_zoom"], settings.PROXY_TILE_MAX_ZOOM) + 1):
+            min_col, max_col, min_row, max_row = tile_matrix_set.get_tile_range(
+                zoom=zoom, bbox=bbox.extent)
+            for meta_row in range(min_row // meta_size * meta_size, max_row + 1, meta_size):
+                for meta_col in range(min_col // meta_size * meta_size, max_col + 1, meta_size):
+                    _, _, cols, rows = tile_matrix_set.get_metatile(
+                        zoom=zoom, col=meta_col, row=meta_row, meta_size=meta_size)
+                    request = client.bypass_request(request=OGCRequest(
+                        method="GET",
+                        url=service.service_url,
+                        params=get_map_params(
+                            version=service.version,
+                            layer=layer.identifier,
+                            tile_matrix_set=tile_matrix_set,
+                            bbox=tile_matrix_set.get_bbox(
+                                zoom=zoom, col=meta_col, row=meta_row, cols=cols, rows=rows),
+                            width=cols * tile_matrix_set.tile_size,
+                            height=rows * tile_matrix_set.tile_size,
+                            mime_type=mime_type),
+                    ))
+                    response = client.session.send(
+                        request=request.prepare(),
+                        timeout=getattr(client.session, "timeout", settings.PROXY_UPSTREAM_TIMEOUT))
+                    if response.status_code != 200 or not response.headers.get("content-type", "").startswith("image/"):
+                        self.stderr.write(
+                            f"zoom {zoom}, col {meta_col}, row {meta_row}: the wms responded with "
+                            f"{response.status_code} {response.headers.get('content-type')}")
+                        continue
+                    tiles = split_metatile(content=response.content, cols=cols, rows=rows,
+                                           tile_size=tile_matrix_set.tile_size, mime_type=mime_type)
+                    tile_cache.set_many(tiles={
+                        TileKey(service_pk=service.pk, layer=layer.identifier, security_key=PUBLIC_TILES,
+                                tile_matrix_set=tile_matrix_set.identifier, zoom=zoom, col=meta_col + col,
+                                row=meta_row + row, extension=mime_type.split("/")[-1]): tile
+                        for (col, row), tile in tiles.items()
+                    })
+                    seeded += len(tiles)
+            self.stdout.write(f"zoom {zoom} seeded")
+
+        self.stdout.write(self.style.SUCCESS(f"{seeded} tiles seeded"))
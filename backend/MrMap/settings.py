@@ -107,6 +107,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    # compresses the response body, so it needs to be the outermost middleware which changes the body
+    "registry.proxy.compression.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.locale.LocaleMiddleware",
@@ -429,9 +431,9 @@ MAPSERVER_URL = os.environ.get("MAPSERVER_URL")
 MAPSERVER_SECURITY_MASK_FILE_PATH = os.environ.get(
     "MAPSERVER_SECURITY_MASK_FILE_PATH"
 )  # path on the machine which provides the mapserver service
-MAPSERVER_SECURITY_MASK_TABLE = "registry_allowedwebmapserviceoperation"
-MAPSERVER_SECURITY_MASK_GEOMETRY_COLUMN = "allowed_area"
-MAPSERVER_SECURITY_MASK_KEY_COLUMN = "id"
+MAPSERVER_SECURITY_MASK_TABLE = "registry_allowedwebmapserviceoperationareapart"
+MAPSERVER_SECURITY_MASK_GEOMETRY_COLUMN = "geom"
+MAPSERVER_SECURITY_MASK_KEY_COLUMN = "allowed_operation_id"
 
 DEFAULT_SRS = 4326
 FONT_IMG_RATIO = 1 / 20  # Font to image ratio
@@ -443,6 +445,179 @@ ERROR_MASK_TXT = (
     "Error during mask creation! \nCheck the configuration of security_mask.map!"
 )
 
+################################################################
+# Security proxy
+################################################################
+# How many parsed capabilities documents and ready to use clients are cached per process
+PROXY_CAPABILITIES_CACHE_SIZE = int(
+    os.environ.get("MRMAP_PROXY_CAPABILITIES_CACHE_SIZE", 128))
+# Max seconds the decrypted credentials of authenticated services are cached per process; changes of the
+# authentication invalidate them immediately
+PROXY_CREDENTIALS_CACHE_TIMEOUT = int(
+    os.environ.get("MRMAP_PROXY_CREDENTIALS_CACHE_TIMEOUT", 300))
+# Max seconds the clients of services with their upstream sessions are cached per process; changes of the service,
+# its authentication or its proxy setting invalidate them immediately in the changing process only
+PROXY_CLIENT_CACHE_TIMEOUT = int(
+    os.environ.get("MRMAP_PROXY_CLIENT_CACHE_TIMEOUT", 300))
+# Max seconds a rendered capabilities document is cached; changes of the service invalidate it immediately
+PROXY_CAPABILITIES_RENDER_CACHE_TIMEOUT = int(
+    os.environ.get("MRMAP_PROXY_CAPABILITIES_RENDER_CACHE_TIMEOUT", 86400))
+# Decide security questions against compiled in memory policy snapshots instead of the database
+PROXY_SECURITY_POLICY_SNAPSHOT = os.environ.get(
+    "MRMAP_PROXY_SECURITY_POLICY_SNAPSHOT", "True") == "True"
+# Redis pub/sub channel to invalidate the policy snapshots of all processes
+PROXY_SECURITY_POLICY_CHANNEL = "mrmap:security-policy"
+# Max age of a policy snapshot in seconds; fallback if invalidation messages are lost
+PROXY_SECURITY_POLICY_MAX_AGE = int(
+    os.environ.get("MRMAP_PROXY_SECURITY_POLICY_MAX_AGE", 300))
+# Tolerance in units of the crs of the allowed areas to simplify the spatial filters of secured GetFeature requests;
+# 0 disables the simplification. Simplified filters may differ from the allowed areas by up to the tolerance.
+PROXY_WFS_FILTER_SIMPLIFY_TOLERANCE = float(
+    os.environ.get("MRMAP_PROXY_WFS_FILTER_SIMPLIFY_TOLERANCE", 0))
+# Tolerances in units of the allowed areas (degrees of EPSG:4326) of the simplified allowed area pyramid. Security
+# masks are rendered from the most simplified allowed area, which differs at most half a pixel from the original.
+PROXY_ALLOWED_AREA_TOLERANCES = [float(tolerance) for tolerance in os.environ.get(
+    "MRMAP_PROXY_ALLOWED_AREA_TOLERANCES", "0.00001,0.0001,0.001,0.01").split(",") if tolerance.strip()]
+# Max vertices of the parts allowed areas are subdivided in for indexed spatial tests
+PROXY_ALLOWED_AREA_SUBDIVIDE_MAX_VERTICES = int(
+    os.environ.get("MRMAP_PROXY_ALLOWED_AREA_SUBDIVIDE_MAX_VERTICES", 256))
+# Backend which renders the security masks: "native" rasterizes the allowed areas in process, "mapserver" requests
+# them from MAPSERVER_URL. The native backend falls back to the mapserver if it fails and MAPSERVER_URL is set.
+PROXY_SECURITY_MASK_BACKEND = os.environ.get(
+    "MRMAP_PROXY_SECURITY_MASK_BACKEND", "native")
+# How many pooled keep-alive sessions to upstream hosts are kept per process
+PROXY_UPSTREAM_SESSIONS_SIZE = int(
+    os.environ.get("MRMAP_PROXY_UPSTREAM_SESSIONS_SIZE", 128))
+# Default max connections per upstream host; can be overwritten by the proxy setting of a service
+PROXY_UPSTREAM_MAX_CONNECTIONS = int(
+    os.environ.get("MRMAP_PROXY_UPSTREAM_MAX_CONNECTIONS", 20))
+# Default timeout in seconds for upstream requests; can be overwritten by the proxy setting of a service
+PROXY_UPSTREAM_TIMEOUT = int(
+    os.environ.get("MRMAP_PROXY_UPSTREAM_TIMEOUT", 10))
+# Chunk size in bytes to stream upstream responses to the client
+PROXY_STREAM_CHUNK_SIZE = int(
+    os.environ.get("MRMAP_PROXY_STREAM_CHUNK_SIZE", 64 * 1024))
+# Max bytes of a streamed response, which are held in memory for logging before spooling to disk
+PROXY_LOG_SPOOL_MAX_MEMORY = int(
+    os.environ.get("MRMAP_PROXY_LOG_SPOOL_MAX_MEMORY", 1024 * 1024))
+# Serve the security proxy by asyncio views; only useful if MrMap runs as asgi application
+PROXY_ASYNC_VIEWS = os.environ.get(
+    "MRMAP_PROXY_ASYNC_VIEWS", "False") == "True"
+# Encoder settings for secured map images
+PROXY_PNG_COMPRESS_LEVEL = int(
+    os.environ.get("MRMAP_PROXY_PNG_COMPRESS_LEVEL", 3))
+PROXY_JPEG_QUALITY = int(os.environ.get("MRMAP_PROXY_JPEG_QUALITY", 80))
+# Size of the per process queue of request/response logs; 0 writes the logs synchronously on the request path
+PROXY_LOG_QUEUE_SIZE = int(os.environ.get("MRMAP_PROXY_LOG_QUEUE_SIZE", 1000))
+# What happens if the log queue is full: "drop" the log or "block" the request up to PROXY_LOG_QUEUE_TIMEOUT seconds
+PROXY_LOG_QUEUE_POLICY = os.environ.get("MRMAP_PROXY_LOG_QUEUE_POLICY", "drop")
+PROXY_LOG_QUEUE_TIMEOUT = float(
+    os.environ.get("MRMAP_PROXY_LOG_QUEUE_TIMEOUT", 0.05))
+# Max count of logs per bulk insert and max seconds to wait for a batch to fill up
+PROXY_LOG_BATCH_SIZE = int(os.environ.get("MRMAP_PROXY_LOG_BATCH_SIZE", 100))
+PROXY_LOG_FLUSH_INTERVAL = float(
+    os.environ.get("MRMAP_PROXY_LOG_FLUSH_INTERVAL", 1))
+# Answer GetMap requests outside the scale range or extent of all requested layers with an empty image and requests
+# with a crs the layers do not support with an exception, without requesting the remote service
+PROXY_GET_MAP_PREFLIGHT = os.environ.get(
+    "MRMAP_PROXY_GET_MAP_PREFLIGHT", "False") == "True"
+# Relative tolerance of the scale ranges and extents of the preflight; remote services may compute the scale with
+# another pixel size than the standardized 0.28mm, like 72 dpi
+PROXY_GET_MAP_PREFLIGHT_TOLERANCE = float(
+    os.environ.get("MRMAP_PROXY_GET_MAP_PREFLIGHT_TOLERANCE", 0.3))
+# Reduce the requested layers of GetMap and GetFeatureInfo requests to the layers the requesting user may request,
+# instead of denying the whole request; GetMap requests without any allowed layer are answered with an empty image
+PROXY_GET_MAP_LAYER_FILTER = os.environ.get(
+    "MRMAP_PROXY_GET_MAP_LAYER_FILTER", "False") == "True"
+# Coalesce identical concurrent GET requests of these operations to one upstream request; optional across processes.
+# Only responses which are read completely anyway, like secured responses, are coalesced; streamed ones are not
+PROXY_SINGLE_FLIGHT = os.environ.get(
+    "MRMAP_PROXY_SINGLE_FLIGHT", "True") == "True"
+PROXY_SINGLE_FLIGHT_REDIS = os.environ.get(
+    "MRMAP_PROXY_SINGLE_FLIGHT_REDIS", "False") == "True"
+PROXY_SINGLE_FLIGHT_OPERATIONS = [operation.strip().lower() for operation in os.environ.get(
+    "MRMAP_PROXY_SINGLE_FLIGHT_OPERATIONS", "GetMap,GetCapabilities,GetLegendGraphic,GetFeatureInfo").split(",")]
+# Send a second identical request, if an upstream request of these idempotent operations is slower than the
+# PROXY_HEDGE_PERCENTILE of the recent latencies of the same service and operation; the first response wins
+PROXY_HEDGE = os.environ.get("MRMAP_PROXY_HEDGE", "False") == "True"
+PROXY_HEDGE_OPERATIONS = [operation.strip().lower() for operation in os.environ.get(
+    "MRMAP_PROXY_HEDGE_OPERATIONS", "GetMap,GetFeatureInfo,GetCapabilities,GetFeature").split(",")]
+PROXY_HEDGE_PERCENTILE = float(
+    os.environ.get("MRMAP_PROXY_HEDGE_PERCENTILE", 95))
+# Max share of hedged requests per service and operation and the max count of hedges in a burst
+PROXY_HEDGE_BUDGET = float(os.environ.get("MRMAP_PROXY_HEDGE_BUDGET", 0.05))
+PROXY_HEDGE_BUDGET_BURST = float(
+    os.environ.get("MRMAP_PROXY_HEDGE_BUDGET_BURST", 10))
+# How many latencies of a service and operation need to be recorded, before its requests are hedged
+PROXY_HEDGE_MIN_SAMPLES = int(
+    os.environ.get("MRMAP_PROXY_HEDGE_MIN_SAMPLES", 20))
+# Max threads per process, which send the first request of hedgeable requests; requests which can't be hedged are
+# sent on the request thread
+PROXY_HEDGE_MAX_WORKERS = int(
+    os.environ.get("MRMAP_PROXY_HEDGE_MAX_WORKERS", 16))
+# Max concurrent requests per upstream host and process; shared by all processes through redis if
+# PROXY_UPSTREAM_CONCURRENCY_REDIS is set, so the limit needs to be raised for the whole deployment then.
+# Requests wait up to PROXY_UPSTREAM_QUEUE_TIMEOUT seconds for a free slot. 0 disables the limit.
+PROXY_UPSTREAM_CONCURRENCY_LIMIT = int(
+    os.environ.get("MRMAP_PROXY_UPSTREAM_CONCURRENCY_LIMIT", 32))
+PROXY_UPSTREAM_CONCURRENCY_REDIS = os.environ.get(
+    "MRMAP_PROXY_UPSTREAM_CONCURRENCY_REDIS", "False") == "True"
+PROXY_UPSTREAM_QUEUE_TIMEOUT = float(
+    os.environ.get("MRMAP_PROXY_UPSTREAM_QUEUE_TIMEOUT", 1))
+# Answer requests of a service with ServiceUnavailable for PROXY_CIRCUIT_BREAKER_RESET_TIMEOUT seconds, after it failed
+# PROXY_CIRCUIT_BREAKER_THRESHOLD times within PROXY_CIRCUIT_BREAKER_WINDOW seconds by timeouts or 5xx responses
+PROXY_CIRCUIT_BREAKER = os.environ.get(
+    "MRMAP_PROXY_CIRCUIT_BREAKER", "True") == "True"
+PROXY_CIRCUIT_BREAKER_THRESHOLD = int(
+    os.environ.get("MRMAP_PROXY_CIRCUIT_BREAKER_THRESHOLD", 5))
+PROXY_CIRCUIT_BREAKER_WINDOW = float(
+    os.environ.get("MRMAP_PROXY_CIRCUIT_BREAKER_WINDOW", 30))
+PROXY_CIRCUIT_BREAKER_RESET_TIMEOUT = float(
+    os.environ.get("MRMAP_PROXY_CIRCUIT_BREAKER_RESET_TIMEOUT", 30))
+# Tile cache of the wmts/xyz facade: "filesystem" stores tiles below MEDIA_ROOT/tiles, "redis" in a redis database
+PROXY_TILE_CACHE = {
+    "filesystem": {
+        "BACKEND": "registry.proxy.tiles.FileSystemTileCache",
+        "LOCATION": os.environ.get("MRMAP_PROXY_TILE_CACHE_LOCATION", f"{MEDIA_ROOT}/tiles"),
+    },
+    "redis": {
+        "BACKEND": "registry.proxy.tiles.RedisTileCache",
+        "LOCATION": os.environ.get("MRMAP_PROXY_TILE_CACHE_LOCATION", f"{BROKER_URL}/2"),
+    },
+}[os.environ.get("MRMAP_PROXY_TILE_CACHE_BACKEND", "filesystem")]
+# Seconds until a cached tile expires; 0 keeps tiles until they are purged
+PROXY_TILE_CACHE["TIMEOUT"] = int(
+    os.environ.get("MRMAP_PROXY_TILE_CACHE_TIMEOUT", 7 * 24 * 60 * 60))
+# Tiles are requested from the wms in metatiles of n x n tiles, which are split and cached at once
+PROXY_TILE_METATILE_SIZE = int(
+    os.environ.get("MRMAP_PROXY_TILE_METATILE_SIZE", 4))
+PROXY_TILE_MAX_ZOOM = int(os.environ.get("MRMAP_PROXY_TILE_MAX_ZOOM", 20))
+# Record the durations of the phases of proxied requests as histograms, which are exposed in the prometheus format at
+# /mrmap-proxy/metrics for superusers or with the bearer token PROXY_METRICS_TOKEN. If PROXY_METRICS_REDIS is set, the
+# metrics of all processes are summed in redis every PROXY_METRICS_FLUSH_INTERVAL seconds; otherwise only the metrics
+# of the process which answers the scrape are exposed.
+PROXY_METRICS = os.environ.get("MRMAP_PROXY_METRICS", "True") == "True"
+PROXY_METRICS_REDIS = os.environ.get(
+    "MRMAP_PROXY_METRICS_REDIS", "False") == "True"
+PROXY_METRICS_FLUSH_INTERVAL = float(
+    os.environ.get("MRMAP_PROXY_METRICS_FLUSH_INTERVAL", 10))
+PROXY_METRICS_TOKEN = os.environ.get("MRMAP_PROXY_METRICS_TOKEN", "")
+# Send the phase durations of proxied requests as Server-Timing header
+PROXY_SERVER_TIMING = os.environ.get(
+    "MRMAP_PROXY_SERVER_TIMING", "False") == "True"
+# Compress text like responses of the ogc endpoints below PROXY_COMPRESSION_PATHS, which are not compressed by the
+# remote service. The first content coding of PROXY_COMPRESSION_ENCODINGS, which the client accepts, is used.
+PROXY_COMPRESSION = os.environ.get("MRMAP_PROXY_COMPRESSION", "True") == "True"
+PROXY_COMPRESSION_ENCODINGS = [encoding.strip().lower() for encoding in os.environ.get(
+    "MRMAP_PROXY_COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",") if encoding.strip()]
+PROXY_COMPRESSION_PATHS = ["/mrmap-proxy/", "/csw"]
+# Responses smaller than this are not worth to compress; streamed responses are always compressed
+PROXY_COMPRESSION_MIN_SIZE = int(
+    os.environ.get("MRMAP_PROXY_COMPRESSION_MIN_SIZE", 1024))
+# Max concurrent upstream GetMap requests of the virtual wms per process, shared by all virtual GetMap requests
+PROXY_VIRTUAL_WMS_MAX_WORKERS = int(
+    os.environ.get("MRMAP_PROXY_VIRTUAL_WMS_MAX_WORKERS", 16))
+
 
 LOG_DIR = os.environ.get(
     "MRMAP_LOG_DIR", "/var/log/mrmap")
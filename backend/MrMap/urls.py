@@ -18,13 +18,18 @@ from accounts.views.auth import LoginView, LogoutView
 from csw.views import CswServiceView
 from django.conf import settings
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
 from django.views.decorators.cache import cache_page
 from drf_spectacular.views import (SpectacularJSONAPIView,
                                    SpectacularSwaggerView)
 from mapbender_compatibility.views import MapBenderSearchApi
-from registry.proxy.wfs_proxy import WebFeatureServiceProxy
-from registry.proxy.wms_proxy import WebMapServiceProxy
+from registry.proxy.metrics_view import ProxyMetricsView
+from registry.proxy.tile_proxy import WebMapTileServiceProxy
+from registry.proxy.virtual_wms_proxy import VirtualWebMapServiceProxy
+from registry.proxy.wfs_proxy import (AsyncWebFeatureServiceProxy,
+                                      WebFeatureServiceProxy)
+from registry.proxy.wms_proxy import (AsyncWebMapServiceProxy,
+                                      WebMapServiceProxy)
 from registry.views_ows.mapcontext import OwsContextView
 
 urlpatterns = [
@@ -48,11 +53,32 @@ urlpatterns = [
          SpectacularSwaggerView.as_view(url_name='openapi-schema'), name='swagger-ui'),
     # ows views
     path("mrmap-proxy/wms/<pk>",
-         WebMapServiceProxy.as_view(),
+         (AsyncWebMapServiceProxy if settings.PROXY_ASYNC_VIEWS
+          else WebMapServiceProxy).as_view(),
          name="wms-operation"),
     path("mrmap-proxy/wfs/<pk>",
-         WebFeatureServiceProxy.as_view(),
+         (AsyncWebFeatureServiceProxy if settings.PROXY_ASYNC_VIEWS
+          else WebFeatureServiceProxy).as_view(),
          name="wfs-operation"),
+    path("mrmap-proxy/wmts/<pk>",
+         WebMapTileServiceProxy.as_view(),
+         name="wmts-operation"),
+    path("mrmap-proxy/wmts/<pk>/1.0.0/WMTSCapabilities.xml",
+         WebMapTileServiceProxy.as_view(),
+         {"capabilities": True},
+         name="wmts-capabilities"),
+    re_path(r"^mrmap-proxy/wmts/(?P<pk>[^/]+)/(?P<layer>[^/]+)/(?P<tile_matrix_set>[^/]+)/(?P<zoom>\d+)/(?P<row>\d+)/(?P<col>\d+)\.(?P<extension>\w+)$",
+            WebMapTileServiceProxy.as_view(),
+            name="wmts-tile"),
+    re_path(r"^mrmap-proxy/xyz/(?P<pk>[^/]+)/(?P<layer>[^/]+)/(?P<zoom>\d+)/(?P<col>\d+)/(?P<row>\d+)\.(?P<extension>\w+)$",
+            WebMapTileServiceProxy.as_view(),
+            name="xyz-tile"),
+    path("mrmap-proxy/mapcontext/<pk>/wms",
+         VirtualWebMapServiceProxy.as_view(),
+         name="virtual-wms-operation"),
+    path("mrmap-proxy/metrics",
+         ProxyMetricsView.as_view(),
+         name="proxy-metrics"),
     path("mrmap-proxy/ows/<pk>",
          OwsContextView.as_view(),
          name="ows-context-detail"),
@@ -1,12 +1,13 @@
 from abc import ABC
 from typing import Any, List, Tuple
 
+from django.conf import settings
 from django.contrib.auth.models import Group
-from django.contrib.gis.db.models import Union
+from django.contrib.gis.db.models import GeometryField, Union
 from django.contrib.postgres.aggregates import ArrayAgg
 from django.contrib.postgres.expressions import ArraySubquery
-from django.db import models
-from django.db.models import (BooleanField, Exists, ExpressionWrapper, F,
+from django.db import connections, models
+from django.db.models import (BooleanField, Count, Exists, ExpressionWrapper, F,
                               OuterRef, QuerySet, Subquery)
 from django.db.models import Value as V
 from django.db.models.expressions import Value
@@ -100,21 +101,58 @@ class AllowedWebMapServiceOperationQuerySet(AllowedOgcServiceOperationQuerySet):
     def get_entity_identifiers(self, request):
         return "secured_layers__identifier__iexact", request.requested_entities
 
+    def filter_by_requested_entity(self, request):
+        """Collects only the AllowedWebMapServiceOperation objects which secure all requested layers, directly or by
+        one of their ancestor layers.
+
+        All requested layers are looked up at once in the effective layers of the allowed operations, instead of
+        joining the secured layers once per requested layer.
+        """
+        identifiers = {identifier.lower()
+                       for identifier in request.requested_entities if identifier}
+        if not identifiers:
+            return super().filter_by_requested_entity(request=request)
+        effective_layer_model = self.model.effective_layers.rel.related_model
+        return self.filter(
+            pk__in=effective_layer_model.objects.filter(
+                identifier__in=identifiers,
+            ).values("allowed_operation").annotate(
+                identifier_count=Count("identifier", distinct=True),
+            ).filter(
+                identifier_count=len(identifiers),
+            ).values("allowed_operation")
+        )
+
     def is_spatial_secured_and_covers(self, service_pk, request: HttpRequest) -> Exists:
+        """checks if any allowed area of the user for the requested layers covers the requested bbox
+
+        Only the full resolution parts of an allowed area which overlap the bbox are united and tested, instead of the
+        whole allowed area.
+        """
+        area_part_model = self.model.area_parts.rel.related_model
         return Exists(
-            self.filter(
-                secured_service__pk=service_pk,
-                allowed_area__covers=request.bbox,
+            self.get_allowed_areas(service_pk=service_pk, request=request).annotate(
+                local_allowed_area=Subquery(
+                    area_part_model.objects.filter(
+                        allowed_operation=OuterRef("pk"),
+                        tolerance=0,
+                        geom__bboverlaps=request.bbox,
+                    ).values("allowed_operation").annotate(geom=Union("geom")).values("geom"),
+                    output_field=GeometryField(),
+                )
+            ).filter(
+                local_allowed_area__covers=request.bbox,
             )
         )
 
     def is_spatial_secured_and_intersects(
         self, service_pk, request: HttpRequest
     ) -> Exists:
+        """checks if any allowed area of the user for the requested layers intersects the requested bbox"""
         return Exists(
-            self.filter(
-                secured_service__pk=service_pk,
-                allowed_area__intersects=request.bbox,
+            self.get_allowed_areas(service_pk=service_pk, request=request).filter(
+                area_part__tolerance=0,
+                area_part__geom__intersects=request.bbox,
             )
         )
 
@@ -124,7 +162,120 @@ class AllowedWebFeatureServiceOperationQuerySet(AllowedOgcServiceOperationQueryS
         return "secured_feature_types__identifier__iexact", request.requested_entities
 
 
-class WebMapServiceSecurityManager(models.Manager):
+class AllowedAreaPartQuerySet(models.QuerySet):
+
+    def rebuild(self, allowed_operation_pks: List[int]) -> None:
+        """Replace the parts of the given allowed operations by new parts of their current allowed areas.
+
+        Every allowed area is simplified by all tolerances of ``settings.PROXY_ALLOWED_AREA_TOLERANCES`` and
+        subdivided by ``ST_Subdivide`` into polygons with at most ``settings.PROXY_ALLOWED_AREA_SUBDIVIDE_MAX_VERTICES``
+        vertices. The full resolution is stored with tolerance ``0``.
+        """
+        if not allowed_operation_pks:
+            return
+        part_table = self.model._meta.db_table
+        allowed_operation_model = self.model._meta.get_field(
+            "allowed_operation").related_model
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM "{part_table}" WHERE allowed_operation_id = ANY(%s)', [list(allowed_operation_pks)])
+            cursor.execute(
+                f"""
+                INSERT INTO "{part_table}" (allowed_operation_id, tolerance, geom)
+                SELECT allowed_operation.id, tolerance.value, dumped.geom
+                FROM "{allowed_operation_model._meta.db_table}" allowed_operation
+                CROSS JOIN unnest(%s::double precision[]) AS tolerance(value)
+                CROSS JOIN LATERAL ST_Subdivide(
+                    CASE WHEN tolerance.value = 0 THEN allowed_operation.allowed_area
+                    ELSE ST_SimplifyPreserveTopology(allowed_operation.allowed_area, tolerance.value) END,
+                    %s) AS part(geom)
+                CROSS JOIN LATERAL ST_Dump(part.geom) AS dumped
+                WHERE allowed_operation.id = ANY(%s)
+                AND allowed_operation.allowed_area IS NOT NULL
+                AND GeometryType(dumped.geom) = 'POLYGON'
+                """,
+                [[0, *settings.PROXY_ALLOWED_AREA_TOLERANCES],
+                 settings.PROXY_ALLOWED_AREA_SUBDIVIDE_MAX_VERTICES,
+                 list(allowed_operation_pks)])
+
+
+class EffectiveLayerQuerySet(models.QuerySet):
+
+    def get_layer_model(self):
+        return self.model._meta.get_field("layer").related_model
+
+    def add(self, allowed_operation_pk, secured_layer_pks: List) -> None:
+        """Add the given secured layers and all of their descendants as effective layers of the allowed operation."""
+        layer_model = self.get_layer_model()
+        subtrees = Q()
+        secured_layers = list(layer_model.objects.filter(pk__in=secured_layer_pks).values_list(
+            "pk", "mptt_tree_id", "mptt_lft", "mptt_rgt"))
+        if not secured_layers:
+            return
+        for _, tree, lft, rgt in secured_layers:
+            subtrees |= Q(mptt_tree_id=tree, mptt_lft__gte=lft, mptt_rgt__lte=rgt)
+        layers = list(layer_model.objects.filter(subtrees).values_list(
+            "pk", "identifier", "mptt_tree_id", "mptt_lft", "mptt_rgt"))
+        self.bulk_create(
+            objs=[
+                self.model(
+                    allowed_operation_id=allowed_operation_pk,
+                    layer_id=layer_pk,
+                    derived_from_id=secured_layer_pk,
+                    identifier=identifier.lower() if identifier else None)
+                for secured_layer_pk, tree, lft, rgt in secured_layers
+                for layer_pk, identifier, _tree, _lft, _rgt in layers
+                if _tree == tree and lft <= _lft and _rgt <= rgt
+            ],
+            ignore_conflicts=True)
+
+    def rebuild(self, allowed_operation_pks: List) -> None:
+        """Replace the effective layers of the given allowed operations by the subtrees of their secured layers."""
+        through_model = self.model._meta.get_field(
+            "allowed_operation").related_model.secured_layers.through
+        self.filter(allowed_operation__pk__in=allowed_operation_pks).delete()
+        secured_layer_pks = {}
+        for allowed_operation_pk, layer_pk in through_model.objects.using(self.db).filter(
+                allowedwebmapserviceoperation_id__in=allowed_operation_pks).values_list(
+                    "allowedwebmapserviceoperation_id", "layer_id"):
+            secured_layer_pks.setdefault(
+                allowed_operation_pk, []).append(layer_pk)
+        for allowed_operation_pk, layer_pks in secured_layer_pks.items():
+            self.add(allowed_operation_pk=allowed_operation_pk,
+                     secured_layer_pks=layer_pks)
+
+
+class SecurityPolicyManagerMixin:
+    """Resolves the security decisions against the in memory
+    :class:`registry.proxy.security_policy.SecurityPolicySnapshot` instead of the database."""
+
+    def get_with_security_policy(self, request: OGCRequest, *args: Any, **kwargs: Any):
+        if (
+            request.is_get_capabilities_request
+            or request.operation.lower() not in SECURE_ABLE_OPERATIONS_LOWER
+        ):
+            # there are no heavy security annotations for this requests
+            return self.get_with_security_info(request=request, *args, **kwargs)
+
+        from registry.proxy.security_policy import \
+            security_policy_registry  # to avoid circular import
+
+        service = (
+            self.get_queryset()
+            .select_related("auth")
+            .annotate(
+                camouflage=Coalesce(F("proxy_setting__camouflage"), V(False)),
+                log_response=Coalesce(
+                    F("proxy_setting__log_response"), V(False)),
+            )
+            .get(*args, **kwargs)
+        )
+        security_policy_registry.get(service=service).apply(
+            service=service, request=request)
+        return service
+
+
+class WebMapServiceSecurityManager(SecurityPolicyManagerMixin, models.Manager):
 
     def is_unknown_layer(self, service_pk, request: HttpRequest) -> QuerySet:
         return ~Exists(self.filter(pk=service_pk, layer__identifier__in=request.requested_entities))
@@ -192,7 +343,7 @@ class WebMapServiceSecurityManager(models.Manager):
         return self.prepare_with_security_info(request=request).get(*args, **kwargs)
 
 
-class WebFeatureServiceSecurityManager(models.Manager):
+class WebFeatureServiceSecurityManager(SecurityPolicyManagerMixin, models.Manager):
 
     def filter_by_requested_entity(self, request):
         """Collects only the AllowedWebMapServiceOperation objects where all requested_entities are part of."""
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0008_alter_harvestingjob_background_process_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webfeatureserviceproxysetting',
+            name='max_connections',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='the max count of parallel connections per proxy process to the remote service. If empty, the default of the mr. map instance is used.', null=True, verbose_name='max connections'),
+        ),
+        migrations.AddField(
+            model_name='webfeatureserviceproxysetting',
+            name='timeout',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='the timeout in seconds for requests to the remote service. If empty, the default of the mr. map instance is used.', null=True, verbose_name='timeout'),
+        ),
+        migrations.AddField(
+            model_name='webmapserviceproxysetting',
+            name='max_connections',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='the max count of parallel connections per proxy process to the remote service. If empty, the default of the mr. map instance is used.', null=True, verbose_name='max connections'),
+        ),
+        migrations.AddField(
+            model_name='webmapserviceproxysetting',
+            name='timeout',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='the timeout in seconds for requests to the remote service. If empty, the default of the mr. map instance is used.', null=True, verbose_name='timeout'),
+        ),
+    ]
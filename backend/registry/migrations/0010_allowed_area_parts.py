@@ -0,0 +1,70 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:37
+
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def rebuild_area_parts(apps, schema_editor):
+    # frozen copy of AllowedAreaPartQuerySet.rebuild() at the time of this migration
+    for allowed_operation_model_name, area_part_model_name in (
+        ("AllowedWebMapServiceOperation", "AllowedWebMapServiceOperationAreaPart"),
+        ("AllowedWebFeatureServiceOperation", "AllowedWebFeatureServiceOperationAreaPart"),
+    ):
+        allowed_operation_model = apps.get_model("registry", allowed_operation_model_name)
+        area_part_model = apps.get_model("registry", area_part_model_name)
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO "{area_part_model._meta.db_table}" (allowed_operation_id, tolerance, geom)
+                SELECT allowed_operation.id, tolerance.value, dumped.geom
+                FROM "{allowed_operation_model._meta.db_table}" allowed_operation
+                CROSS JOIN unnest(%s::double precision[]) AS tolerance(value)
+                CROSS JOIN LATERAL ST_Subdivide(
+                    CASE WHEN tolerance.value = 0 THEN allowed_operation.allowed_area
+                    ELSE ST_SimplifyPreserveTopology(allowed_operation.allowed_area, tolerance.value) END,
+                    %s) AS part(geom)
+                CROSS JOIN LATERAL ST_Dump(part.geom) AS dumped
+                WHERE allowed_operation.allowed_area IS NOT NULL
+                AND GeometryType(dumped.geom) = 'POLYGON'
+                """,
+                [[0, *settings.PROXY_ALLOWED_AREA_TOLERANCES],
+                 settings.PROXY_ALLOWED_AREA_SUBDIVIDE_MAX_VERTICES])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0009_proxysetting_max_connections_and_timeout'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllowedWebFeatureServiceOperationAreaPart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tolerance', models.FloatField(default=0)),
+                ('geom', django.contrib.gis.db.models.fields.PolygonField(srid=4326)),
+                ('allowed_operation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='area_parts', related_query_name='area_part', to='registry.allowedwebfeatureserviceoperation')),
+            ],
+            options={
+                'abstract': False,
+                'indexes': [models.Index(fields=['allowed_operation', 'tolerance'], name='registry_wfs_area_part_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='AllowedWebMapServiceOperationAreaPart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tolerance', models.FloatField(default=0)),
+                ('geom', django.contrib.gis.db.models.fields.PolygonField(srid=4326)),
+                ('allowed_operation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='area_parts', related_query_name='area_part', to='registry.allowedwebmapserviceoperation')),
+            ],
+            options={
+                'abstract': False,
+                'indexes': [models.Index(fields=['allowed_operation', 'tolerance'], name='registry_wms_area_part_idx')],
+            },
+        ),
+        migrations.RunPython(rebuild_area_parts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.2 on 2026-10-18 15:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def rebuild_effective_layers(apps, schema_editor):
+    # frozen copy of EffectiveLayerQuerySet.rebuild() at the time of this migration: the subtrees of all secured layers
+    allowed_operation_model = apps.get_model("registry", "AllowedWebMapServiceOperation")
+    effective_layer_model = apps.get_model("registry", "AllowedWebMapServiceOperationLayer")
+    layer_model = apps.get_model("registry", "Layer")
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO "{effective_layer_model._meta.db_table}" (allowed_operation_id, layer_id, derived_from_id, identifier)
+            SELECT secured.allowedwebmapserviceoperation_id, layer.id, secured_layer.id, LOWER(layer.identifier)
+            FROM "{allowed_operation_model.secured_layers.through._meta.db_table}" secured
+            JOIN "{layer_model._meta.db_table}" secured_layer ON secured_layer.id = secured.layer_id
+            JOIN "{layer_model._meta.db_table}" layer ON layer.mptt_tree_id = secured_layer.mptt_tree_id
+                AND layer.mptt_lft >= secured_layer.mptt_lft AND layer.mptt_rgt <= secured_layer.mptt_rgt
+            ON CONFLICT DO NOTHING
+            """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0010_allowed_area_parts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllowedWebMapServiceOperationLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('identifier', models.CharField(max_length=500, null=True)),
+                ('allowed_operation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='effective_layers', related_query_name='effective_layer', to='registry.allowedwebmapserviceoperation')),
+                ('derived_from', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='registry.layer')),
+                ('layer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='registry.layer')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['identifier', 'allowed_operation'], name='registry_effective_layer_idx')],
+                'constraints': [models.UniqueConstraint(fields=('allowed_operation', 'layer', 'derived_from'), name='registry_effective_layer_unique')],
+            },
+        ),
+        migrations.RunPython(rebuild_effective_layers, migrations.RunPython.noop),
+    ]
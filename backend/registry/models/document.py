@@ -1,4 +1,5 @@
 from abc import abstractmethod
+from typing import FrozenSet
 from warnings import warn
 
 from django.core.exceptions import ImproperlyConfigured
@@ -101,11 +102,32 @@ class CapabilitiesDocumentModelMixin(DocumentModelMixin):
         xml_object = mapper.update(destination_obj=self.xml_backup)
         return xml_object
 
-    def xml_secured(self, request: HttpRequest) -> str:
+    def hide_layers(self, capabilities_xml: XmlObject, visible_layer_identifiers: FrozenSet[str]) -> None:
+        """Remove all layers from the given capabilities document, which are not part of the given lower cased layer
+        identifiers. Parent layers of visible layers are kept, so the layer tree stays valid.
+        """
+        def prune(layer) -> bool:
+            visible = (layer.identifier or "").lower() in visible_layer_identifiers
+            for child in list(layer.children):
+                if prune(child):
+                    visible = True
+                else:
+                    child.node.getparent().remove(child.node)
+            return visible
+
+        root_layer = getattr(capabilities_xml, "root_layer", None)
+        if root_layer is not None:
+            # the root layer is mandatory; it stays, even if the user can not request it
+            prune(root_layer)
+
+    def xml_secured(self, request: HttpRequest, visible_layer_identifiers: FrozenSet[str] = None) -> str:
         path = reverse("wms-operation", args=[self.pk])
         new_url = f"{request.scheme}://{request.get_host()}{path}?"
 
         capabilities_xml = self.updated_capabilitites
+        if visible_layer_identifiers is not None:
+            self.hide_layers(capabilities_xml=capabilities_xml,
+                             visible_layer_identifiers=visible_layer_identifiers)
         # TODO: camouflage metadata urls also
         for operation_url in capabilities_xml.operation_urls:
             operation_url.url = new_url
@@ -118,13 +140,14 @@ class CapabilitiesDocumentModelMixin(DocumentModelMixin):
         # TODO: only support xml Exception format --> remove all others
         return capabilities_xml.serializeDocument()
 
-    def get_capabilitites_for_request(self, request: HttpRequest) -> str:
+    def get_capabilitites_for_request(self, request: HttpRequest, visible_layer_identifiers: FrozenSet[str] = None) -> str:
         """Returns the current version of the capabilities document.
 
             The values from the database overwrites the values inside the xml document.
+            If ``visible_layer_identifiers`` is passed, the camouflaged document lists only these layers.
         """
         if self.camouflage:
-            return self.xml_secured(request=request)
+            return self.xml_secured(request=request, visible_layer_identifiers=visible_layer_identifiers)
         else:
             return self.updated_capabilitites.serializeDocument()
 
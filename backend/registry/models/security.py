@@ -18,8 +18,11 @@ from extras.validators import geometry_is_empty
 from PIL import Image
 from registry.enums.service import (AuthTypeEnum, SecureableWFSOperationEnum,
                                     SecureableWMSOperationEnum)
+from registry.managers.security import (AllowedAreaPartQuerySet,
+                                        EffectiveLayerQuerySet)
 from registry.models.service import (CatalogueService, FeatureType, Layer,
                                      WebFeatureService, WebMapService)
+from registry.proxy.cache import credentials_cache
 from registry.tasks.security import async_analyze_log
 from requests.auth import HTTPDigestAuth
 
@@ -132,7 +135,23 @@ class ServiceAuthentication(models.Model):
             return username, password
         return None, None
 
+    @property
+    def credentials_cache_key(self) -> tuple:
+        """Return the key of the cached auth object.
+
+        The key contains the ciphered credentials and the key file, so it changes if the credentials are changed, even
+        if the cache entries of other processes are not invalidated by signals.
+        """
+        return (self.service_id, self.pk, self.key_file.name, self.auth_type, self.username, self.password)
+
     def get_auth_for_request(self):
+        """Return the auth object for :attr:`requests.Session.auth` from the per process credentials cache, so the key
+        file is not read and the credentials are not decrypted on every request."""
+        return credentials_cache.get_or_set(
+            key=self.credentials_cache_key,
+            default=self._get_auth_for_request)
+
+    def _get_auth_for_request(self):
         username, password = self.decrypt()
         if self.auth_type == AuthTypeEnum.BASIC.value:
             auth = (username, password)
@@ -322,6 +341,50 @@ class AllowedWebMapServiceOperation(AllowedOperation):
             )
 
 
+class AllowedWebMapServiceOperationLayer(models.Model):
+    """An effective permission of an :class:`AllowedWebMapServiceOperation` on a layer.
+
+    Securing a layer secures all of its sub layers. This table holds every layer of the subtrees of the secured layers,
+    so the layers an allowed operation grants access to can be looked up by one indexed query. The rows are maintained
+    by signals, if the secured layers of an allowed operation or the layer tree change.
+
+    :attr allowed_operation: the allowed operation which grants the access
+    :attr layer: the secured layer or one of its descendants
+    :attr derived_from: the secured layer of the allowed operation, which ``layer`` is part of the subtree of
+    :attr identifier: the lower cased identifier of ``layer``
+    """
+    allowed_operation = models.ForeignKey(
+        to=AllowedWebMapServiceOperation,
+        on_delete=models.CASCADE,
+        related_name="effective_layers",
+        related_query_name="effective_layer",
+    )
+    layer = models.ForeignKey(
+        to=Layer,
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    derived_from = models.ForeignKey(
+        to=Layer,
+        on_delete=models.CASCADE,
+        related_name="+",
+    )
+    identifier = models.CharField(max_length=500, null=True)
+
+    objects = EffectiveLayerQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["allowed_operation", "layer", "derived_from"],
+                name="registry_effective_layer_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["identifier", "allowed_operation"],
+                         name="registry_effective_layer_idx"),
+        ]
+
+
 class AllowedWebFeatureServiceOperation(AllowedOperation):
     operations = models.ManyToManyField(
         to=WebFeatureServiceOperation,
@@ -371,6 +434,56 @@ class AllowedWebFeatureServiceOperation(AllowedOperation):
             )
 
 
+class AllowedAreaPart(models.Model):
+    """A part of the subdivided and optionally simplified allowed area of an :class:`AllowedOperation`.
+
+    The parts are derived from :attr:`AllowedOperation.allowed_area` every time the allowed operation is saved. Spatial
+    tests against the small, indexed parts only touch the vertices around the requested bbox; the simplified parts
+    are a pyramid to render masks of small scale maps with less vertices.
+
+    :attr tolerance: the tolerance the allowed area is simplified with, in units of its reference system. ``0`` is the
+                     full resolution.
+    :attr geom: the subdivided polygon
+    """
+    tolerance = models.FloatField(default=0)
+    geom = models.PolygonField()
+
+    objects = AllowedAreaPartQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+
+class AllowedWebMapServiceOperationAreaPart(AllowedAreaPart):
+    allowed_operation = models.ForeignKey(
+        to=AllowedWebMapServiceOperation,
+        on_delete=models.CASCADE,
+        related_name="area_parts",
+        related_query_name="area_part",
+    )
+
+    class Meta(AllowedAreaPart.Meta):
+        indexes = [
+            models.Index(fields=["allowed_operation", "tolerance"],
+                         name="registry_wms_area_part_idx"),
+        ]
+
+
+class AllowedWebFeatureServiceOperationAreaPart(AllowedAreaPart):
+    allowed_operation = models.ForeignKey(
+        to=AllowedWebFeatureServiceOperation,
+        on_delete=models.CASCADE,
+        related_name="area_parts",
+        related_query_name="area_part",
+    )
+
+    class Meta(AllowedAreaPart.Meta):
+        indexes = [
+            models.Index(fields=["allowed_operation", "tolerance"],
+                         name="registry_wfs_area_part_idx"),
+        ]
+
+
 class ProxySetting(models.Model):
     camouflage = models.BooleanField(
         default=False,
@@ -389,6 +502,22 @@ class ProxySetting(models.Model):
         help_text=_(
             "if true, all responses of the related service will be logged."),
     )
+    max_connections = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_("max connections"),
+        help_text=_(
+            "the max count of parallel connections per proxy process to the remote service. "
+            "If empty, the default of the mr. map instance is used."),
+    )
+    timeout = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_("timeout"),
+        help_text=_(
+            "the timeout in seconds for requests to the remote service. "
+            "If empty, the default of the mr. map instance is used."),
+    )
 
     class Meta:
         abstract = True
@@ -32,6 +32,8 @@ from registry.models.document import CapabilitiesDocumentModelMixin
 from registry.models.metadata import (AbstractMetadata, FeatureTypeMetadata,
                                       LayerMetadata, MimeType, ServiceMetadata,
                                       Style)
+from registry.proxy.cache import capabilities_cache, client_cache
+from registry.proxy.sessions import upstream_session_registry
 from registry.xmlmapper.ogc.wfs_describe_feature_type import \
     DescribedFeatureType as XmlDescribedFeatureType
 from requests import Session
@@ -107,15 +109,58 @@ class OgcService(CapabilitiesDocumentModelMixin, ServiceMetadata, CommonServiceI
         return int(self.version.split(".")[2])
 
     def get_session_for_request(self) -> Session:
-        session = Session()
+        """Return the pooled keep-alive session for the host of this service and its credentials."""
         # session.proxies.update(PROXIES)
-        if hasattr(self, "auth"):
-            session.auth = self.auth.get_auth_for_request()
-        return session
+        auth = self.auth.get_auth_for_request() if hasattr(self, "auth") else None
+        proxy_setting = getattr(self, "proxy_setting", None)
+        return upstream_session_registry.get_session(
+            url=self.service_url,
+            auth=auth,
+            max_connections=proxy_setting.max_connections if proxy_setting else None,
+            timeout=proxy_setting.timeout if proxy_setting else None,
+        )
+
+    @property
+    def xml_backup_cache_key(self) -> tuple:
+        """Return the key to cache objects which are constructed from the capabilities backup file.
+
+        The key contains the name and the modification time of the backup file, so it changes if the service is
+        re-registered or updated, even if the cache entries of other processes are not invalidated by signals.
+        """
+        try:
+            modified = self.xml_backup_file.storage.get_modified_time(
+                self.xml_backup_file.name)
+        except (NotImplementedError, OSError, ValueError):
+            modified = None
+        return (self.pk, self.xml_backup_file.name, modified)
+
+    @property
+    def cached_xml_backup(self):
+        """Return the parsed capabilities document from the per process cache.
+
+        .. warning::
+            The returned object is shared between requests. Do not modify it; use :attr:`xml_backup` instead.
+        """
+        return capabilities_cache.get_or_set(
+            key=self.xml_backup_cache_key,
+            default=lambda: self.xml_backup)
+
+    @property
+    def client_cache_key(self) -> tuple:
+        """Return the key of the cached client.
+
+        Besides the capabilities backup file, the key contains the credentials of the service, so the session of the
+        client is created again if they change, even if the cache entries of other processes are not invalidated by
+        signals. Changed proxy settings are applied after ``settings.PROXY_CLIENT_CACHE_TIMEOUT`` seconds.
+        """
+        auth = self.auth.credentials_cache_key if hasattr(self, "auth") else None
+        return (*self.xml_backup_cache_key, auth)
 
     @property
     def client(self):
-        return get_client(capabilities=self.xml_backup, session=self.get_session_for_request())
+        return client_cache.get_or_set(
+            key=self.client_cache_key,
+            default=lambda: get_client(capabilities=self.cached_xml_backup, session=self.get_session_for_request()))
 
 
 class WebMapService(HistoricalRecordMixin, OgcService):
@@ -631,8 +676,7 @@ class FeatureType(HistoricalRecordMixin, FeatureTypeMetadata, ServiceElement):
     def fetch_describe_feature_type_document(self, save=True):
         """Return the fetched described feature type document and update the content if save is True"""
 
-        client = get_client(capabilities=self.service.xml_backup,
-                            session=self.service.get_session_for_request())
+        client = self.service.client
         response = client.send_request(
             client.prepare_describe_feature_type_request(type_names=self.identifier))
         if response.status_code <= 202 and "xml" in response.headers["content-type"]:
@@ -0,0 +1,142 @@
+import time
+from collections import OrderedDict
+from threading import RLock
+from typing import Any, Callable, Hashable
+
+from django.conf import settings
+
+
+class LRUCache:
+    """Thread safe per process least recently used cache with hit/miss counters.
+
+    The cache is used on the proxy hot path to store objects which are expensive to construct, such as parsed
+    capabilities documents or ready to use ogc clients. Every entry is stored under a tuple key, where the first item
+    is the group key (the primary key of the related service for example). With that all entries of one group can be
+    invalidated at once by calling :meth:`~LRUCache.invalidate`.
+
+    :attr max_size: the maximum count of entries. If the cache is full, the least recently used entry is dropped.
+    :attr timeout: optional seconds after which an entry expires, even if it is not invalidated
+    :attr on_evict: optional callable, which is called with every value that is dropped, expired, invalidated or
+                    replaced, like to close the connections of a session. It is called outside of the lock.
+    """
+
+    def __init__(self, max_size: int = 128, timeout: float = None, on_evict: Callable[[Any], None] = None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._lock = RLock()
+        self.hits = 0
+        self.misses = 0
+
+    def _evict(self, values: list) -> None:
+        if self.on_evict is None:
+            return
+        for value in values:
+            try:
+                self.on_evict(value)
+            except Exception as e:
+                settings.ROOT_LOGGER.warning(f"can't release evicted cache entry: {e}")
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value, expires = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is None or expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+            self.misses += 1
+        self._evict(values=[value])
+        return default
+
+    def _set(self, key: Hashable, value: Any, evicted: list) -> None:
+        expires = time.monotonic() + self.timeout if self.timeout is not None else None
+        replaced = self._entries.get(key)
+        if replaced is not None and replaced[0] is not value:
+            evicted.append(replaced[0])
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            evicted.append(self._entries.popitem(last=False)[1][0])
+
+    def set(self, key: Hashable, value: Any) -> None:
+        evicted = []
+        with self._lock:
+            self._set(key=key, value=value, evicted=evicted)
+        self._evict(values=evicted)
+
+    def get_or_set(self, key: Hashable, default: Callable[[], Any]) -> Any:
+        """Return the cached value for the given key or construct, store and return it by calling ``default``."""
+        value = self.get(key=key, default=None)
+        if value is None:
+            # construct the value outside the lock; the same value may be constructed twice concurrently, but this
+            # does not block other threads while a large document is parsed.
+            value = default()
+            if value is not None:
+                evicted = []
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                        # another thread was faster; the constructed value is not used by anyone yet
+                        evicted.append(value)
+                        value = entry[0]
+                    else:
+                        self._set(key=key, value=value, evicted=evicted)
+                self._evict(values=evicted)
+        return value
+
+    def values(self) -> list:
+        """Return a snapshot of all cached values without touching the lru order or the counters."""
+        with self._lock:
+            return [value for value, _ in self._entries.values()]
+
+    def items(self) -> list:
+        """Return a snapshot of all cached keys and values without touching the lru order or the counters."""
+        with self._lock:
+            return [(key, value) for key, (value, _) in self._entries.items()]
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._evict(values=[entry[0]])
+
+    def invalidate(self, group: Hashable) -> None:
+        """Remove all entries whose key starts with the given group key."""
+        with self._lock:
+            evicted = [self._entries.pop(key)[0] for key in [key for key in self._entries if key[0] == group]]
+        self._evict(values=evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            evicted = [value for value, _ in self._entries.values()]
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+        self._evict(values=evicted)
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
+
+
+capabilities_cache = LRUCache(max_size=settings.PROXY_CAPABILITIES_CACHE_SIZE)
+# clients with the upstream session of a service; the key contains the credentials, but not the proxy setting
+client_cache = LRUCache(
+    max_size=settings.PROXY_CAPABILITIES_CACHE_SIZE,
+    timeout=settings.PROXY_CLIENT_CACHE_TIMEOUT)
+# decrypted credentials of authenticated services as ready to use auth objects
+credentials_cache = LRUCache(
+    max_size=settings.PROXY_CAPABILITIES_CACHE_SIZE,
+    timeout=settings.PROXY_CREDENTIALS_CACHE_TIMEOUT)
@@ -0,0 +1,165 @@
+import hashlib
+import time
+from typing import FrozenSet, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpRequest
+from django.utils.http import quote_etag
+from registry.proxy.cache import LRUCache
+from registry.proxy.compression import STATIC_LEVELS, compress
+from registry.proxy.transactions import on_commit_once
+
+
+class RenderedCapabilities:
+    """Serialized capabilities document with the validators for conditional requests.
+
+    :attr content: the serialized document
+    :attr etag: the quoted entity tag of the document
+    :attr last_modified: the unix timestamp of the last change of the service, which invalidated the document
+    :attr encoded: the compressed variants of the document per content coding
+    """
+    __slots__ = ("content", "etag", "last_modified", "encoded")
+
+    def __init__(self, content, last_modified: int):
+        self.content = content
+        if isinstance(content, str):
+            content = content.encode("UTF-8")
+        self.etag = quote_etag(hashlib.sha256(content).hexdigest()[:32])
+        self.last_modified = last_modified
+        self.encoded = {}
+
+    def get_encoded(self, encoding: str) -> bytes:
+        """Return the document compressed with the given content coding.
+
+        The document is compressed once per process with the strongest level; the variant is kept as long as the
+        document is in the per process cache.
+        """
+        encoded = getattr(self, "encoded", None)
+        if encoded is None:
+            # documents pickled before the variants were added
+            encoded = self.encoded = {}
+        content = encoded.get(encoding)
+        if content is None:
+            content = self.content.encode("UTF-8") if isinstance(self.content, str) else self.content
+            content = encoded[encoding] = compress(
+                content=content, encoding=encoding, levels=STATIC_LEVELS)
+        return content
+
+
+class CapabilitiesRenderCache:
+    """Cache of the final serialized capabilities documents per service, camouflage host and scheme and set of visible
+    layers.
+
+    Rendering a document parses the xml backup, updates it with the values of the database and camouflages all urls.
+    The rendered documents are stored in the django cache, so all processes share them, and the most recently used ones
+    additionally in a per process :class:`registry.proxy.cache.LRUCache`.
+
+    Every service has a version in the django cache, which is part of the cache keys. Changing the service, its
+    elements or its proxy setting sets a new version by :meth:`~CapabilitiesRenderCache.invalidate_on_commit`; with
+    that the documents of all processes are invalidated at once.
+    """
+    ALL_SERVICES = "*"
+
+    def __init__(self, max_size: int, timeout: int, cache_alias: str = "default"):
+        self.timeout = timeout
+        self.cache_alias = cache_alias
+        self._local_cache = LRUCache(max_size=max_size)
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _get_version_key(self, service_pk) -> str:
+        return f"mrmap:capabilities:{service_pk}:version"
+
+    def get_versions(self, service_pk) -> Tuple[int, int]:
+        """Return the versions of all services and of the given service; missing versions are initialized."""
+        global_key = self._get_version_key(service_pk=self.ALL_SERVICES)
+        service_key = self._get_version_key(service_pk=service_pk)
+        versions = self.cache.get_many([global_key, service_key])
+        for key in (global_key, service_key):
+            if key not in versions:
+                version = time.time_ns()
+                # another process may initialize the version concurrently; the first one wins
+                if not self.cache.add(key, version, timeout=None):
+                    version = self.cache.get(key, version)
+                versions[key] = version
+        return versions[global_key], versions[service_key]
+
+    @staticmethod
+    def get_principal_key(visible_layer_identifiers: FrozenSet[str] = None) -> str:
+        """Return the key of the filtered document for the given visible layers.
+
+        Users whose groups can see the same layers share one document, even if they are members of different groups.
+        """
+        if visible_layer_identifiers is None:
+            return "*"
+        return hashlib.sha256(
+            "\n".join(sorted(visible_layer_identifiers)).encode("UTF-8")).hexdigest()[:32]
+
+    def get_or_render(self, service, request: HttpRequest, service_version: str = "",
+                      visible_layer_identifiers: FrozenSet[str] = None) -> RenderedCapabilities:
+        """Return the rendered capabilities document of the given service for the given request.
+
+        :param visible_layer_identifiers: the lower cased identifiers of the layers the requesting user can see or
+                                          ``None`` to list all layers
+        """
+        try:
+            versions = self.get_versions(service_pk=service.pk)
+        except Exception as e:
+            # without versions the cached documents can't be validated
+            settings.ROOT_LOGGER.exception(e)
+            return RenderedCapabilities(
+                content=service.get_capabilitites_for_request(
+                    request=request, visible_layer_identifiers=visible_layer_identifiers),
+                last_modified=int(time.time()))
+        host, scheme = (request.get_host(), request.scheme) if service.camouflage else ("", "")
+        key = (service.pk, *versions, service_version, host, scheme,
+               self.get_principal_key(visible_layer_identifiers=visible_layer_identifiers))
+
+        rendered = self._local_cache.get(key=key)
+        if rendered is not None:
+            return rendered
+
+        cache_key = "mrmap:capabilities:" + ":".join(str(part) for part in key)
+        try:
+            rendered = self.cache.get(cache_key)
+        except Exception as e:
+            settings.ROOT_LOGGER.exception(e)
+        if rendered is None:
+            rendered = RenderedCapabilities(
+                content=service.get_capabilitites_for_request(
+                    request=request, visible_layer_identifiers=visible_layer_identifiers),
+                last_modified=max(versions) // 1_000_000_000,
+            )
+            try:
+                self.cache.set(cache_key, rendered, timeout=self.timeout)
+            except Exception as e:
+                settings.ROOT_LOGGER.exception(e)
+        self._local_cache.set(key=key, value=rendered)
+        return rendered
+
+    def invalidate(self, service_pk=None) -> None:
+        """Set a new version for the given service, or for all services if no service pk is passed."""
+        if service_pk:
+            self._local_cache.invalidate(group=service_pk)
+        else:
+            self._local_cache.clear()
+        try:
+            self.cache.set(self._get_version_key(service_pk=service_pk or self.ALL_SERVICES),
+                           time.time_ns(), timeout=None)
+        except Exception as e:
+            settings.ROOT_LOGGER.warning(
+                f"can't invalidate rendered capabilities: {e}")
+
+    def invalidate_on_commit(self, service_pk=None) -> None:
+        """Apply the invalidation once after the current transaction is committed, or immediately in autocommit
+        mode."""
+        on_commit_once(func=self.invalidate, key=service_pk)
+
+
+capabilities_render_cache = CapabilitiesRenderCache(
+    max_size=settings.PROXY_CAPABILITIES_CACHE_SIZE,
+    timeout=settings.PROXY_CAPABILITIES_RENDER_CACHE_TIMEOUT,
+)
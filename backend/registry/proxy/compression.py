@@ -0,0 +1,164 @@
+import re
+import zlib
+from typing import AsyncIterator, Iterable, Iterator
+
+import brotli
+import zstandard
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpRequest, HttpResponseBase
+from django.utils.cache import patch_vary_headers
+
+# text like content types, which are worth to compress; images are already compressed by their format
+COMPRESSIBLE_CONTENT_TYPES = re.compile(
+    r"^(text/.*|.*[/+](xml|json)|application/vnd\.ogc\.gml|application/javascript)$")
+
+# fast levels for responses, which are compressed on every request
+DYNAMIC_LEVELS = {"gzip": 6, "br": 4, "zstd": 3}
+# strong levels for cached documents, which are compressed once
+STATIC_LEVELS = {"gzip": 9, "br": 11, "zstd": 19}
+
+
+class _BrotliCompressor:
+    """Adapter of :class:`brotli.Compressor` to the ``compress``/``flush`` interface of the other compressors."""
+
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+def get_compressor(encoding: str, level: int):
+    """Return an incremental compressor with ``compress(data)`` and ``flush()`` for the given content coding."""
+    if encoding == "gzip":
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == "br":
+        return _BrotliCompressor(quality=level)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    raise ValueError(f"unsupported content coding: {encoding}")
+
+
+def compress(content: bytes, encoding: str, levels: dict = DYNAMIC_LEVELS) -> bytes:
+    compressor = get_compressor(encoding=encoding, level=levels[encoding])
+    return compressor.compress(content) + compressor.flush()
+
+
+def compress_stream(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    compressor = get_compressor(
+        encoding=encoding, level=DYNAMIC_LEVELS[encoding])
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def acompress_stream(chunks: AsyncIterator[bytes], encoding: str) -> AsyncIterator[bytes]:
+    compressor = get_compressor(
+        encoding=encoding, level=DYNAMIC_LEVELS[encoding])
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def get_accepted_encoding(request: HttpRequest) -> str:
+    """Return the content coding of ``settings.PROXY_COMPRESSION_ENCODINGS`` with the highest quality in the
+    ``Accept-Encoding`` header of the request; on equal quality the order of the setting decides. ``None`` if the
+    client accepts none of them."""
+    qualities = {}
+    for part in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        coding, _, params = part.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if coding.strip():
+            qualities[coding.strip().lower()] = quality
+
+    accepted, accepted_quality = None, 0
+    for encoding in settings.PROXY_COMPRESSION_ENCODINGS:
+        quality = qualities.get(encoding, qualities.get("*", 0))
+        if quality > accepted_quality:
+            accepted, accepted_quality = encoding, quality
+    return accepted
+
+
+def is_compressible(response: HttpResponseBase) -> bool:
+    content_type = response.get("Content-Type", "").split(";")[0].strip().lower()
+    return (
+        response.status_code not in (204, 206, 304)
+        and not response.has_header("Content-Encoding")
+        and COMPRESSIBLE_CONTENT_TYPES.match(content_type) is not None
+        and (response.streaming or len(response.content) >= settings.PROXY_COMPRESSION_MIN_SIZE)
+    )
+
+
+def patch_content_encoding(response: HttpResponseBase, encoding: str) -> None:
+    """Mark the response as compressed with the given content coding; strong etags are weakened, because the
+    compressed body is not byte equal to the uncompressed one anymore."""
+    response.headers["Content-Encoding"] = encoding
+    etag = response.get("ETag")
+    if etag and etag.startswith('"'):
+        response.headers["ETag"] = "W/" + etag
+
+
+class CompressionMiddleware:
+    """Compress text like responses of the ogc endpoints with gzip, brotli or zstd, as the client accepts it.
+
+    Only responses of ``settings.PROXY_COMPRESSION_PATHS`` are compressed. Responses which are already compressed, like
+    passed through compressed upstream responses or cached compressed capabilities documents, are left as they are.
+    Streamed responses are compressed chunk by chunk; other responses only if they have at least
+    ``settings.PROXY_COMPRESSION_MIN_SIZE`` bytes.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.process_response(request=request, response=self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request=request, response=await self.get_response(request))
+
+    def process_response(self, request: HttpRequest, response: HttpResponseBase) -> HttpResponseBase:
+        if not settings.PROXY_COMPRESSION or not request.path.startswith(tuple(settings.PROXY_COMPRESSION_PATHS)):
+            return response
+        if not is_compressible(response=response):
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = get_accepted_encoding(request=request)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = acompress_stream(
+                    chunks=response.streaming_content, encoding=encoding)
+            else:
+                response.streaming_content = compress_stream(
+                    chunks=response.streaming_content, encoding=encoding)
+            # the length of the compressed stream is unknown
+            del response.headers["Content-Length"]
+        else:
+            response.content = compress(
+                content=response.content, encoding=encoding)
+            response.headers["Content-Length"] = str(len(response.content))
+        patch_content_encoding(response=response, encoding=encoding)
+        return response
@@ -0,0 +1,261 @@
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
+from threading import BoundedSemaphore, Lock
+from typing import Awaitable, Callable, Hashable, Tuple
+
+from django.conf import settings
+from registry.proxy.metrics import Counters
+
+
+def close_response(response) -> None:
+    """Release the connection of a response, which is not used anymore; error dicts have nothing to release."""
+    close = getattr(response, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+async def aclose_response(response) -> None:
+    aclose = getattr(response, "aclose", None)
+    if aclose is not None:
+        try:
+            await aclose()
+        except Exception:
+            pass
+    else:
+        close_response(response)
+
+
+def is_error(response) -> bool:
+    return isinstance(response, dict)
+
+
+class _Upstream:
+    """Recent latencies and the hedge budget of one service and operation."""
+    __slots__ = ("latencies", "tokens", "lock")
+
+    def __init__(self, sample_size: int, burst: float):
+        self.latencies = deque(maxlen=sample_size)
+        self.tokens = burst
+        self.lock = Lock()
+
+
+class Hedger:
+    """Send a second identical request, if the first one is slower than the ``percentile`` of the recent latencies of
+    the same service and operation. The first response wins; the other one is closed.
+
+    Every request adds ``budget`` tokens to the bucket of its service and operation, up to ``burst`` tokens; every hedge
+    costs one token. With that at most ``budget`` of the requests, like 5%, are hedged in the long run, so a slow
+    remote service is not overloaded by hedges.
+
+    Hedging starts after ``min_samples`` latencies of a service and operation were recorded.
+
+    Requests, which can't be hedged, are sent on the calling thread. Only if a hedge is possible, the first request is
+    sent by a worker of a pool with ``max_workers`` threads, so the calling thread can send the hedge after the delay;
+    if all workers are busy, the request is sent on the calling thread without hedging.
+    """
+
+    def __init__(self, percentile: float = 95, budget: float = 0.05, burst: float = 10, min_samples: int = 20,
+                 sample_size: int = 200, min_delay: float = 0.05, max_workers: int = 16):
+        self.percentile = percentile
+        self.budget = budget
+        self.burst = burst
+        self.min_samples = min_samples
+        self.sample_size = sample_size
+        self.min_delay = min_delay
+        self.max_workers = max_workers
+        self.counters = Counters(name="hedging")
+        self._upstreams = {}
+        self._lock = Lock()
+        self._executor = None
+        self._workers = None
+        self._pid = None
+
+    def _get_upstream(self, key: Hashable) -> _Upstream:
+        upstream = self._upstreams.get(key)
+        if upstream is None:
+            with self._lock:
+                upstream = self._upstreams.setdefault(
+                    key, _Upstream(sample_size=self.sample_size, burst=self.burst))
+        return upstream
+
+    def record(self, key: Hashable, latency: float) -> None:
+        upstream = self._get_upstream(key=key)
+        with upstream.lock:
+            upstream.latencies.append(latency)
+
+    def get_delay(self, key: Hashable) -> float:
+        """Return the seconds after which the request is hedged or ``None`` if there are not enough samples."""
+        upstream = self._get_upstream(key=key)
+        with upstream.lock:
+            if len(upstream.latencies) < self.min_samples:
+                return None
+            latencies = sorted(upstream.latencies)
+        index = min(len(latencies) - 1,
+                    int(len(latencies) * self.percentile / 100))
+        return max(self.min_delay, latencies[index])
+
+    def _has_token(self, key: Hashable) -> bool:
+        upstream = self._get_upstream(key=key)
+        with upstream.lock:
+            return upstream.tokens >= 1
+
+    def _take_token(self, key: Hashable) -> bool:
+        upstream = self._get_upstream(key=key)
+        with upstream.lock:
+            if upstream.tokens >= 1:
+                upstream.tokens -= 1
+                return True
+            return False
+
+    def _return_token(self, key: Hashable) -> None:
+        upstream = self._get_upstream(key=key)
+        with upstream.lock:
+            upstream.tokens = min(self.burst, upstream.tokens + 1)
+
+    def _add_token(self, key: Hashable) -> None:
+        upstream = self._get_upstream(key=key)
+        with upstream.lock:
+            upstream.tokens = min(self.burst, upstream.tokens + self.budget)
+
+    def _get_pool(self) -> Tuple[ThreadPoolExecutor, BoundedSemaphore]:
+        # the pool needs to be created again in forked worker processes
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix="mrmap-proxy-hedging")
+                    self._workers = BoundedSemaphore(self.max_workers)
+                    self._pid = os.getpid()
+        return self._executor, self._workers
+
+    def _call(self, key: Hashable, func: Callable[[], object]):
+        start = time.monotonic()
+        response = func()
+        if not is_error(response):
+            self.record(key=key, latency=time.monotonic() - start)
+        return response
+
+    def _submit(self, key: Hashable, func: Callable[[], object]) -> Future:
+        """Call ``func`` in a free worker of the pool; return ``None`` if all workers are busy."""
+        executor, workers = self._get_pool()
+        if not workers.acquire(blocking=False):
+            return None
+
+        def run():
+            try:
+                return self._call(key=key, func=func)
+            finally:
+                workers.release()
+
+        try:
+            return executor.submit(run)
+        except RuntimeError:
+            workers.release()
+            return None
+
+    def do(self, key: Hashable, func: Callable[[], object]):
+        """Call ``func`` and hedge it, if it is slow.
+
+        :param key: the service and operation, which the latencies are learned for
+        :param func: sends the request and returns the response or an error dict
+        """
+        self.counters.increment("requests")
+        self._add_token(key=key)
+        delay = self.get_delay(key=key)
+        first = None
+        if delay is not None:
+            if not self._has_token(key=key):
+                self.counters.increment("budget_exhausted")
+            else:
+                first = self._submit(key=key, func=func)
+                if first is None:
+                    self.counters.increment("workers_exhausted")
+        if first is None:
+            # without enough samples, hedge budget or free workers the request is not hedged
+            return self._call(key=key, func=func)
+
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        if not self._take_token(key=key):
+            self.counters.increment("budget_exhausted")
+            return first.result()
+        second = self._submit(key=key, func=func)
+        if second is None:
+            self._return_token(key=key)
+            self.counters.increment("workers_exhausted")
+            return first.result()
+
+        self.counters.increment("hedged")
+        pending = {first, second}
+        winner = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = done.pop()
+            if winner.exception() is None and not is_error(winner.result()) or not pending:
+                break
+            # the failed attempt is discarded, if the other one may still succeed
+        if winner is second:
+            self.counters.increment("hedge_won")
+        for future in (first, second):
+            if future is not winner:
+                future.add_done_callback(
+                    lambda f: f.exception() is None and close_response(f.result()))
+        return winner.result()
+
+    async def ado(self, key: Hashable, func: Callable[[], Awaitable[object]]):
+        """Async variant of :meth:`~Hedger.do`; the losing request is cancelled."""
+        self.counters.increment("requests")
+        self._add_token(key=key)
+
+        async def timed():
+            start = time.monotonic()
+            response = await func()
+            if not is_error(response):
+                self.record(key=key, latency=time.monotonic() - start)
+            return response
+
+        delay = self.get_delay(key=key)
+        if delay is None:
+            return await timed()
+
+        first = asyncio.ensure_future(timed())
+        done, _ = await asyncio.wait([first], timeout=delay)
+        if done or not self._take_token(key=key):
+            if not done:
+                self.counters.increment("budget_exhausted")
+            return await first
+
+        self.counters.increment("hedged")
+        second = asyncio.ensure_future(timed())
+        pending = {first, second}
+        winner = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = done.pop()
+            if winner.exception() is None and not is_error(winner.result()) or not pending:
+                break
+        if winner is second:
+            self.counters.increment("hedge_won")
+        for task in pending:
+            task.cancel()
+        for task in (first, second):
+            if task is not winner and task.done() and not task.cancelled() and task.exception() is None:
+                await aclose_response(task.result())
+        return winner.result()
+
+
+hedger = Hedger(
+    percentile=settings.PROXY_HEDGE_PERCENTILE,
+    budget=settings.PROXY_HEDGE_BUDGET,
+    burst=settings.PROXY_HEDGE_BUDGET_BURST,
+    min_samples=settings.PROXY_HEDGE_MIN_SAMPLES,
+    max_workers=settings.PROXY_HEDGE_MAX_WORKERS,
+)
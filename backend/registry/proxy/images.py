@@ -0,0 +1,165 @@
+import io
+from typing import List
+
+import numpy
+from django.conf import settings
+from PIL import Image
+from registry.proxy.cache import LRUCache
+
+# formats which can encode an alpha channel
+ALPHA_FORMATS = ("PNG", "GIF", "TIFF", "WEBP")
+
+empty_image_cache = LRUCache(max_size=64)
+
+
+def get_image_format(mime_type: str) -> str:
+    """Return the Pillow format name for the given wms FORMAT parameter, like ``image/png; mode=8bit``."""
+    subtype = (mime_type or "").split(";")[0].strip().split("/")[-1].upper()
+    if subtype in ("JPG", "JPEG"):
+        return "JPEG"
+    Image.init()
+    if subtype in Image.SAVE:
+        return subtype
+    return "PNG"
+
+
+def get_bgcolor(bgcolor: str) -> tuple:
+    """Return the rgb tuple for the given wms BGCOLOR parameter, like ``0xFFFFFF``; default is white."""
+    try:
+        value = int((bgcolor or "").lower().replace("0x", "").replace("#", ""), 16)
+    except ValueError:
+        return (255, 255, 255)
+    return ((value >> 16) & 255, (value >> 8) & 255, value & 255)
+
+
+def _create_empty_image(image_format: str, width: int, height: int, transparent: bool, bgcolor: tuple) -> bytes:
+    if transparent and image_format in ALPHA_FORMATS:
+        image = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    else:
+        image = Image.new("RGB", (width, height), bgcolor)
+    out_bytes_stream = io.BytesIO()
+    image.save(out_bytes_stream, image_format)
+    return out_bytes_stream.getvalue()
+
+
+def get_empty_image(mime_type: str, width: int, height: int, transparent: bool = True, bgcolor: str = None) -> bytes:
+    """Return the encoded empty map image of the given size and format from the per process cache.
+
+    Formats without alpha channel are filled with the given background color.
+    """
+    image_format = get_image_format(mime_type=mime_type)
+    bgcolor = get_bgcolor(bgcolor=bgcolor)
+    transparent = transparent and image_format in ALPHA_FORMATS
+    return empty_image_cache.get_or_set(
+        key=(image_format, width, height, transparent, bgcolor),
+        default=lambda: _create_empty_image(
+            image_format=image_format, width=width, height=height, transparent=transparent, bgcolor=bgcolor),
+    )
+
+
+def get_save_options(image_format: str) -> dict:
+    """Return the encoder settings for the given Pillow format."""
+    if image_format == "PNG":
+        return {"compress_level": settings.PROXY_PNG_COMPRESS_LEVEL}
+    if image_format in ("JPEG", "WEBP"):
+        return {"quality": settings.PROXY_JPEG_QUALITY}
+    return {}
+
+
+def _mask_palette_image(image: Image.Image, hidden: numpy.ndarray) -> Image.Image:
+    """Mask a palette image by the transparent palette index; return None if the palette has no index left."""
+    transparency = image.info.get("transparency")
+    if not isinstance(transparency, int):
+        colors = len(image.getpalette() or []) // 3
+        if transparency is not None or colors >= 256:
+            # the palette has alpha values per index or no free index
+            return None
+        transparency = colors
+        image.putpalette((image.getpalette() or []) + [0, 0, 0])
+    indices = numpy.array(image)
+    indices[hidden] = transparency
+    masked = Image.fromarray(indices)
+    masked.putpalette(image.getpalette())
+    masked.info["transparency"] = transparency
+    return masked
+
+
+def mask_image(content: bytes, mask: Image.Image, overlay: Image.Image = None) -> bytes:
+    """Apply the security mask to the encoded map image and return the encoded result.
+
+    The image is decoded and encoded only once. The mask is applied by multiplying the alpha channel with the
+    inverted mask; formats without alpha channel are blended with white instead. Palette images keep their palette,
+    if a palette index for transparency is available.
+
+    :param content: the encoded map image
+    :param mask: the grayscale mask, where ``0`` marks the visible and ``255`` the hidden pixels
+    :param overlay: an optional rgba image, which is drawn on top of the masked image
+    :return: the encoded masked image in the format of the given image
+    """
+    image = Image.open(io.BytesIO(content))
+    image_format = image.format or "PNG"
+    image.load()
+
+    if overlay is not None and overlay.size != image.size:
+        overlay = overlay.resize(image.size)
+    if mask.mode != "L":
+        mask = mask.convert("L")
+    if mask.size != image.size:
+        mask = mask.resize(image.size)
+    hidden = numpy.asarray(mask, dtype=numpy.uint16)
+
+    masked = None
+    if image.mode == "P" and image_format in ALPHA_FORMATS and overlay is None:
+        masked = _mask_palette_image(image=image, hidden=hidden >= 128)
+
+    if masked is None and image_format in ALPHA_FORMATS:
+        pixels = numpy.array(image.convert("RGBA"))
+        alpha = pixels[..., 3].astype(numpy.uint16)
+        alpha *= 255 - hidden
+        alpha //= 255
+        pixels[..., 3] = alpha
+        masked = Image.fromarray(pixels)
+        if overlay is not None:
+            masked.alpha_composite(overlay.convert("RGBA"))
+    elif masked is None:
+        pixels = numpy.array(image.convert("RGB"), dtype=numpy.uint16)
+        pixels *= (255 - hidden)[..., numpy.newaxis]
+        pixels += (255 * hidden)[..., numpy.newaxis]
+        pixels //= 255
+        masked = Image.fromarray(pixels.astype(numpy.uint8))
+        if overlay is not None:
+            overlay = overlay.convert("RGBA")
+            masked.paste(overlay, mask=overlay)
+
+    out_bytes_stream = io.BytesIO()
+    masked.save(out_bytes_stream, image_format,
+                **get_save_options(image_format=image_format))
+    return out_bytes_stream.getvalue()
+
+
+def composite_images(contents: List[bytes], mime_type: str, width: int, height: int, transparent: bool = True,
+                     bgcolor: str = None) -> bytes:
+    """Draw the encoded map images on top of each other and return the encoded result.
+
+    :param contents: the encoded map images from bottom to top; ``None`` entries are skipped
+    :return: the composited image encoded in the given format. Formats without alpha channel and opaque requests are
+             filled with the given background color.
+    """
+    canvas = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    for content in contents:
+        if content is None:
+            continue
+        image = Image.open(io.BytesIO(content)).convert("RGBA")
+        if image.size != canvas.size:
+            image = image.resize(canvas.size)
+        canvas.alpha_composite(image)
+
+    image_format = get_image_format(mime_type=mime_type)
+    if not transparent or image_format not in ALPHA_FORMATS:
+        background = Image.new("RGB", canvas.size, get_bgcolor(bgcolor=bgcolor))
+        background.paste(canvas, mask=canvas)
+        canvas = background
+    out_bytes_stream = io.BytesIO()
+    canvas.save(out_bytes_stream, image_format,
+                **get_save_options(image_format=image_format))
+    return out_bytes_stream.getvalue()
@@ -0,0 +1,48 @@
+from typing import Dict, FrozenSet, List, Tuple
+
+
+def _get_param(params: Dict, key: str) -> Tuple[str, str]:
+    """Return the used key and the value of the given query param; looked up like
+    :attr:`ows_lib.models.ogc_request.OGCRequest.ogc_query_params` does it."""
+    for _key in (key, key.lower()):
+        value = params.get(_key)
+        if value is not None:
+            if isinstance(value, list):
+                # if multiple values are passed in multiple queryparams, we pick the first item
+                value = value[0] if value else ""
+            return _key, value
+    return None, None
+
+
+def _split(value: str) -> List[str]:
+    return list(filter(None, value.split(",")))
+
+
+def filter_layer_params(params: Dict, allowed_entities: FrozenSet[str]) -> Dict:
+    """Return a copy of the given GetMap or GetFeatureInfo query params, with the ``LAYERS`` and ``QUERY_LAYERS``
+    reduced to the given lower cased layer identifiers.
+
+    The ``STYLES`` are kept in line with the remaining layers, if there is one style per requested layer. Otherwise
+    the default styles of all remaining layers are requested.
+    """
+    params = dict(params)
+    layers_key, layers = _get_param(params=params, key="LAYERS")
+    if layers_key:
+        requested_layers = _split(layers)
+        kept = [index for index, layer in enumerate(requested_layers)
+                if layer.lower() in allowed_entities]
+        params[layers_key] = ",".join(requested_layers[index] for index in kept)
+
+        styles_key, styles = _get_param(params=params, key="STYLES")
+        if styles_key:
+            requested_styles = styles.split(",")
+            if len(requested_styles) == len(requested_layers):
+                params[styles_key] = ",".join(requested_styles[index] for index in kept)
+            else:
+                params[styles_key] = ""
+
+    query_layers_key, query_layers = _get_param(params=params, key="QUERY_LAYERS")
+    if query_layers_key:
+        params[query_layers_key] = ",".join(
+            layer for layer in _split(query_layers) if layer.lower() in allowed_entities)
+    return params
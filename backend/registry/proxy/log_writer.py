@@ -0,0 +1,213 @@
+import os
+import time
+from datetime import timedelta
+from queue import Empty, Full, Queue
+from threading import Lock, Thread
+from typing import Dict, List
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile, File
+from django.db import close_old_connections, transaction
+from registry.proxy.metrics import Counters
+
+
+class ProxyLogEntry:
+    """Everything that is needed to log one proxied request and its response.
+
+    The entry is created on the request path without any database access and is written later by the
+    :class:`ProxyLogWriter`.
+
+    :attr request_body: the bytes of the request body or ``None``
+    :attr response_content: the response content as :class:`django.core.files.base.File` or ``None``
+    """
+
+    __slots__ = (
+        "service_cls", "service_pk", "user_pk", "timestamp", "elapsed", "method", "url", "headers", "request_body",
+        "request_content_type", "status_code", "reason", "response_elapsed", "response_headers", "response_url",
+        "response_content", "response_content_type",
+    )
+
+    def __init__(self, **kwargs):
+        for attr in self.__slots__:
+            setattr(self, attr, kwargs.get(attr))
+
+    def get_file_name(self, content_type: str) -> str:
+        if content_type and "/" in content_type:
+            content_type = content_type.split("/")[-1]
+        return f'{self.timestamp.strftime("%Y_%m_%d-%I_%M_%S_%p")}.{content_type}'
+
+    def close(self):
+        if self.response_content is not None:
+            self.response_content.close()
+
+
+class ProxyLogWriter:
+    """Per process writer, which logs proxied requests and responses in batches from a background thread.
+
+    Entries are put into a bounded queue. If the queue is full, the entry is dropped with the ``drop`` policy or the
+    request waits up to ``put_timeout`` seconds with the ``block`` policy, before the entry is dropped. So logging
+    can never slow down the proxy more than ``put_timeout``.
+
+    With ``max_size=0`` the entries are written synchronously on the request path.
+    """
+
+    def __init__(self, max_size: int, batch_size: int, flush_interval: float, policy: str = "drop",
+                 put_timeout: float = 0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.put_timeout = put_timeout
+        self.counters = Counters(name="proxy_log")
+        self._queue = Queue(maxsize=max_size) if max_size else None
+        self._lock = Lock()
+        self._thread = None
+        self._pid = None
+        self._anonymous_user_pk = None
+        self._system_user_pk = None
+
+    def log(self, entry: ProxyLogEntry) -> None:
+        if self._queue is None:
+            self._flush_and_close(entries=[entry])
+            return
+        self._ensure_thread()
+        try:
+            if self.policy == "block":
+                self._queue.put(entry, timeout=self.put_timeout)
+            else:
+                self._queue.put_nowait(entry)
+            self.counters.increment("enqueued")
+        except Full:
+            self.counters.increment("dropped")
+            entry.close()
+
+    def _ensure_thread(self) -> None:
+        # the thread needs to be started again in forked worker processes
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = Thread(
+                target=self._run, name="mrmap-proxy-log-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self) -> None:
+        while True:
+            entries = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(entries) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    entries.append(self._queue.get(timeout=timeout))
+                except Empty:
+                    break
+            self._flush_and_close(entries=entries)
+
+    def _flush_and_close(self, entries: List[ProxyLogEntry]) -> None:
+        close_old_connections()
+        try:
+            self.flush(entries=entries)
+            self.counters.increment("written", len(entries))
+        except Exception as e:
+            settings.ROOT_LOGGER.exception(e)
+            self.counters.increment("failed", len(entries))
+        finally:
+            for entry in entries:
+                entry.close()
+
+    def _get_users(self, entries: List[ProxyLogEntry]) -> Dict:
+        if self._anonymous_user_pk is None:
+            self._anonymous_user_pk = get_user_model().objects.values_list(
+                "pk", flat=True).get(username="AnonymousUser")
+        user_pks = {entry.user_pk or self._anonymous_user_pk for entry in entries}
+        return get_user_model().objects.only("pk", "username").in_bulk(user_pks)
+
+    def _get_system_user_pk(self):
+        if self._system_user_pk is None:
+            self._system_user_pk = get_user_model().objects.values_list(
+                "pk", flat=True).get(username="system")
+        return self._system_user_pk
+
+    def flush(self, entries: List[ProxyLogEntry]) -> None:
+        """Write the given entries with one bulk insert per log model and enqueue the analysis of the responses."""
+        from registry.tasks.security import \
+            async_analyze_logs  # to avoid circular import
+
+        users = self._get_users(entries=entries)
+        entries_per_service_cls = {}
+        for entry in entries:
+            entries_per_service_cls.setdefault(
+                entry.service_cls, []).append(entry)
+
+        for service_cls, _entries in entries_per_service_cls.items():
+            request_log_cls = service_cls.http_request_logs.rel.related_model
+            response_log_cls = request_log_cls.response.related.related_model
+            request_logs = []
+            response_logs = []
+            for entry in _entries:
+                # the bodies are written to the storage before the rows are inserted, so the transaction stays short
+                request_log = request_log_cls(
+                    timestamp=entry.timestamp,
+                    elapsed=entry.elapsed,
+                    method=entry.method,
+                    url=entry.url,
+                    headers=entry.headers,
+                    service=service_cls(pk=entry.service_pk),
+                    user=users[entry.user_pk or self._anonymous_user_pk],
+                )
+                if entry.request_body:
+                    request_log.body.save(
+                        name=entry.get_file_name(entry.request_content_type),
+                        content=ContentFile(entry.request_body),
+                        save=False,
+                    )
+                # error responses of the proxy itself provide only status code and content
+                response_log = response_log_cls(
+                    status_code=entry.status_code,
+                    reason=entry.reason or "",
+                    elapsed=entry.response_elapsed or timedelta(0),
+                    headers=entry.response_headers or {},
+                    url=entry.response_url or "",
+                    request=request_log,
+                )
+                if entry.response_content is not None and entry.response_content.size:
+                    response_log.content.save(
+                        name=entry.get_file_name(entry.response_content_type),
+                        content=entry.response_content,
+                        save=False,
+                    )
+                request_logs.append(request_log)
+                response_logs.append(response_log)
+
+            with transaction.atomic():
+                request_log_cls.objects.bulk_create(request_logs)
+                response_logs = response_log_cls.objects.bulk_create(
+                    response_logs)
+
+            async_analyze_logs.apply_async(
+                args=([response_log.pk for response_log in response_logs if response_log.content],
+                      response_log_cls._meta.model_name),
+                kwargs={"created_by_user_pk": self._get_system_user_pk()},
+            )
+
+
+def get_response_content(content) -> File:
+    """Return the given in memory content as file object for a :class:`ProxyLogEntry`."""
+    if content is None or content == "" or content == b"":
+        return None
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return ContentFile(content)
+
+
+proxy_log_writer = ProxyLogWriter(
+    max_size=settings.PROXY_LOG_QUEUE_SIZE,
+    batch_size=settings.PROXY_LOG_BATCH_SIZE,
+    flush_interval=settings.PROXY_LOG_FLUSH_INTERVAL,
+    policy=settings.PROXY_LOG_QUEUE_POLICY,
+    put_timeout=settings.PROXY_LOG_QUEUE_TIMEOUT,
+)
@@ -0,0 +1,307 @@
+import json
+import os
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, Thread
+from typing import Dict, Iterator, Tuple
+from weakref import WeakSet
+
+from django.conf import settings
+from redis import Redis
+from redis.exceptions import RedisError
+
+# upper bounds in seconds of the buckets of latency histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# all counters and histograms of this process, which are exposed by the metrics endpoint
+_counters = WeakSet()
+_histograms = WeakSet()
+
+
+class Counters:
+    """Thread safe per process counters of the security proxy.
+
+    The counters are exposed as prometheus counter ``mrmap_proxy_<name>_total`` with the key as ``key`` label.
+
+    :attr name: the name of the counter group, like ``get_map``
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._values = defaultdict(int)
+        self._lock = Lock()
+        _counters.add(self)
+
+    def increment(self, key: str, value: int = 1) -> None:
+        with self._lock:
+            self._values[key] += value
+
+    def get(self, key: str) -> int:
+        with self._lock:
+            return self._values[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    @property
+    def metric_name(self) -> str:
+        return f"mrmap_proxy_{self.name}_total"
+
+    def get_samples(self) -> Dict[Tuple[str, tuple], float]:
+        return {(self.metric_name, (("key", key),)): value for key, value in self.stats.items()}
+
+
+class Histogram:
+    """Thread safe per process histogram, like prometheus histograms.
+
+    :attr name: the metric name, like ``mrmap_proxy_phase_seconds``
+    :attr label_names: the names of the labels, which are passed as tuple of values to :meth:`~Histogram.observe`
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...],
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # per label values: the counts per bucket and +Inf and the sum of all observed values
+        self._values = {}
+        self._lock = Lock()
+        _histograms.add(self)
+
+    def observe(self, labels: tuple, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def get_samples(self) -> Dict[Tuple[str, tuple], float]:
+        with self._lock:
+            values = [(labels, list(counts), total)
+                      for labels, (counts, total) in self._values.items()]
+        samples = {}
+        for labels, counts, total in values:
+            labels = tuple(zip(self.label_names, labels))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                samples[(f"{self.name}_bucket", (*labels, ("le", str(bound))))] = cumulative
+            samples[(f"{self.name}_sum", labels)] = total
+            samples[(f"{self.name}_count", labels)] = cumulative
+        return samples
+
+
+def get_samples() -> Dict[Tuple[str, tuple], float]:
+    """Return the current values of all counters and histograms of this process."""
+    samples = {}
+    for metric in (*_counters, *_histograms):
+        for key, value in metric.get_samples().items():
+            samples[key] = samples.get(key, 0) + value
+    return samples
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def render_samples(samples: Dict[Tuple[str, tuple], float]) -> str:
+    """Render the given samples in the prometheus text exposition format."""
+    families = {counters.metric_name: ("counter", f"{counters.name} counters of the security proxy")
+                for counters in _counters}
+    families.update({histogram.name: ("histogram", histogram.documentation)
+                    for histogram in _histograms})
+
+    grouped = defaultdict(list)
+    for (name, labels), value in samples.items():
+        family = name
+        if family not in families:
+            family = name.rsplit("_", 1)[0]
+        grouped[family].append((name, labels, value))
+
+    def sort_key(sample):
+        name, labels, _ = sample
+        le = dict(labels).get("le")
+        return tuple(label for label in labels if label[0] != "le"), name, float(le) if le else 0
+
+    lines = []
+    for family in sorted(grouped):
+        metric_type, documentation = families.get(family, ("untyped", ""))
+        lines.append(f"# HELP {family} {documentation}")
+        lines.append(f"# TYPE {family} {metric_type}")
+        for name, labels, value in sorted(grouped[family], key=sort_key):
+            label = ",".join(f'{label_name}="{_escape(label_value)}"' for label_name, label_value in labels)
+            value = int(value) if float(value).is_integer() else value
+            lines.append(f"{name}{{{label}}} {value}" if label else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsPublisher:
+    """Sum the metrics of all processes in redis, so the metrics endpoint of any process returns the metrics of all
+    processes.
+
+    Every ``interval`` seconds a background thread adds the increments of this process since the last publication to
+    a redis hash. With that restarted processes do not reset the sums. Without redis the metrics endpoint returns the
+    metrics of the requested process only.
+    """
+    KEY = "mrmap:metrics"
+
+    def __init__(self, interval: float = 10, use_redis: bool = False):
+        self.interval = interval
+        self.use_redis = use_redis
+        self._published = {}
+        self._lock = Lock()
+        self._thread = None
+        self._pid = None
+        self._redis = None
+
+    def _get_redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = Redis.from_url(settings.BROKER_URL)
+        return self._redis
+
+    def ensure_thread(self) -> None:
+        if not self.use_redis:
+            return
+        # the thread needs to be started again in forked worker processes
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = Thread(
+                target=self._run, name="mrmap-proxy-metrics", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.publish()
+            except RedisError as e:
+                settings.ROOT_LOGGER.warning(f"can't publish proxy metrics: {e}")
+
+    def publish(self) -> None:
+        with self._lock:
+            samples = get_samples()
+            pipeline = self._get_redis().pipeline(transaction=False)
+            for key, value in samples.items():
+                delta = value - self._published.get(key, 0)
+                if delta:
+                    pipeline.hincrbyfloat(self.KEY, json.dumps(key), delta)
+            pipeline.execute()
+            self._published = samples
+
+    def get_samples(self) -> Dict[Tuple[str, tuple], float]:
+        """Return the metrics of all processes, or of this process only if redis is not used or not reachable."""
+        if self.use_redis:
+            try:
+                self.publish()
+                return {
+                    (name, tuple(tuple(label) for label in labels)): float(value)
+                    for (name, labels), value in (
+                        (json.loads(field), value) for field, value in self._get_redis().hgetall(self.KEY).items())
+                }
+            except RedisError as e:
+                settings.ROOT_LOGGER.warning(f"can't read proxy metrics: {e}")
+        return get_samples()
+
+
+class RequestTimer:
+    """Durations of the phases of one proxied request, like ``parse``, ``security`` or ``upstream_ttfb``.
+
+    Phases can be timed from several threads, like the concurrent upstream request and mask rendering of a secured
+    GetMap request; durations of the same phase are added.
+    """
+    __slots__ = ("start", "durations", "_lock")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.durations = {}
+        self._lock = Lock()
+
+    def add(self, phase: str, seconds: float) -> None:
+        with self._lock:
+            self.durations[phase] = self.durations.get(phase, 0) + seconds
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase=name, seconds=time.perf_counter() - start)
+
+    def get_server_timing(self) -> str:
+        """Return the value of the ``Server-Timing`` header with the durations of all phases until now."""
+        with self._lock:
+            durations = list(self.durations.items())
+        durations.append(("total", time.perf_counter() - self.start))
+        return ", ".join(f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in durations)
+
+    def observe(self, service: str, operation: str, outcome: str) -> None:
+        """Record the durations of all phases and of the whole request in the proxy histograms."""
+        total = time.perf_counter() - self.start
+        with self._lock:
+            durations = list(self.durations.items())
+        for phase, seconds in durations:
+            phase_histogram.observe(
+                labels=(service, operation, outcome, phase), value=seconds)
+        request_histogram.observe(
+            labels=(service, operation, outcome), value=total)
+        metrics_publisher.ensure_thread()
+
+
+def timed_phase(phase: str):
+    """Decorator for methods of proxy views, which adds the duration of the method to the given phase of the
+    ``timer`` of the view."""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.timer.phase(phase):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_outcome(status_code: int) -> str:
+    return f"{status_code // 100}xx"
+
+
+# how GetMap requests are handled: "covered" (no mask needed), "disjoint" (no upstream request needed), "masked",
+# "preflight" (empty image, because all requested layers are out of scale or extent), "filtered" (layers the user may
+# not request are removed) or "denied" (empty image, because the user may request none of the layers)
+get_map_counters = Counters(name="get_map")
+
+phase_histogram = Histogram(
+    name="mrmap_proxy_phase_seconds",
+    documentation="Seconds spent in the phases of proxied requests",
+    label_names=("service", "operation", "outcome", "phase"),
+)
+request_histogram = Histogram(
+    name="mrmap_proxy_request_seconds",
+    documentation="Seconds until proxied requests are answered completely",
+    label_names=("service", "operation", "outcome"),
+)
+metrics_publisher = MetricsPublisher(
+    interval=settings.PROXY_METRICS_FLUSH_INTERVAL,
+    use_redis=settings.PROXY_METRICS_REDIS,
+)
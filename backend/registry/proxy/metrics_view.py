@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.views.generic.base import View
+from registry.proxy.metrics import metrics_publisher, render_samples
+
+
+class ProxyMetricsView(View):
+    """Expose the counters and latency histograms of the security proxy in the prometheus text format.
+
+    The endpoint can be requested by superusers or with ``Authorization: Bearer <settings.PROXY_METRICS_TOKEN>``.
+    """
+
+    def is_authorized(self, request) -> bool:
+        if request.user.is_superuser:
+            return True
+        authorization = request.headers.get("Authorization", "")
+        return bool(settings.PROXY_METRICS_TOKEN) and constant_time_compare(
+            authorization, f"Bearer {settings.PROXY_METRICS_TOKEN}")
+
+    def get(self, request, *args, **kwargs):
+        if not self.is_authorized(request=request):
+            return HttpResponseForbidden()
+        return HttpResponse(
+            content=render_samples(samples=metrics_publisher.get_samples()),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
@@ -1,31 +1,56 @@
 import re
+import time
 from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from typing import FrozenSet
+from urllib.parse import urlsplit
 
-from django.contrib.auth import get_user_model
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
-from django.core.files.base import ContentFile
-from django.db import transaction
+from django.core.files.base import File
 from django.db.models.functions import datetime
 from django.http import HttpResponse, StreamingHttpResponse
 from django.http.response import Http404
 from django.template.loader import render_to_string
+from django.utils.cache import (get_conditional_response,
+                                patch_vary_headers)
 from django.utils.decorators import method_decorator
+from django.utils.http import http_date
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.base import View
 from ows_lib.client.mixins import OgcClient
 from ows_lib.models.ogc_request import OGCRequest
-from registry.models.security import HttpRequestLog, HttpResponseLog
+from registry.enums.service import OGCOperationEnum
 from registry.models.service import OgcService
+from registry.proxy.capabilities import capabilities_render_cache
+from registry.proxy.compression import (get_accepted_encoding,
+                                        patch_content_encoding)
+from registry.proxy.hedging import hedger
+from registry.proxy.log_writer import (ProxyLogEntry, get_response_content,
+                                       proxy_log_writer)
+from registry.proxy.metrics import RequestTimer, get_outcome
 from registry.proxy.ogc_exceptions import (DisabledException,
                                            ForbiddenException,
                                            MissingRequestParameterException,
                                            MissingVersionParameterException)
 from registry.proxy.ogc_exceptions import \
     NotImplementedError as MrMapNotImplementedError
+from registry.proxy.sessions import (RemoteResponse,
+                                     async_upstream_client_registry)
+from registry.proxy.single_flight import single_flight
+from registry.proxy.upstream_guard import (CLOSED, circuit_breaker,
+                                           concurrency_limiter,
+                                           get_unavailable_response,
+                                           is_failure)
 from registry.settings import SECURE_ABLE_OPERATIONS_LOWER
-from requests import Request
+from requests import PreparedRequest, Request
 from requests.exceptions import ConnectionError as ConnectionErrorException
-from requests.exceptions import ConnectTimeout as ConnectTimeoutException
+from requests.exceptions import Timeout as TimeoutException
+
+KNOWN_OPERATIONS_LOWER = frozenset(
+    operation.lower() for operation in OGCOperationEnum.values)
 
 
 @method_decorator(csrf_exempt, name="dispatch")
@@ -41,6 +66,14 @@ class OgcServiceProxyView(View):
     start_time = None
     _service = None
     _remote_service = None
+    _timer = None
+
+    @property
+    def timer(self) -> RequestTimer:
+        """The durations of the phases of the current request."""
+        if self._timer is None:
+            self._timer = RequestTimer()
+        return self._timer
 
     @property
     def is_get_request(self) -> bool:
@@ -54,9 +87,15 @@ class OgcServiceProxyView(View):
     def service(self) -> OgcService:
         if not self._service:
             try:
-                self._service = self.service_cls.security.get_with_security_info(
-                    pk=self.kwargs.get("pk"), request=self.ogc_request
-                )
+                with self.timer.phase("security"):
+                    if settings.PROXY_SECURITY_POLICY_SNAPSHOT:
+                        self._service = self.service_cls.security.get_with_security_policy(
+                            pk=self.kwargs.get("pk"), request=self.ogc_request
+                        )
+                    else:
+                        self._service = self.service_cls.security.get_with_security_info(
+                            pk=self.kwargs.get("pk"), request=self.ogc_request
+                        )
             except ObjectDoesNotExist:
                 raise Http404
         return self._service
@@ -69,7 +108,9 @@ class OgcServiceProxyView(View):
     @property
     def remote_service(self) -> OgcClient:
         if not self._remote_service:
-            self._remote_service = self.service.client
+            service = self.service
+            with self.timer.phase("client"):
+                self._remote_service = service.client
         return self._remote_service
 
     def analyze_request(self):
@@ -78,14 +119,66 @@ class OgcServiceProxyView(View):
 
     def dispatch(self, request, *args, **kwargs):
         self.start_time = datetime.datetime.now()
-        self.ogc_request = OGCRequest.from_django_request(request)
+        self._timer = RequestTimer()
+        with self.timer.phase("parse"):
+            self.ogc_request = OGCRequest.from_django_request(request)
 
         exception = self.check_request()
         if exception:
-            return exception
+            return self.finish_timing(response=exception)
         self.analyze_request()
 
-        return self.get_and_post(request=request, *args, **kwargs)
+        return self.finish_timing(response=self.get_and_post(request=request, *args, **kwargs))
+
+    def get_timing_labels(self, response) -> dict:
+        operation = (getattr(self, "ogc_request", None) and self.ogc_request.operation or "").lower()
+        return {
+            # labels of unknown services and operations are not recorded, so clients can't flood the metrics
+            "service": str(self._service.pk) if self._service else "unknown",
+            "operation": operation if operation in KNOWN_OPERATIONS_LOWER else "other",
+            "outcome": get_outcome(status_code=response.status_code),
+        }
+
+    def finish_timing(self, response):
+        """Record the phase durations of the request in the proxy histograms; if ``settings.PROXY_SERVER_TIMING`` is
+        set, the durations until now are send as ``Server-Timing`` header.
+
+        Streamed responses are recorded after the last chunk was send; the body transfer is the
+        ``upstream_download`` phase.
+        """
+        if settings.PROXY_SERVER_TIMING:
+            response.headers["Server-Timing"] = self.timer.get_server_timing()
+        if not settings.PROXY_METRICS:
+            return response
+        labels = self.get_timing_labels(response=response)
+        if not response.streaming:
+            self.timer.observe(**labels)
+        elif response.is_async:
+            response.streaming_content = self._atime_stream(
+                streaming_content=response.streaming_content, labels=labels)
+        else:
+            response.streaming_content = self._time_stream(
+                streaming_content=response.streaming_content, labels=labels)
+        return response
+
+    def _time_stream(self, streaming_content, labels: dict):
+        start = time.perf_counter()
+        try:
+            yield from streaming_content
+        finally:
+            self.timer.add(phase="upstream_download",
+                           seconds=time.perf_counter() - start)
+            self.timer.observe(**labels)
+
+    async def _atime_stream(self, streaming_content, labels: dict):
+        start = time.perf_counter()
+        try:
+            async for chunk in streaming_content:
+                yield chunk
+        finally:
+            self.timer.add(phase="upstream_download",
+                           seconds=time.perf_counter() - start)
+            self.timer.observe(**labels)
 
     def check_request(self):
         if not self.ogc_request.operation:
@@ -133,13 +226,15 @@ class OgcServiceProxyView(View):
         ):
             # seperated from elif below, cause security.for_security_facade does not fill the fields like is_secured,
             # is_spatial_secured, is_user_principle_entitled...
-            return self.return_http_response(response=self.get_remote_response())
+            return self.return_streaming_http_response(
+                response=self.get_remote_response(stream=True))
         elif (
             not self.service.is_secured
             or not self.service.is_spatial_secured
             and self.service.is_user_principle_entitled
         ):
-            return self.return_http_response(response=self.get_remote_response())
+            return self.return_streaming_http_response(
+                response=self.get_remote_response(stream=True))
         elif (
             self.service.is_spatial_secured and self.service.is_user_principle_entitled
         ):
@@ -154,13 +249,46 @@ class OgcServiceProxyView(View):
         """Return the camouflaged capabilities document of the founded service.
         .. note::
            See :meth:`registry.models.document.DocumentModelMixin.xml_secured` for details of xml_secured function.
+           The rendered document is cached by :class:`registry.proxy.capabilities.CapabilitiesRenderCache`; clients
+           which send a matching ``If-None-Match`` or ``If-Modified-Since`` header get a ``304 Not Modified``.
         :return: the camouflaged capabilities document.
         :rtype: :class:`django.http.response.HttpResponse`
         """
         # todo: handle different service versions
-        return HttpResponse(
-            status=200, content=self.service.get_capabilitites_for_request(self.request), content_type="application/xml"
-        )
+        visible_entities = self.get_visible_entities()
+        capabilities = capabilities_render_cache.get_or_render(
+            service=self.service,
+            request=self.request,
+            service_version=self.ogc_request.service_version,
+            visible_layer_identifiers=visible_entities)
+        response = get_conditional_response(
+            request=self.request, etag=capabilities.etag, last_modified=capabilities.last_modified)
+        encoding = get_accepted_encoding(
+            request=self.request) if settings.PROXY_COMPRESSION else None
+        if response is None:
+            response = HttpResponse(
+                status=200,
+                content=capabilities.get_encoded(
+                    encoding=encoding) if encoding else capabilities.content,
+                content_type="application/xml"
+            )
+        response.headers["ETag"] = capabilities.etag
+        response.headers["Last-Modified"] = http_date(
+            capabilities.last_modified)
+        if settings.PROXY_COMPRESSION:
+            patch_vary_headers(response, ("Accept-Encoding",))
+            if encoding and response.status_code == 200:
+                # the compressed variant is cached with the document
+                patch_content_encoding(response=response, encoding=encoding)
+        if visible_entities is not None:
+            # the document depends on the groups of the requesting user
+            patch_vary_headers(response, ("Cookie", "Authorization"))
+        return response
+
+    def get_visible_entities(self) -> FrozenSet[str]:
+        """Hook method to return the lower cased identifiers of the entities, which are listed in the capabilities
+        document for the requesting user; ``None`` lists all entities."""
+        return None
 
     def secure_request(self):
         """Handler to decide which subroutine for the given request param shall run.
@@ -169,12 +297,15 @@ class OgcServiceProxyView(View):
         """
         raise NotImplementedError()
 
-    def get_remote_response(self, request: Request = None):
+    def get_remote_response(self, request: Request = None, stream: bool = False):
         """Perform a request to the :attr:`~GenericOwsServiceOperationFacade.remote_service` with the given
         query parameters or if ``request`` is provided this request is performed.
         :param request: a prepared request which shall used instead of the constructed request from the remote
                         service.
         :type request: :class:`requests.models.Request`, optional
+        :param stream: if true, only the headers are read; the body needs to be consumed by
+                       :meth:`~OgcServiceProxyView.return_streaming_http_response`.
+        :type stream: bool, optional
         :return: the response of the remote service
         :rtype: :class:`requests.models.Response` or dict with ``status_code``, ``content`` and ``code`` if any
                 error occurs.
@@ -184,11 +315,111 @@ class OgcServiceProxyView(View):
                 request=self.ogc_request
             )
 
+        if not stream and self.is_single_flight_request(request=request):
+            # concurrent identical requests share one completely read response of the remote service; streamed
+            # responses are passed through chunk by chunk instead, so they are never coalesced
+            prepared_request = request.prepare()
+            return single_flight.do(
+                key=single_flight.get_key(
+                    service_pk=self.service.pk,
+                    request=prepared_request,
+                    security_context=self.get_security_context(),
+                ),
+                func=lambda: self._send_hedged_request(
+                    request=prepared_request, stream=False, shared=True),
+            )
+        return self._send_hedged_request(request=request.prepare(), stream=stream)
+
+    def is_single_flight_request(self, request: Request) -> bool:
+        """Return true if the given request can be coalesced with identical concurrent requests."""
+        return (
+            settings.PROXY_SINGLE_FLIGHT
+            and request.method.upper() == "GET"
+            and self.ogc_request.operation.lower() in settings.PROXY_SINGLE_FLIGHT_OPERATIONS
+        )
+
+    def is_hedged_request(self, request: Request) -> bool:
+        """Return true if the given request is idempotent, so a second identical request can be sent if it is slow."""
+        return (
+            settings.PROXY_HEDGE
+            and request.method.upper() == "GET"
+            and self.ogc_request.operation.lower() in settings.PROXY_HEDGE_OPERATIONS
+        )
+
+    def _send_hedged_request(self, request: PreparedRequest, stream: bool = False, shared: bool = False):
+        if not self.is_hedged_request(request=request):
+            return self._send_guarded_request(request=request, stream=stream, shared=shared)
+        # the attempts may run concurrently in other threads; only the durations of the winner are added to the timer
+        attempts = []
+
+        def attempt():
+            timer = RequestTimer()
+            response = self._send_guarded_request(
+                request=request, stream=stream, shared=shared, timer=timer)
+            attempts.append((response, timer))
+            return response
+
+        response = hedger.do(
+            key=(self.service.pk, self.ogc_request.operation.lower()),
+            func=attempt,
+        )
+        for _response, timer in list(attempts):
+            if _response is response:
+                for phase, seconds in timer.durations.items():
+                    self.timer.add(phase=phase, seconds=seconds)
+                break
+        return response
+
+    def _send_guarded_request(self, request: PreparedRequest, stream: bool = False, shared: bool = False,
+                              timer: RequestTimer = None):
+        """Send the request, if the circuit of the service is not open and a slot of the remote host is free.
+
+        The slot is held until the response headers (or the whole body, if not streamed) are received.
+        """
+        mode = circuit_breaker.allow(
+            service_pk=self.service.pk) if settings.PROXY_CIRCUIT_BREAKER else CLOSED
+        if mode is None:
+            return get_unavailable_response(message="the remote service is temporarily unavailable.")
+        with concurrency_limiter.limit_host(host=urlsplit(request.url).netloc) as acquired:
+            if not acquired:
+                circuit_breaker.cancel(service_pk=self.service.pk, mode=mode)
+                return get_unavailable_response(message="the remote service is busy.")
+            r = self._send_remote_request(
+                request=request, stream=stream, shared=shared, timer=timer)
+        if settings.PROXY_CIRCUIT_BREAKER:
+            circuit_breaker.record(
+                service_pk=self.service.pk, mode=mode, success=not is_failure(response=r))
+        return r
+
+    def get_security_context(self) -> tuple:
+        """Return the allowed areas which are applied to the response, so responses are only shared between requests
+        with the same security context."""
+        return tuple(sorted(
+            pk for pk in getattr(self.service, "allowed_area_pks", None) or [] if pk is not None))
+
+    def _send_remote_request(self, request: PreparedRequest, stream: bool = False, shared: bool = False,
+                             timer: RequestTimer = None):
+        timer = timer or self.timer
         r = {}
+        session = self.remote_service.session
+        timeout = getattr(session, "timeout", settings.PROXY_UPSTREAM_TIMEOUT)
+        start = time.perf_counter()
         try:
-            r = self.remote_service.send_request(request)
-        except ConnectTimeoutException:
-            # response with GatewayTimeout; the remote service response not in timeout
+            if stream:
+                r = session.send(request=request, timeout=timeout, stream=True)
+            elif shared:
+                r = RemoteResponse.from_requests(
+                    response=session.send(request=request, timeout=timeout))
+            else:
+                r = session.send(request=request, timeout=timeout)
+            # the elapsed time of requests ends with the parsed headers; the rest is spent for the body
+            ttfb = min(r.elapsed.total_seconds(), time.perf_counter() - start)
+            timer.add(phase="upstream_ttfb", seconds=ttfb)
+            if not stream:
+                timer.add(phase="upstream_download",
+                          seconds=time.perf_counter() - start - ttfb)
+        except TimeoutException:
+            # response with GatewayTimeout; the remote service doesn't connect or response in time
             r.update(
                 {
                     "status_code": 504,
@@ -216,77 +447,59 @@ class OgcServiceProxyView(View):
             )
         return r
 
-    def log_response(self, response):
-        """Check if response logging is active. If so, the request and response will be logged."""
-        if self.service.log_response:
-            with transaction.atomic():
-                if self.request.user.username == "":
-                    user = get_user_model().objects.get(username="AnonymousUser")
-                else:
-                    user = self.request.user
-                regex = re.compile("^HTTP_")
-                headers = dict(
-                    (regex.sub("", header), value)
-                    for (header, value) in self.request.META.items()
-                    if header.startswith("HTTP_")
-                )
-                request_log = HttpRequestLog(
-                    timestamp=self.start_time,
-                    elapsed=datetime.datetime.now() - self.start_time,
-                    method=self.request.method,
-                    url=self.request.get_full_path(),
-                    headers=headers,
-                    service=self.service,
-                    user=user,
-                )
-                if self.request.body:
-                    content_type = self.request.content_type
-                    if "/" in content_type:
-                        content_type = content_type.split("/")[-1]
-                    request_log.body.save(
-                        name=f'{self.start_time.strftime("%Y_%m_%d-%I_%M_%S_%p")}.{content_type}',
-                        content=ContentFile(self.request.body),
-                    )
-                else:
-                    request_log.save()
-                if isinstance(response, dict):
-                    response_log = HttpResponseLog(
-                        status_code=response.get("status_code"),
-                        reason=response.get("reason"),
-                        elapsed=response.get("elapsed"),
-                        headers=response.get("headers"),
-                        url=response.get("url"),
-                        request=request_log,
-                    )
-                    if response.get("content", None):
-                        content_type = response.get("content_type")
-                        if "/" in content_type:
-                            content_type = content_type.split("/")[-1]
-                        response_log.content.save(
-                            name=f'{self.start_time.strftime("%Y_%m_%d-%I_%M_%S_%p")}.{content_type}',
-                            content=ContentFile(response.get("content")),
-                        )
-                    else:
-                        response_log.save()
-                else:
-                    response_log = HttpResponseLog(
-                        status_code=response.status_code,
-                        reason=response.reason,
-                        elapsed=response.elapsed,
-                        headers=dict(response.headers),
-                        url=response.url,
-                        request=request_log,
-                    )
-                    if response.content:
-                        content_type = response.headers.get("content-type")
-                        if "/" in content_type:
-                            content_type = content_type.split("/")[-1]
-                        response_log.content.save(
-                            name=f'{self.start_time.strftime("%Y_%m_%d-%I_%M_%S_%p")}.{content_type}',
-                            content=ContentFile(response.content),
-                        )
-                    else:
-                        response_log.save()
+    def log_response(self, response, content: File = None):
+        """Check if response logging is active. If so, the request and response are passed to the
+        :class:`registry.proxy.log_writer.ProxyLogWriter`, which writes them in the background.
+
+        :param content: the content of a streamed response, which can not be read from the response anymore.
+        :type content: :class:`django.core.files.base.File`, optional
+        """
+        if not self.service.log_response:
+            if content is not None:
+                content.close()
+            return
+        with self.timer.phase("log"):
+            self._log_response(response=response, content=content)
+
+    def _log_response(self, response, content: File = None):
+        regex = re.compile("^HTTP_")
+        headers = dict(
+            (regex.sub("", header), value)
+            for (header, value) in self.request.META.items()
+            if header.startswith("HTTP_")
+        )
+        entry = ProxyLogEntry(
+            service_cls=self.service_cls,
+            service_pk=self.service.pk,
+            user_pk=self.request.user.pk,
+            timestamp=self.start_time,
+            elapsed=datetime.datetime.now() - self.start_time,
+            method=self.request.method,
+            url=self.request.get_full_path(),
+            headers=headers,
+            request_body=self.request.body,
+            request_content_type=self.request.content_type,
+        )
+        if isinstance(response, dict):
+            entry.status_code = response.get("status_code")
+            entry.reason = response.get("reason")
+            entry.response_elapsed = response.get("elapsed")
+            entry.response_headers = response.get("headers")
+            entry.response_url = response.get("url")
+            entry.response_content_type = response.get("content_type")
+            if content is None:
+                content = get_response_content(response.get("content", None))
+        else:
+            entry.status_code = response.status_code
+            entry.reason = response.reason
+            entry.response_elapsed = response.elapsed
+            entry.response_headers = dict(response.headers)
+            entry.response_url = response.url
+            entry.response_content_type = response.headers.get("content-type")
+            if content is None:
+                content = get_response_content(response.content)
+        entry.response_content = content
+        proxy_log_writer.log(entry=entry)
 
     def return_http_response(self, response):
         """Return the http response for the client.
@@ -308,7 +521,8 @@ class OgcServiceProxyView(View):
             content_type = response.headers.get("content-type")
             content_disposition = response.headers.get(
                 "content-disposition", None)
-            content_encoding = response.headers.get("content-encoding", None)
+            content_encoding = None if isinstance(
+                response, RemoteResponse) else response.headers.get("content-encoding", None)
             if content_disposition:
                 headers.update({"Content-Disposition": content_disposition})
             if content_encoding:
@@ -339,3 +553,305 @@ class OgcServiceProxyView(View):
 
         self.log_response(response=response)
         return computed_response
+
+    def return_streaming_http_response(self, response):
+        """Return the response of the remote service to the client without buffering the body.
+
+        The headers are send as soon as they are received from the remote service; the body is passed through chunk
+        by chunk. If response logging is active, the decoded body is spooled to a temporary file while it is streamed
+        and logged after the last chunk was send.
+
+        :param response: the response of :meth:`~OgcServiceProxyView.get_remote_response` with ``stream=True``
+        :type response: :class:`requests.models.Response` or dict
+        :return: the streamed response or an ows exception report if ``isinstance(response, dict) == True``.
+        :rtype: :class:`django.http.response.StreamingHttpResponse` or :class:`django.http.response.HttpResponse`
+        """
+        if isinstance(response, dict):
+            return self.return_http_response(response=response)
+
+        headers = {}
+        content_disposition = response.headers.get("content-disposition", None)
+        if content_disposition:
+            headers.update({"Content-Disposition": content_disposition})
+
+        if isinstance(response, RemoteResponse):
+            # a shared response is already read and decoded
+            streaming_content = response.iter_content(
+                chunk_size=settings.PROXY_STREAM_CHUNK_SIZE)
+            self.log_response(response=response)
+        elif self.service.log_response:
+            # the analysis of the logged content needs the decoded body
+            streaming_content = self._tee_content(
+                response=response,
+                spool=SpooledTemporaryFile(
+                    max_size=settings.PROXY_LOG_SPOOL_MAX_MEMORY),
+            )
+        else:
+            # pass the body through as it is, so the compression of the remote service is kept
+            for header in ("Content-Encoding", "Content-Length"):
+                if response.headers.get(header, None):
+                    headers.update({header: response.headers.get(header)})
+            streaming_content = self._iter_raw_content(response=response)
+
+        return StreamingHttpResponse(
+            status=response.status_code,
+            streaming_content=streaming_content,
+            content_type=response.headers.get("content-type"),
+            headers=headers,
+        )
+
+    def _iter_raw_content(self, response):
+        try:
+            yield from response.raw.stream(settings.PROXY_STREAM_CHUNK_SIZE, decode_content=False)
+        finally:
+            # release the connection to the pool, even if the client disconnects
+            response.close()
+
+    def _tee_content(self, response, spool: SpooledTemporaryFile):
+        completed = False
+        try:
+            for chunk in response.iter_content(chunk_size=settings.PROXY_STREAM_CHUNK_SIZE):
+                spool.write(chunk)
+                yield chunk
+            completed = True
+        finally:
+            response.close()
+            if not completed:
+                # only complete responses are logged
+                spool.close()
+        spool.seek(0)
+        # the spool is closed by the log writer
+        self.log_response(response=response, content=File(spool))
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncOgcServiceProxyView(OgcServiceProxyView):
+    """Asyncio variant of :class:`OgcServiceProxyView` for asgi deployments.
+
+    Requests to remote services are send with a pooled :class:`httpx.AsyncClient`, so a worker does not need a
+    thread per pending upstream request. Database lookups and cpu bound image processing run in the thread pool of
+    :func:`asgiref.sync.sync_to_async`.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.start_time = datetime.datetime.now()
+        self._timer = RequestTimer()
+        with self.timer.phase("parse"):
+            self.ogc_request = OGCRequest.from_django_request(request)
+
+        exception = self.check_request()
+        if exception:
+            return self.finish_timing(response=exception)
+        self.analyze_request()
+
+        return self.finish_timing(response=await self.get_and_post(request=request, *args, **kwargs))
+
+    async def post(self, request, *args, **kwargs):
+        return await self.get_and_post(request=request, *args, **kwargs)
+
+    async def get(self, request, *args, **kwargs):
+        return await self.get_and_post(request=request, *args, **kwargs)
+
+    def load_service(self):
+        """Fetch the service with its security information and the client to request the remote service."""
+        if not self.ogc_request.is_get_capabilities_request:
+            return self.remote_service
+        return self.service
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        return async_upstream_client_registry.get_client(session=self.remote_service.session)
+
+    async def get_and_post(self, request, *args, **kwargs):
+        """Async variant of :meth:`OgcServiceProxyView.get_and_post` with the same security case decisioning."""
+        await sync_to_async(self.load_service)()
+
+        if self.ogc_request.is_get_capabilities_request:
+            return await sync_to_async(self.get_capabilities)()
+        elif not self.service.is_active:
+            return DisabledException(ogc_request=self.ogc_request)
+        elif (
+            self.ogc_request.operation.lower() not in SECURE_ABLE_OPERATIONS_LOWER
+        ):
+            return await self.areturn_streaming_http_response(
+                response=await self.aget_remote_response(stream=True))
+        elif (
+            not self.service.is_secured
+            or not self.service.is_spatial_secured
+            and self.service.is_user_principle_entitled
+        ):
+            return await self.areturn_streaming_http_response(
+                response=await self.aget_remote_response(stream=True))
+        elif (
+            self.service.is_spatial_secured and self.service.is_user_principle_entitled
+        ):
+            try:
+                return await self.asecure_request()
+            except NotImplementedError:
+                return MrMapNotImplementedError(ogc_request=self.ogc_request)
+        else:
+            return ForbiddenException(ogc_request=self.ogc_request)
+
+    async def asecure_request(self):
+        """Async variant of :meth:`OgcServiceProxyView.secure_request`."""
+        raise NotImplementedError()
+
+    async def aget_remote_response(self, request: Request = None, stream: bool = False):
+        """Async variant of :meth:`OgcServiceProxyView.get_remote_response`.
+
+        :return: the completely read response as :class:`registry.proxy.sessions.RemoteResponse`, the
+                 :class:`httpx.Response` with unread body if ``stream`` is true or dict with ``status_code``,
+                 ``content`` and ``code`` if any error occurs.
+        """
+        if not request:
+            request = self.remote_service.bypass_request(
+                request=self.ogc_request
+            )
+        prepared_request = request.prepare()
+        if self.is_hedged_request(request=prepared_request):
+            return await hedger.ado(
+                key=(self.service.pk, self.ogc_request.operation.lower()),
+                func=lambda: self._asend_guarded_request(
+                    request=prepared_request, stream=stream),
+            )
+        return await self._asend_guarded_request(request=prepared_request, stream=stream)
+
+    async def _asend_guarded_request(self, request: PreparedRequest, stream: bool = False):
+        """Async variant of :meth:`OgcServiceProxyView._send_guarded_request`."""
+        mode = await sync_to_async(circuit_breaker.allow, thread_sensitive=False)(
+            service_pk=self.service.pk) if settings.PROXY_CIRCUIT_BREAKER else CLOSED
+        if mode is None:
+            return get_unavailable_response(message="the remote service is temporarily unavailable.")
+        async with concurrency_limiter.alimit_host(host=urlsplit(request.url).netloc) as acquired:
+            if not acquired:
+                await sync_to_async(circuit_breaker.cancel, thread_sensitive=False)(
+                    service_pk=self.service.pk, mode=mode)
+                return get_unavailable_response(message="the remote service is busy.")
+            r = await self._asend_remote_request(request=request, stream=stream)
+        if settings.PROXY_CIRCUIT_BREAKER:
+            await sync_to_async(circuit_breaker.record, thread_sensitive=False)(
+                service_pk=self.service.pk, mode=mode, success=not is_failure(response=r))
+        return r
+
+    async def _asend_remote_request(self, request: PreparedRequest, stream: bool = False):
+        prepared_request = request
+        r = {}
+        try:
+            client = self.async_client
+            start = time.perf_counter()
+            # the body is always read separately, so the time to the first byte can be measured
+            response = await client.send(
+                client.build_request(
+                    method=prepared_request.method,
+                    url=prepared_request.url,
+                    headers=dict(prepared_request.headers),
+                    content=prepared_request.body,
+                ),
+                stream=True,
+            )
+            ttfb = time.perf_counter() - start
+            self.timer.add(phase="upstream_ttfb", seconds=ttfb)
+            if stream:
+                r = response
+            else:
+                try:
+                    await response.aread()
+                finally:
+                    await response.aclose()
+                self.timer.add(phase="upstream_download",
+                               seconds=time.perf_counter() - start - ttfb)
+                r = RemoteResponse.from_httpx(response=response)
+        except httpx.TimeoutException:
+            # response with GatewayTimeout; the remote service doesn't connect or response in time
+            r.update(
+                {
+                    "status_code": 504,
+                    "code": "MaxResponseTimeExceeded",
+                    "content": "remote service didn't response in time.",
+                }
+            )
+        except httpx.ConnectError:
+            # response with Bad Gateway; we can't connect to the remote service
+            r.update(
+                {
+                    "status_code": 502,
+                    "code": "MaxRetriesExceeded",
+                    "content": "can't reach remote service.",
+                }
+            )
+        except Exception as e:
+            settings.ROOT_LOGGER.exception(e)
+            r.update(
+                {
+                    "status_code": 500,
+                    "code": "InternalServerError",
+                    "content": f"{type(e).__name__} raised in function aget_remote_response()",
+                }
+            )
+        return r
+
+    async def areturn_http_response(self, response):
+        """Async variant of :meth:`OgcServiceProxyView.return_http_response`; the logging needs the database."""
+        return await sync_to_async(self.return_http_response)(response=response)
+
+    async def areturn_streaming_http_response(self, response):
+        """Async variant of :meth:`OgcServiceProxyView.return_streaming_http_response`."""
+        if isinstance(response, dict):
+            return await self.areturn_http_response(response=response)
+
+        headers = {}
+        content_disposition = response.headers.get("content-disposition", None)
+        if content_disposition:
+            headers.update({"Content-Disposition": content_disposition})
+
+        if isinstance(response, RemoteResponse):
+            # a shared response is already read and decoded
+            streaming_content = response.iter_content(
+                chunk_size=settings.PROXY_STREAM_CHUNK_SIZE)
+            await sync_to_async(self.log_response)(response=response)
+        elif self.service.log_response:
+            # the analysis of the logged content needs the decoded body
+            streaming_content = self._atee_content(
+                response=response,
+                spool=SpooledTemporaryFile(
+                    max_size=settings.PROXY_LOG_SPOOL_MAX_MEMORY),
+            )
+        else:
+            # pass the body through as it is, so the compression of the remote service is kept
+            for header in ("Content-Encoding", "Content-Length"):
+                if response.headers.get(header, None):
+                    headers.update({header: response.headers.get(header)})
+            streaming_content = self._aiter_raw_content(response=response)
+
+        return StreamingHttpResponse(
+            status=response.status_code,
+            streaming_content=streaming_content,
+            content_type=response.headers.get("content-type"),
+            headers=headers,
+        )
+
+    async def _aiter_raw_content(self, response: httpx.Response):
+        try:
+            async for chunk in response.aiter_raw(chunk_size=settings.PROXY_STREAM_CHUNK_SIZE):
+                yield chunk
+        finally:
+            # release the connection to the pool, even if the client disconnects
+            await response.aclose()
+
+    async def _atee_content(self, response: httpx.Response, spool: SpooledTemporaryFile):
+        completed = False
+        try:
+            async for chunk in response.aiter_bytes(chunk_size=settings.PROXY_STREAM_CHUNK_SIZE):
+                spool.write(chunk)
+                yield chunk
+            completed = True
+        finally:
+            await response.aclose()
+            if not completed:
+                # only complete responses are logged
+                spool.close()
+        spool.seek(0)
+        # the spool is closed by the log writer
+        await sync_to_async(self.log_response)(
+            response=RemoteResponse.from_httpx(response=response, content=b""),
+            content=File(spool))
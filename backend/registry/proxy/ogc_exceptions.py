@@ -84,6 +84,31 @@ class LayerNotDefined(OGCServiceException):
     locator = "LAYERS"
 
 
+class InvalidCRS(OGCServiceException):
+    locator = "crs"
+    message = "the requested crs is not supported by the requested layers."
+
+    @property
+    def code(self):
+        return "InvalidSRS" if self.ogc_request.service_version.startswith("1.1") else "InvalidCRS"
+
+    def get_locator(self):
+        return "srs" if self.ogc_request.service_version.startswith("1.1") else "crs"
+
+
+class InvalidParameterValue(OGCServiceException):
+    # wmts clients expect an http error status (OGC 07-057r7, 8.2.1)
+    status_code = 400
+    code = "InvalidParameterValue"
+    message = "the value of a parameter is invalid."
+
+
+class TileOutOfRange(OGCServiceException):
+    status_code = 400
+    code = "TileOutOfRange"
+    message = "the requested tile is outside of the tile matrix set."
+
+
 class RuntimeError(OGCServiceException):
     code = "RuntimeError"
     message = "Something unexpected did occur. Please contact the service provider."
@@ -0,0 +1,137 @@
+import math
+from functools import lru_cache
+from typing import Dict, Iterable, Tuple
+
+from django.contrib.gis.gdal import SpatialReference
+from django.contrib.gis.geos import GEOSGeometry
+
+# standardized rendering pixel size of 0.28mm (OGC 06-042, 7.2.4.6.9)
+PIXEL_SIZE = 0.00028
+# meters per degree at the equator
+METERS_PER_DEGREE = 111319.49079327358
+
+
+@lru_cache(maxsize=256)
+def get_meters_per_unit(srid: int) -> float:
+    srs = SpatialReference(srid)
+    if srs.geographic:
+        return METERS_PER_DEGREE
+    return srs.linear_units or 1.0
+
+
+def get_scale_denominator(bbox: GEOSGeometry, width: int, height: int) -> float:
+    """Return the scale denominator of a GetMap request, like wms 1.3.0 Min/MaxScaleDenominator are defined."""
+    min_x, _, max_x, _ = bbox.extent
+    return (max_x - min_x) / width * get_meters_per_unit(srid=bbox.srid) / PIXEL_SIZE
+
+
+def get_scale_hint(bbox: GEOSGeometry, width: int, height: int) -> float:
+    """Return the diagonal ground size of a pixel of a GetMap request, like wms 1.1.1 ScaleHint is defined."""
+    min_x, min_y, max_x, max_y = bbox.extent
+    meters_per_unit = get_meters_per_unit(srid=bbox.srid)
+    return math.hypot((max_x - min_x) / width * meters_per_unit, (max_y - min_y) / height * meters_per_unit)
+
+
+def get_scale(bbox: GEOSGeometry, width: int, height: int, version: str) -> float:
+    """Return the scale of a GetMap request like the given wms version defines it: the scale hint for 1.1.x and the
+    scale denominator otherwise."""
+    if version.startswith("1.1"):
+        return get_scale_hint(bbox=bbox, width=width, height=height)
+    return get_scale_denominator(bbox=bbox, width=width, height=height)
+
+
+def convert_scale(scale: float, from_version: str, to_version: str) -> float:
+    """Convert a scale hint to a scale denominator or the other way round, if the wms versions differ; square pixels
+    are assumed, so the diagonal of a pixel is ``sqrt(2)`` times its width."""
+    from_hint, to_hint = from_version.startswith("1.1"), to_version.startswith("1.1")
+    if from_hint and not to_hint:
+        return scale / math.sqrt(2) / PIXEL_SIZE
+    if to_hint and not from_hint:
+        return scale * PIXEL_SIZE * math.sqrt(2)
+    return scale
+
+
+def normalize_crs(crs: str) -> str:
+    """Return the given crs like ``EPSG:4326``; urns like ``urn:ogc:def:crs:EPSG::4326`` are shortened."""
+    crs = (crs or "").strip().upper()
+    if crs.startswith("URN:OGC:DEF:CRS:"):
+        parts = crs.split(":")
+        return f"{parts[4]}:{parts[-1]}"
+    return crs
+
+
+class LayerAttributes:
+    """Inherited attributes of a single layer, which decide if a GetMap request can be answered without the remote
+    service.
+
+    :attr scale_min: the min scale denominator (wms 1.3.0) or min scale hint (wms 1.1.1)
+    :attr scale_max: the max scale denominator (wms 1.3.0) or max scale hint (wms 1.1.1)
+    :attr extent: the lat/lon bbox as ``(min_x, min_y, max_x, max_y)`` in lon/lat axis order
+    :attr reference_systems: the normalized crs identifiers, like ``EPSG:4326``
+    """
+    __slots__ = ("scale_min", "scale_max", "extent", "reference_systems")
+
+    def __init__(self, scale_min: float = None, scale_max: float = None, extent: Tuple[float, float, float, float] = None,
+                 reference_systems: Iterable[str] = ()):
+        self.scale_min = scale_min
+        self.scale_max = scale_max
+        self.extent = extent
+        self.reference_systems = frozenset(reference_systems)
+
+    def is_in_scale_range(self, scale: float, tolerance: float = 0) -> bool:
+        """The scale range is extended by the relative ``tolerance``, because remote services may compute the scale
+        with another pixel size, like 72 dpi instead of 0.28mm."""
+        return (
+            (self.scale_min is None or scale >= self.scale_min * (1 - tolerance))
+            and (self.scale_max is None or scale <= self.scale_max * (1 + tolerance))
+        )
+
+    def intersects(self, extent: Tuple[float, float, float, float], tolerance: float = 0) -> bool:
+        """The extent of the layer is extended by the relative ``tolerance`` of its width and height."""
+        if self.extent is None:
+            return True
+        buffer_x = (self.extent[2] - self.extent[0]) * tolerance
+        buffer_y = (self.extent[3] - self.extent[1]) * tolerance
+        return not (
+            extent[2] < self.extent[0] - buffer_x or extent[0] > self.extent[2] + buffer_x
+            or extent[3] < self.extent[1] - buffer_y or extent[1] > self.extent[3] + buffer_y
+        )
+
+    def supports(self, crs: str) -> bool:
+        """Layers without any known reference system are not checked."""
+        return not self.reference_systems or normalize_crs(crs) in self.reference_systems
+
+
+def compile_layer_attributes(layers: Iterable[tuple], reference_systems: Iterable[tuple]) -> Dict[str, LayerAttributes]:
+    """Compute the inherited attributes of all layers of a service.
+
+    Scale ranges and bboxes of the nearest ancestor are inherited, if the layer does not declare its own; reference
+    systems are added to the ones of all ancestors (OGC 06-042, 7.2.4.8).
+
+    :param layers: tuples of ``(pk, identifier, tree id, lft, rgt, scale_min, scale_max, bbox_lat_lon)``
+    :param reference_systems: tuples of ``(layer pk, prefix, code)``
+    :return: the attributes per lower cased layer identifier
+    """
+    own_reference_systems = {}
+    for layer_pk, prefix, code in reference_systems:
+        own_reference_systems.setdefault(layer_pk, set()).add(
+            normalize_crs(f"{prefix}:{code}" if prefix else code))
+
+    layer_attributes = {}
+    ancestors = []
+    for pk, identifier, tree, lft, rgt, scale_min, scale_max, bbox_lat_lon in sorted(
+            layers, key=lambda layer: (str(layer[2]), layer[3])):
+        while ancestors and (ancestors[-1][0] != tree or ancestors[-1][1] < lft):
+            ancestors.pop()
+        parent = ancestors[-1][2] if ancestors else LayerAttributes()
+        attributes = LayerAttributes(
+            scale_min=scale_min if scale_min is not None else parent.scale_min,
+            scale_max=scale_max if scale_max is not None else parent.scale_max,
+            extent=bbox_lat_lon.extent if bbox_lat_lon else parent.extent,
+            reference_systems=parent.reference_systems | own_reference_systems.get(
+                pk, set()),
+        )
+        ancestors.append((tree, rgt, attributes))
+        if identifier:
+            layer_attributes[identifier.lower()] = attributes
+    return layer_attributes
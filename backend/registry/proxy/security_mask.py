@@ -0,0 +1,134 @@
+import io
+from typing import Iterator, List
+
+import numpy
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry, Polygon
+from PIL import Image, ImageDraw
+from registry.proxy.sessions import upstream_session_registry
+from requests import Request, Session
+
+# mask values used by :func:`registry.proxy.images.mask_image`
+MASKED = 255
+VISIBLE = 0
+
+
+def _iter_polygons(geometry: GEOSGeometry) -> Iterator[Polygon]:
+    """Yield all polygons of the given geometry; the result of an intersection can be any kind of geometry."""
+    if geometry.empty:
+        return
+    if isinstance(geometry, Polygon):
+        yield geometry
+    elif geometry.geom_type in ("MultiPolygon", "GeometryCollection"):
+        for part in geometry:
+            yield from _iter_polygons(part)
+
+
+def _clip_and_transform(allowed_area: GEOSGeometry, bbox: Polygon) -> GEOSGeometry:
+    """Clip the allowed area by the requested bbox and transform it into the reference system of the bbox."""
+    if not allowed_area.srid or not bbox.srid or allowed_area.srid == bbox.srid:
+        return allowed_area.intersection(bbox)
+    # The transformed bbox is not a rectangle anymore in the reference system of the allowed area. To clip without
+    # losing parts at the edges we clip by the buffered envelope and do the exact clipping in pixel space.
+    clip = bbox.transform(allowed_area.srid, clone=True).envelope
+    min_x, min_y, max_x, max_y = clip.extent
+    clip = clip.buffer(max(max_x - min_x, max_y - min_y) * 0.05)
+    return allowed_area.intersection(clip).transform(bbox.srid, clone=True)
+
+
+def get_simplify_tolerance(bbox: Polygon, width: int, height: int, srid: int) -> float:
+    """Return the largest tolerance of ``settings.PROXY_ALLOWED_AREA_TOLERANCES``, which is at most half a pixel of the
+    requested map in units of the given reference system of the allowed areas; ``0`` for the full resolution.
+
+    Allowed areas simplified by this tolerance differ at most by half a pixel from the original, so the rendered mask
+    is the same.
+    """
+    if bbox is None or bbox.empty or not width or not height:
+        return 0
+    if bbox.srid and srid and bbox.srid != srid:
+        bbox = bbox.transform(srid, clone=True)
+    min_x, min_y, max_x, max_y = bbox.extent
+    half_pixel = min((max_x - min_x) / width, (max_y - min_y) / height) / 2
+    return max((tolerance for tolerance in settings.PROXY_ALLOWED_AREA_TOLERANCES if tolerance <= half_pixel),
+               default=0)
+
+
+def render_security_mask(allowed_area: GEOSGeometry, bbox: Polygon, width: int, height: int) -> Image.Image:
+    """Rasterize the allowed area for the given GetMap bbox and image size.
+
+    The bbox is expected in x/y axis order, like :attr:`ows_lib.models.ogc_request.OGCRequest.bbox` provides it for
+    every wms version. So the axis order of wms 1.3.0 requests is already handled by parsing the request.
+
+    :return: a grayscale mask, where ``0`` marks the allowed area and ``255`` all other pixels.
+    :rtype: :class:`PIL.Image.Image`
+    """
+    mask = Image.new("L", (width, height), MASKED)
+    if allowed_area is None or bbox is None or bbox.empty:
+        return mask
+
+    min_x, min_y, max_x, max_y = bbox.extent
+    if max_x <= min_x or max_y <= min_y:
+        return mask
+    scale = numpy.array([width / (max_x - min_x), -height / (max_y - min_y)])
+    origin = numpy.array([min_x, max_y])
+
+    draw = ImageDraw.Draw(mask)
+    for polygon in _iter_polygons(_clip_and_transform(allowed_area=allowed_area, bbox=bbox)):
+        # the first ring is the exterior ring; all others are holes
+        for index, ring in enumerate(polygon):
+            pixels = (numpy.array(ring.coords)[:, :2] - origin) * scale
+            draw.polygon(
+                [tuple(pixel) for pixel in pixels.tolist()],
+                fill=VISIBLE if index == 0 else MASKED)
+    return mask
+
+
+def fetch_security_mask_from_mapserver(query_params: dict, allowed_area_pks: List[int], width: int, height: int, session: Session = None, tolerance: float = 0) -> Image.Image:
+    """Request the mask image from the local mapserver, which renders the allowed areas from the database.
+
+    The mapserver renders the subdivided parts of the allowed areas, which are simplified by the given tolerance of
+    ``settings.PROXY_ALLOWED_AREA_TOLERANCES``; ``0`` renders the full resolution.
+
+    :return: a RGB mask, where black marks the allowed area and white all other pixels.
+    :rtype: :class:`PIL.Image.Image`
+    """
+    from django.db import connection
+    db_name = connection.settings_dict["NAME"]
+    crs_qp = "CRS" if "CRS" in query_params else "SRS"
+    mapserver_query_params = {
+        "VERSION": query_params.get("VERSION"),
+        "REQUEST": "GetMap",
+        "SERVICE": "WMS",
+        "FORMAT": "image/png",
+        "LAYERS": "mask",
+        crs_qp: query_params.get(crs_qp),
+        "BBOX": query_params.get("BBOX"),
+        "WIDTH": width,
+        "HEIGHT": height,
+        "TRANSPARENT": "TRUE",
+        "table": settings.MAPSERVER_SECURITY_MASK_TABLE,
+        "key_column": settings.MAPSERVER_SECURITY_MASK_KEY_COLUMN,
+        "geom_column": settings.MAPSERVER_SECURITY_MASK_GEOMETRY_COLUMN,
+        "map": f"/etc/mapserver/mapfiles/security_mask{'_test_db' if 'test' in db_name else ''}.map",
+        "keys": ",".join(str(pk) for pk in allowed_area_pks or []),
+        "tolerance": str(float(tolerance)),
+    }
+
+    request = Request(
+        method="GET", url=settings.MAPSERVER_URL, params=mapserver_query_params
+    )
+    session = session or upstream_session_registry.get_session(
+        url=settings.MAPSERVER_URL)
+    response = session.send(request.prepare())
+
+    mask = Image.open(io.BytesIO(response.content))
+
+    # Put combined mask on white background
+    background = Image.new("RGB", (width, height), (255, 255, 255))
+    background.paste(mask, mask=mask)
+    return background
+
+
+def create_error_mask(width: int, height: int) -> Image.Image:
+    """Return a mask which signals, that an error occurred while creating the mask."""
+    return Image.new("L", (width, height), settings.ERROR_MASK_VAL)
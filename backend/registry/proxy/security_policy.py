@@ -0,0 +1,465 @@
+import hashlib
+import threading
+import time
+from typing import Dict, FrozenSet, Iterable, List
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db.models import Q
+from ows_lib.models.ogc_request import OGCRequest
+from registry.proxy.preflight import LayerAttributes, compile_layer_attributes
+from registry.proxy.transactions import on_commit_once
+from registry.proxy.wfs_filter import SpatialFilter, get_filter_geometry
+
+
+def get_group_pks_for_request(request: OGCRequest) -> FrozenSet[int]:
+    """Return the primary keys of all groups the requesting user is member of.
+
+    Anonymous users are handled like the :meth:`registry.managers.security.AllowedOgcServiceOperationQuerySet.for_user`
+    lookup does it.
+    """
+    user = request._djano_request.user
+    if user.is_anonymous:
+        group_pks = Group.objects.filter(
+            user__username="AnonymouseUser").values_list("pk", flat=True)
+    else:
+        group_pks = user.groups.values_list("pk", flat=True)
+    return frozenset(group_pks)
+
+
+def get_geometry_key(geometry: GEOSGeometry) -> str:
+    """Return a short hash of the given geometry, which changes with any of its coordinates."""
+    return hashlib.sha256(bytes(geometry.ewkb)).hexdigest()[:32]
+
+
+class AllowedOperationPolicy:
+    """Compiled, database free representation of a single allowed operation object.
+
+    :attr pk: the primary key of the compiled :class:`registry.models.security.AllowedOperation`
+    :attr operations: the lower cased names of the allowed ogc operations
+    :attr group_pks: the primary keys of the allowed groups. An empty set means that all users are allowed.
+    :attr entity_identifiers: the lower cased identifiers of all effective secured layers or feature types. For
+                              layers all descendants of the selected layers are part of it.
+    :attr allowed_area: the optional allowed area geometry
+    """
+    __slots__ = ("pk", "operations", "group_pks",
+                 "entity_identifiers", "allowed_area")
+
+    def __init__(
+            self,
+            pk: int,
+            operations: Iterable[str],
+            group_pks: Iterable[int],
+            entity_identifiers: Iterable[str],
+            allowed_area: GEOSGeometry = None):
+        self.pk = pk
+        self.operations = frozenset(operation.lower()
+                                    for operation in operations if operation)
+        self.group_pks = frozenset(pk for pk in group_pks if pk is not None)
+        self.entity_identifiers = frozenset(
+            identifier.lower() for identifier in entity_identifiers if identifier)
+        self.allowed_area = allowed_area
+
+    def matches(self, operation: str, group_pks: FrozenSet[int], entities: Iterable[str]) -> bool:
+        """Check if this policy grants the given operation on all given entities to one of the given groups."""
+        return (
+            operation.lower() in self.operations
+            and (not self.group_pks or not self.group_pks.isdisjoint(group_pks))
+            and all(entity.lower() in self.entity_identifiers for entity in entities)
+        )
+
+
+class SecurityPolicySnapshot:
+    """In memory policy snapshot of a single secured service.
+
+    The snapshot is compiled once from the allowed operation objects of a service and answers all security decisions of
+    the proxy without any database query, except the lookup of the groups of the requesting user.
+
+    :attr service_pk: the primary key of the secured service
+    :attr version: a version number which changes with every compilation of a snapshot
+    :attr known_entities: the lower cased identifiers of all layers or feature types of the service
+    :attr policies: the compiled :class:`AllowedOperationPolicy` objects
+    :attr geometry_property_names: (wfs only) the geometry property name per lower cased feature type identifier
+    :attr layer_attributes: (wms only) the inherited :class:`registry.proxy.preflight.LayerAttributes` per lower cased
+                            layer identifier
+    """
+
+    def __init__(
+            self,
+            service_pk,
+            known_entities: Iterable[str],
+            policies: List[AllowedOperationPolicy],
+            geometry_property_names: Dict[str, str] = None,
+            layer_attributes: Dict[str, LayerAttributes] = None):
+        self.service_pk = service_pk
+        self.version = time.time_ns()
+        self.compiled_at = time.monotonic()
+        self.known_entities = frozenset(entity.lower()
+                                        for entity in known_entities if entity)
+        self.policies = policies
+        self.geometry_property_names = geometry_property_names or {}
+        self.layer_attributes = layer_attributes or {}
+        self._unions = {}
+        self._simplified_unions = {}
+        self._union_keys = {}
+        self._spatial_filters = {}
+        self._lock = threading.Lock()
+        # prepared geometries are not safe to share between threads; so we hold them per thread
+        self._local = threading.local()
+
+    @property
+    def is_secured(self) -> bool:
+        return bool(self.policies)
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.compiled_at
+
+    def get_policies(self, operation: str, group_pks: FrozenSet[int], entities: Iterable[str]) -> List[AllowedOperationPolicy]:
+        entities = list(entities)
+        return [policy for policy in self.policies if policy.matches(operation, group_pks, entities)]
+
+    def get_allowed_entities(self, operation: str, group_pks: FrozenSet[int]) -> FrozenSet[str]:
+        """Return the lower cased identifiers of all layers or feature types, which the given groups may request with
+        the given operation."""
+        allowed_entities = set()
+        for policy in self.get_policies(operation=operation, group_pks=group_pks, entities=[]):
+            allowed_entities.update(policy.entity_identifiers)
+        return frozenset(allowed_entities)
+
+    def is_unknown_entity(self, entities: Iterable[str]) -> bool:
+        """Mirrors the ``is_unknown_layer`` annotation: True if none of the requested entities is part of the service"""
+        return not any(entity.lower() in self.known_entities for entity in entities)
+
+    def get_allowed_area_union(self, policies: List[AllowedOperationPolicy]) -> GEOSGeometry:
+        """Return the union of the allowed areas of the given policies; computed once per set of policies."""
+        key = frozenset(
+            policy.pk for policy in policies if policy.allowed_area is not None)
+        if not key:
+            return None
+        union = self._unions.get(key)
+        if union is None:
+            areas = [policy.allowed_area for policy in policies if policy.allowed_area is not None]
+            union = areas[0].clone()
+            for area in areas[1:]:
+                union = union.union(area)
+            with self._lock:
+                self._unions[key] = union
+        return union
+
+    def get_allowed_area_union_key(self, allowed_area_pks: Iterable[int]) -> str:
+        """Return the :func:`get_geometry_key` of the union of the allowed areas of the given policies; computed once
+        per set of policies."""
+        key = frozenset(pk for pk in allowed_area_pks or [] if pk is not None)
+        union_key = self._union_keys.get(key)
+        if union_key is None:
+            union = self.get_allowed_area_union(
+                policies=[policy for policy in self.policies if policy.pk in key])
+            if union is None:
+                return None
+            union_key = get_geometry_key(geometry=union)
+            with self._lock:
+                self._union_keys[key] = union_key
+        return union_key
+
+    def get_simplified_allowed_area_union(self, allowed_area_pks: Iterable[int], tolerance: float) -> GEOSGeometry:
+        """Return the union of the allowed areas of the given policies, simplified by the given tolerance like the
+        parts of the allowed area pyramid in the database; computed once per set of policies and tolerance."""
+        key = frozenset(pk for pk in allowed_area_pks or [] if pk is not None)
+        union = self.get_allowed_area_union(
+            policies=[policy for policy in self.policies if policy.pk in key])
+        if union is None or not tolerance:
+            return union
+        simplified = self._simplified_unions.get((key, tolerance))
+        if simplified is None:
+            simplified = union.simplify(
+                tolerance=tolerance, preserve_topology=True)
+            with self._lock:
+                self._simplified_unions[(key, tolerance)] = simplified
+        return simplified
+
+    def get_prepared_allowed_area_union(self, policies: List[AllowedOperationPolicy]):
+        union = self.get_allowed_area_union(policies=policies)
+        if union is None:
+            return None
+        prepared_unions = getattr(self._local, "prepared_unions", None)
+        if prepared_unions is None:
+            prepared_unions = self._local.prepared_unions = {}
+        key = frozenset(
+            policy.pk for policy in policies if policy.allowed_area is not None)
+        prepared = prepared_unions.get(key)
+        if prepared is None:
+            prepared = prepared_unions[key] = union.prepared
+        return prepared
+
+    def get_spatial_filter(self, policies: List[AllowedOperationPolicy], value_reference: str,
+                           service_version: str) -> SpatialFilter:
+        """Return the :class:`registry.proxy.wfs_filter.SpatialFilter` of the allowed area union of the given policies
+        for the given wfs version; computed once per set of policies, geometry property and axis order."""
+        union = self.get_allowed_area_union(policies=policies)
+        if union is None:
+            return None
+        key = (frozenset(policy.pk for policy in policies if policy.allowed_area is not None),
+               value_reference, service_version == "1.0.0", union.srid)
+        spatial_filter = self._spatial_filters.get(key)
+        if spatial_filter is None:
+            spatial_filter = SpatialFilter(
+                geometry=get_filter_geometry(
+                    geometry=union, service_version=service_version),
+                value_reference=value_reference)
+            with self._lock:
+                self._spatial_filters[key] = spatial_filter
+        return spatial_filter
+
+    def _get_bbox(self, request: OGCRequest, srid: int) -> GEOSGeometry:
+        bbox = request.bbox
+        if bbox is None or bbox.empty:
+            return None
+        if bbox.srid and srid and bbox.srid != srid:
+            bbox = bbox.transform(srid, clone=True)
+        return bbox
+
+    def apply(self, service, request: OGCRequest) -> None:
+        """Annotate the given service object with the same security attributes as
+        :meth:`registry.managers.security.WebMapServiceSecurityManager.prepare_with_security_info` does.
+        """
+        entities = request.requested_entities
+        operation = request.operation
+        user = request._djano_request.user
+        group_pks = get_group_pks_for_request(request=request)
+        policies = self.get_policies(
+            operation=operation, group_pks=group_pks, entities=entities)
+        spatial_policies = [
+            policy for policy in policies if policy.allowed_area is not None]
+
+        service.security_policy = self
+        service.is_secured = self.is_secured
+        service.is_user_principle_entitled = user.is_superuser or bool(
+            policies)
+        service.is_spatial_secured = bool(spatial_policies) and len(
+            spatial_policies) == len(policies)
+        service.allowed_area_union = self.get_allowed_area_union(
+            policies=spatial_policies)
+        service.allowed_area_pks = [
+            policy.pk for policy in spatial_policies] or None
+
+        if request.is_wms:
+            service.is_unknown_layer = self.is_unknown_entity(
+                entities=entities)
+            service.is_spatial_secured_and_covers = False
+            service.is_spatial_secured_and_intersects = False
+            prepared_union = self.get_prepared_allowed_area_union(
+                policies=spatial_policies)
+            if prepared_union is not None:
+                try:
+                    bbox = self._get_bbox(
+                        request=request, srid=service.allowed_area_union.srid)
+                except Exception as e:
+                    settings.ROOT_LOGGER.exception(e)
+                    bbox = None
+                if bbox is not None:
+                    service.is_spatial_secured_and_covers = prepared_union.covers(
+                        bbox)
+                    service.is_spatial_secured_and_intersects = service.is_spatial_secured_and_covers or prepared_union.intersects(
+                        bbox)
+        elif request.is_wfs:
+            service.is_unknown_feature_type = self.is_unknown_entity(
+                entities=entities)
+            security_info_per_feature_type = []
+            for feature_type in entities:
+                feature_type_policies = [
+                    policy for policy in spatial_policies if feature_type.lower() in policy.entity_identifiers]
+                allowed_area_union = self.get_allowed_area_union(
+                    policies=feature_type_policies)
+                if allowed_area_union is None:
+                    continue
+                geometry_property_name = self.geometry_property_names.get(
+                    feature_type.lower(), "THE_GEOM")
+                security_info = {
+                    "type_name": feature_type,
+                    "geometry_property_name": geometry_property_name,
+                    "allowed_area_union": allowed_area_union,
+                }
+                if request.is_get_feature_request:
+                    security_info["spatial_filter"] = self.get_spatial_filter(
+                        policies=feature_type_policies,
+                        value_reference=geometry_property_name,
+                        service_version=request.service_version)
+                security_info_per_feature_type.append(security_info)
+            service.security_info_per_feature_type = security_info_per_feature_type
+
+
+def compile_web_map_service_policy(service_pk) -> SecurityPolicySnapshot:
+    from registry.models.security import (AllowedWebMapServiceOperation,
+                                          AllowedWebMapServiceOperationLayer)
+    from registry.models.service import Layer
+
+    layers = list(Layer.objects.filter(service__pk=service_pk).values_list(
+        "pk", "identifier", "mptt_tree_id", "mptt_lft", "mptt_rgt", "scale_min", "scale_max", "bbox_lat_lon"))
+    # the identifiers of the layers of the secured subtrees per allowed operation
+    effective_identifiers = {}
+    for allowed_operation_pk, identifier in AllowedWebMapServiceOperationLayer.objects.filter(
+            allowed_operation__secured_service__pk=service_pk,
+            identifier__isnull=False).values_list("allowed_operation_id", "identifier").distinct():
+        effective_identifiers.setdefault(
+            allowed_operation_pk, set()).add(identifier)
+
+    policies = []
+    for allowed_operation in AllowedWebMapServiceOperation.objects.filter(
+            secured_service__pk=service_pk).annotate(
+                operation_list=ArrayAgg(
+                    "operations__operation", distinct=True, default=[]),
+                group_pks=ArrayAgg(
+                    "allowed_groups__pk", distinct=True, filter=Q(allowed_groups__isnull=False), default=[])):
+        policies.append(AllowedOperationPolicy(
+            pk=allowed_operation.pk,
+            operations=allowed_operation.operation_list,
+            group_pks=allowed_operation.group_pks,
+            entity_identifiers=effective_identifiers.get(
+                allowed_operation.pk, ()),
+            allowed_area=allowed_operation.allowed_area))
+
+    return SecurityPolicySnapshot(
+        service_pk=service_pk,
+        known_entities=[identifier for _, identifier, *_ in layers],
+        policies=policies,
+        layer_attributes=compile_layer_attributes(
+            layers=layers,
+            reference_systems=Layer.reference_systems.through.objects.filter(
+                layer__service__pk=service_pk).values_list(
+                    "layer_id", "referencesystem__prefix", "referencesystem__code")))
+
+
+def compile_web_feature_service_policy(service_pk) -> SecurityPolicySnapshot:
+    from ows_lib.xml_mapper.xml_responses.consts import GEOMETRY_DATA_TYPES
+    from registry.models.security import AllowedWebFeatureServiceOperation
+    from registry.models.service import FeatureType, FeatureTypeProperty
+
+    feature_types = list(FeatureType.objects.filter(
+        service__pk=service_pk).values_list("identifier", flat=True))
+    geometry_property_names = {}
+    for feature_type, name in FeatureTypeProperty.objects.filter(
+            feature_type__service__pk=service_pk,
+            data_type__in=GEOMETRY_DATA_TYPES).values_list("feature_type__identifier", "name"):
+        if feature_type:
+            geometry_property_names.setdefault(feature_type.lower(), name)
+
+    policies = []
+    for allowed_operation in AllowedWebFeatureServiceOperation.objects.filter(
+            secured_service__pk=service_pk).annotate(
+                operation_list=ArrayAgg(
+                    "operations__operation", distinct=True, default=[]),
+                group_pks=ArrayAgg(
+                    "allowed_groups__pk", distinct=True, filter=Q(allowed_groups__isnull=False), default=[]),
+                feature_type_identifiers=ArrayAgg(
+                    "secured_feature_types__identifier", distinct=True, filter=Q(secured_feature_types__isnull=False), default=[])):
+        policies.append(AllowedOperationPolicy(
+            pk=allowed_operation.pk,
+            operations=allowed_operation.operation_list,
+            group_pks=allowed_operation.group_pks,
+            entity_identifiers=allowed_operation.feature_type_identifiers,
+            allowed_area=allowed_operation.allowed_area))
+
+    return SecurityPolicySnapshot(
+        service_pk=service_pk,
+        known_entities=feature_types,
+        policies=policies,
+        geometry_property_names=geometry_property_names)
+
+
+class SecurityPolicyRegistry:
+    """Per process registry of compiled :class:`SecurityPolicySnapshot` objects.
+
+    Snapshots are invalidated by messages on the ``PROXY_SECURITY_POLICY_CHANNEL`` redis pub/sub channel, so that
+    every proxy process drops its snapshot if an allowed operation, a group membership or the layer tree changes.
+    If redis is not reachable, snapshots expire after ``PROXY_SECURITY_POLICY_MAX_AGE`` seconds.
+    """
+    ALL_SERVICES = "*"
+
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def get(self, service) -> SecurityPolicySnapshot:
+        self._ensure_listener()
+        snapshot = self._snapshots.get(service.pk)
+        if snapshot is None or snapshot.age > settings.PROXY_SECURITY_POLICY_MAX_AGE:
+            snapshot = self.compile(service=service)
+            with self._lock:
+                self._snapshots[service.pk] = snapshot
+        return snapshot
+
+    def compile(self, service) -> SecurityPolicySnapshot:
+        from registry.models.service import WebFeatureService, WebMapService
+        if isinstance(service, WebMapService):
+            return compile_web_map_service_policy(service_pk=service.pk)
+        elif isinstance(service, WebFeatureService):
+            return compile_web_feature_service_policy(service_pk=service.pk)
+        raise NotImplementedError(
+            f"there is no security policy for {service.__class__.__name__} objects.")
+
+    def invalidate(self, service_pk=None) -> None:
+        """Drop the snapshot of the given service, or of all services if no service pk is passed."""
+        with self._lock:
+            if service_pk is None or service_pk == self.ALL_SERVICES:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(service_pk, None)
+
+    def publish_invalidation_on_commit(self, service_pk=None) -> None:
+        """Publish the invalidation once after the current transaction is committed, or immediately in autocommit mode.
+
+        Registering a service saves thousands of layers; with that only one message per service is published.
+        """
+        on_commit_once(func=self.publish_invalidation, key=service_pk)
+
+    def publish_invalidation(self, service_pk=None) -> None:
+        """Invalidate the snapshot in this process and notify all other processes."""
+        self.invalidate(service_pk=service_pk)
+        try:
+            self._get_redis().publish(
+                settings.PROXY_SECURITY_POLICY_CHANNEL,
+                str(service_pk) if service_pk else self.ALL_SERVICES)
+        except Exception as e:
+            settings.ROOT_LOGGER.warning(
+                f"can't publish security policy invalidation: {e}")
+
+    def _get_redis(self):
+        from redis import Redis
+        return Redis.from_url(settings.BROKER_URL)
+
+    def _handle_message(self, message):
+        data = message.get("data")
+        if isinstance(data, bytes):
+            data = data.decode("UTF-8")
+        if data == self.ALL_SERVICES:
+            self.invalidate()
+        else:
+            # service primary keys are uuids; the string representation is used as message
+            with self._lock:
+                for service_pk in [pk for pk in self._snapshots if str(pk) == data]:
+                    del self._snapshots[service_pk]
+
+    def _ensure_listener(self):
+        if self._listener is not None:
+            return
+        with self._lock:
+            if self._listener is not None:
+                return
+            try:
+                pubsub = self._get_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(
+                    **{settings.PROXY_SECURITY_POLICY_CHANNEL: self._handle_message})
+                self._listener = pubsub.run_in_thread(
+                    sleep_time=1, daemon=True)
+            except Exception as e:
+                # do not retry on every request; the max age of the snapshots is the fallback
+                self._listener = False
+                settings.ROOT_LOGGER.warning(
+                    f"can't subscribe to security policy invalidations: {e}")
+
+
+security_policy_registry = SecurityPolicyRegistry()
@@ -0,0 +1,251 @@
+import asyncio
+import hashlib
+from datetime import timedelta
+from http.cookiejar import DefaultCookiePolicy
+from typing import List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from django.conf import settings
+from registry.proxy.cache import LRUCache
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth, HTTPDigestAuth
+
+
+class UpstreamSession(Session):
+    """Keep-alive session to one upstream host, which is shared between all requests of a process.
+
+    The mounted :class:`requests.adapters.HTTPAdapter` blocks if all ``max_connections`` connections to the host are
+    in use, so the count of parallel connections to a remote service is limited per process.
+
+    Cookies of upstream responses are never stored, cause the session is shared between different users.
+
+    :attr host: the upstream host, like ``https://example.com``
+    :attr max_connections: the max count of connections to the upstream host
+    :attr timeout: the timeout in seconds for requests, which are send with this session
+    """
+
+    def __init__(self, host: str, max_connections: int, timeout: int):
+        super().__init__()
+        self.host = host
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(
+            # one service may announce operation urls of different hosts
+            pool_connections=4,
+            pool_maxsize=max_connections,
+            pool_block=True,
+            max_retries=0,
+        )
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    @property
+    def stats(self) -> dict:
+        """Return the connection counters of all connection pools of this session.
+
+        ``reuse_rate`` is the share of requests, which were send over an already established connection.
+        """
+        requests_count = 0
+        connections_count = 0
+        for adapter in set(self.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_count += pool.num_requests
+                connections_count += pool.num_connections
+        return {
+            "host": self.host,
+            "max_connections": self.max_connections,
+            "requests": requests_count,
+            "connections": connections_count,
+            "reuse_rate": (
+                (requests_count - connections_count) / requests_count
+                if requests_count else 0.0
+            ),
+        }
+
+
+class UpstreamSessionRegistry:
+    """Per process registry of :class:`UpstreamSession` objects keyed by upstream host and credentials.
+
+    The first item of every key is the upstream host, so all sessions of one host can be dropped by calling
+    :meth:`~UpstreamSessionRegistry.invalidate`. The connections of dropped sessions are closed; requests which still
+    use such a session open new connections.
+    """
+
+    def __init__(self, max_size: int = 128):
+        self._sessions = LRUCache(max_size=max_size, on_evict=lambda session: session.close())
+
+    @staticmethod
+    def get_host(url: str) -> str:
+        parsed = urlsplit(url)
+        return f"{parsed.scheme}://{parsed.netloc.lower()}"
+
+    @staticmethod
+    def get_credentials_key(auth) -> Optional[str]:
+        """Return a hash of the given credentials; the key shall not contain any plain text password."""
+        if auth is None:
+            return None
+        if isinstance(auth, (HTTPBasicAuth, HTTPDigestAuth)):
+            auth = (type(auth).__name__, auth.username, auth.password)
+        return hashlib.sha256(repr(auth).encode("utf-8")).hexdigest()
+
+    def get_session(self, url: str, auth=None, max_connections: int = None, timeout: int = None) -> UpstreamSession:
+        """Return the shared session for the host of the given url and the given credentials.
+
+        :param url: any url of the upstream host
+        :param auth: the auth object, which is passed to :attr:`requests.Session.auth`
+        :param max_connections: the max count of connections to the host; default is
+                                ``settings.PROXY_UPSTREAM_MAX_CONNECTIONS``
+        :param timeout: the timeout in seconds for requests to the host; default is ``settings.PROXY_UPSTREAM_TIMEOUT``
+        """
+        host = self.get_host(url=url)
+        max_connections = max_connections or settings.PROXY_UPSTREAM_MAX_CONNECTIONS
+        timeout = timeout or settings.PROXY_UPSTREAM_TIMEOUT
+
+        def create_session():
+            session = UpstreamSession(
+                host=host, max_connections=max_connections, timeout=timeout)
+            session.auth = auth
+            return session
+
+        return self._sessions.get_or_set(
+            key=(host, self.get_credentials_key(auth=auth),
+                 max_connections, timeout),
+            default=create_session,
+        )
+
+    def invalidate(self, url: str) -> None:
+        self._sessions.invalidate(group=self.get_host(url=url))
+
+    def clear(self) -> None:
+        self._sessions.clear()
+
+    @property
+    def stats(self) -> List[dict]:
+        return [session.stats for session in self._sessions.values()]
+
+
+class AsyncUpstreamClientRegistry:
+    """Per process registry of :class:`httpx.AsyncClient` objects for the async proxy views.
+
+    The clients are configured like the :class:`UpstreamSession` of the requested service. A client can only be used
+    inside the event loop it was created in, so the running loop is part of the key. Dropped clients are closed in
+    their loop; the clients of closed loops are dropped, if a client for a new loop is created.
+    """
+
+    def __init__(self, max_size: int = 128):
+        self._clients = LRUCache(max_size=max_size, on_evict=self._close_client)
+        self._closing = set()
+
+    def _close_client(self, entry) -> None:
+        loop, client = entry
+        if loop.is_closed():
+            # the connections of the client can't be closed anymore; they are released with the client
+            return
+
+        def close():
+            task = loop.create_task(client.aclose())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+        loop.call_soon_threadsafe(close)
+
+    def _drop_closed_loops(self) -> None:
+        for key, (loop, _) in self._clients.items():
+            if loop.is_closed():
+                self._clients.delete(key=key)
+
+    @staticmethod
+    def get_auth(auth):
+        """Convert the auth object of a :class:`requests.Session` to the matching httpx auth object."""
+        if isinstance(auth, HTTPDigestAuth):
+            return httpx.DigestAuth(username=auth.username, password=auth.password)
+        if isinstance(auth, HTTPBasicAuth):
+            return httpx.BasicAuth(username=auth.username, password=auth.password)
+        return auth
+
+    def get_client(self, session: UpstreamSession) -> httpx.AsyncClient:
+        """Return the shared async client for the given upstream session."""
+        loop = asyncio.get_running_loop()
+
+        def create_client():
+            self._drop_closed_loops()
+            return loop, httpx.AsyncClient(
+                auth=self.get_auth(auth=session.auth),
+                limits=httpx.Limits(
+                    max_connections=session.max_connections,
+                    max_keepalive_connections=session.max_connections,
+                ),
+                timeout=session.timeout,
+                follow_redirects=True,
+            )
+
+        _, client = self._clients.get_or_set(
+            key=(session.host, id(loop),
+                 UpstreamSessionRegistry.get_credentials_key(
+                     auth=session.auth),
+                 session.max_connections, session.timeout),
+            default=create_client,
+        )
+        return client
+
+    def clear(self) -> None:
+        self._clients.clear()
+
+
+class RemoteResponse:
+    """Completely read response of a remote service with the attributes of :class:`requests.models.Response`, which
+    are used by the proxy views to compute and log the response for the client.
+
+    The content is already decoded, so the ``Content-Encoding`` of the remote service does not apply anymore.
+    Instances are read only and can be shared between threads.
+    """
+
+    def __init__(self, status_code: int, reason: str, headers, url: str, elapsed: timedelta, content: bytes):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.url = url
+        self.elapsed = elapsed
+        self.content = content
+
+    @classmethod
+    def from_httpx(cls, response: httpx.Response, content: bytes = None):
+        return cls(
+            status_code=response.status_code,
+            reason=response.reason_phrase,
+            headers=response.headers,
+            url=str(response.url),
+            elapsed=response.elapsed,
+            content=response.content if content is None else content,
+        )
+
+    @classmethod
+    def from_requests(cls, response: Response):
+        return cls(
+            status_code=response.status_code,
+            reason=response.reason,
+            headers=response.headers,
+            url=response.url,
+            elapsed=response.elapsed,
+            content=response.content,
+        )
+
+    def iter_content(self, chunk_size: int = 1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+upstream_session_registry = UpstreamSessionRegistry(
+    max_size=settings.PROXY_UPSTREAM_SESSIONS_SIZE)
+async_upstream_client_registry = AsyncUpstreamClientRegistry(
+    max_size=settings.PROXY_UPSTREAM_SESSIONS_SIZE)
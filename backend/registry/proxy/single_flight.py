@@ -0,0 +1,168 @@
+import hashlib
+import json
+import time
+from datetime import timedelta
+from threading import Event, Lock
+from typing import Callable, Hashable
+
+from django.conf import settings
+from redis import Redis
+from redis.exceptions import RedisError
+from registry.proxy.metrics import Counters
+from registry.proxy.sessions import RemoteResponse
+from requests import PreparedRequest
+from requests.structures import CaseInsensitiveDict
+
+# how long followers in other processes can pick up the response of the leader in seconds
+REDIS_RESULT_TTL = 2
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce identical concurrent upstream requests, so only one of them is send to the remote service.
+
+    Inside a process the first caller of a key (the leader) performs the request; all concurrent callers of the same
+    key wait for the result of the leader. If ``use_redis`` is true, the leaders of different processes are
+    coordinated by a redis lock: only one process requests the remote service and shares the response through redis
+    for a few seconds.
+
+    The result of ``func`` is shared between all callers, so it needs to be completely read and must not be
+    modified.
+    """
+
+    def __init__(self, use_redis: bool = False, timeout: float = 10):
+        self.use_redis = use_redis
+        self.timeout = timeout
+        self.counters = Counters(name="single_flight")
+        self._calls = {}
+        self._lock = Lock()
+        self._redis = None
+
+    @staticmethod
+    def get_key(service_pk, request: PreparedRequest, security_context: Hashable = None) -> str:
+        """Return the normalized key of an upstream request.
+
+        The query parameters are sorted and the parameter names are compared case insensitive like ogc services do.
+        """
+        url, _, query = request.url.partition("?")
+        params = sorted(
+            (name.upper(), value)
+            for name, _, value in (param.partition("=") for param in query.split("&") if param)
+        )
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        return hashlib.sha256(repr((
+            str(service_pk),
+            request.method,
+            url,
+            params,
+            hashlib.sha256(body).hexdigest(),
+            security_context,
+        )).encode("utf-8")).hexdigest()
+
+    def do(self, key: str, func: Callable[[], object]):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            call.event.wait()
+            self.counters.increment("coalesced")
+        else:
+            try:
+                call.result = self._do_distributed(
+                    key=key, func=func) if self.use_redis else self._issue(func=func)
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.event.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _issue(self, func: Callable[[], object]):
+        self.counters.increment("issued")
+        return func()
+
+    def _get_redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = Redis.from_url(settings.BROKER_URL)
+        return self._redis
+
+    def _do_distributed(self, key: str, func: Callable[[], object]):
+        lock_key = f"mrmap:single-flight:{key}:lock"
+        meta_key = f"mrmap:single-flight:{key}:meta"
+        content_key = f"mrmap:single-flight:{key}:content"
+        try:
+            redis = self._get_redis()
+            is_leader = redis.set(lock_key, 1, nx=True,
+                                  px=int(self.timeout * 1000))
+        except RedisError as e:
+            settings.ROOT_LOGGER.exception(e)
+            return self._issue(func=func)
+
+        if is_leader:
+            result = self._issue(func=func)
+            try:
+                if isinstance(result, RemoteResponse):
+                    pipeline = redis.pipeline()
+                    pipeline.set(meta_key, json.dumps({
+                        "status_code": result.status_code,
+                        "reason": result.reason,
+                        "headers": dict(result.headers),
+                        "url": result.url,
+                        "elapsed": result.elapsed.total_seconds(),
+                    }), ex=REDIS_RESULT_TTL)
+                    pipeline.set(content_key, result.content,
+                                 ex=REDIS_RESULT_TTL)
+                    pipeline.delete(lock_key)
+                    pipeline.execute()
+                else:
+                    redis.delete(lock_key)
+            except RedisError as e:
+                settings.ROOT_LOGGER.exception(e)
+            return result
+
+        deadline = time.monotonic() + self.timeout
+        try:
+            while time.monotonic() < deadline:
+                meta, content = redis.mget(meta_key, content_key)
+                if meta is not None and content is not None:
+                    self.counters.increment("coalesced_remote")
+                    meta = json.loads(meta)
+                    return RemoteResponse(
+                        status_code=meta["status_code"],
+                        reason=meta["reason"],
+                        headers=CaseInsensitiveDict(meta["headers"]),
+                        url=meta["url"],
+                        elapsed=timedelta(seconds=meta["elapsed"]),
+                        content=content,
+                    )
+                if not redis.exists(lock_key):
+                    # the leader failed or did not get a shareable response
+                    break
+                time.sleep(0.01)
+        except RedisError as e:
+            settings.ROOT_LOGGER.exception(e)
+        return self._issue(func=func)
+
+
+single_flight = SingleFlight(
+    use_redis=settings.PROXY_SINGLE_FLIGHT_REDIS,
+    timeout=settings.PROXY_UPSTREAM_TIMEOUT,
+)
@@ -0,0 +1,234 @@
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db.models.functions import datetime
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from ows_lib.models.ogc_request import OGCRequest
+from registry.models.service import Layer, WebMapService
+from registry.proxy.ogc_exceptions import (ForbiddenException,
+                                           InvalidParameterValue,
+                                           MissingParameterException)
+from registry.proxy.ogc_exceptions import RuntimeError as MrMapRuntimeError
+from registry.proxy.ogc_exceptions import TileOutOfRange
+from registry.proxy.security_policy import get_geometry_key
+from registry.proxy.single_flight import single_flight
+from registry.proxy.tiles import (PUBLIC_TILES, TILE_FORMATS,
+                                  TILE_MATRIX_SETS, TileKey, get_map_params,
+                                  service_version_cache, split_metatile,
+                                  tile_cache)
+from registry.proxy.wms_proxy import WebMapServiceProxy
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class WebMapTileServiceProxy(WebMapServiceProxy):
+    """WMTS (KVP and REST) and XYZ facade for the layers of a registered web map service.
+
+    Every tile is mapped onto a GetMap request for the metatile, which contains the tile. The metatile is requested
+    through the security decisions of :class:`registry.proxy.wms_proxy.WebMapServiceProxy`, split into tiles and all
+    tiles are stored in the :data:`registry.proxy.tiles.tile_cache`.
+
+    Tiles of spatial secured layers are cached per union of the allowed areas, which was applied to them. Tiles with
+    the unrestricted content are only served to users, which may request the whole layer.
+
+    The tile address is passed by the url kwargs ``layer``, ``tile_matrix_set``, ``zoom``, ``col``, ``row`` and
+    ``extension``; without them the WMTS KVP parameters are used.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        self.start_time = datetime.datetime.now()
+        self.ogc_request = OGCRequest.from_django_request(request)
+        params = self.ogc_request.ogc_query_params
+
+        if self.kwargs.get("capabilities") or (
+                "layer" not in self.kwargs and params.get("REQUEST", "").lower() == "getcapabilities"):
+            return self.get_wmts_capabilities()
+
+        if "layer" in self.kwargs:
+            tile = (
+                self.kwargs["layer"],
+                self.kwargs.get("tile_matrix_set", "WebMercatorQuad"),
+                int(self.kwargs["zoom"]),
+                int(self.kwargs["col"]),
+                int(self.kwargs["row"]),
+                TILE_FORMATS.get(self.kwargs["extension"].lower()),
+            )
+        else:
+            if params.get("REQUEST", "").lower() != "gettile":
+                return InvalidParameterValue(ogc_request=self.ogc_request, locator="request")
+            try:
+                tile = (
+                    params["LAYER"],
+                    params["TILEMATRIXSET"],
+                    int(params["TILEMATRIX"]),
+                    int(params["TILECOL"]),
+                    int(params["TILEROW"]),
+                    params.get("FORMAT", "image/png"),
+                )
+            except KeyError as e:
+                return MissingParameterException(ogc_request=self.ogc_request, locator=e.args[0].lower())
+            except ValueError:
+                return InvalidParameterValue(ogc_request=self.ogc_request, locator="tilematrix")
+        return self.get_tile(*tile)
+
+    @property
+    def service_version(self) -> str:
+        return service_version_cache.get_or_set(
+            key=(self.kwargs.get("pk"),),
+            default=lambda: WebMapService.objects.values_list(
+                "version", flat=True).filter(pk=self.kwargs.get("pk")).first())
+
+    def get_security_key(self) -> str:
+        """Return the key of the union of the allowed areas, which is applied to the tiles of the requesting user,
+        ``public`` if the user can see the unrestricted content or ``None`` if the user can not request the layer."""
+        if (
+            not self.service.is_secured
+            or not self.service.is_spatial_secured
+            and self.service.is_user_principle_entitled
+        ):
+            return PUBLIC_TILES
+        elif self.service.is_spatial_secured and self.service.is_user_principle_entitled:
+            # the key changes with the geometry of the allowed areas, so tiles of narrowed areas are not served anymore
+            snapshot = getattr(self.service, "security_policy", None)
+            if snapshot is not None:
+                return snapshot.get_allowed_area_union_key(allowed_area_pks=self.service.allowed_area_pks)
+            return get_geometry_key(geometry=self.service.allowed_area_union)
+        return None
+
+    def get_tile(self, layer: str, tile_matrix_set: str, zoom: int, col: int, row: int, mime_type: str):
+        tile_matrix_set = TILE_MATRIX_SETS.get(tile_matrix_set)
+        if tile_matrix_set is None:
+            return InvalidParameterValue(ogc_request=self.ogc_request, locator="tilematrixset")
+        if mime_type not in TILE_FORMATS.values():
+            return InvalidParameterValue(ogc_request=self.ogc_request, locator="format")
+        if not tile_matrix_set.contains(zoom=zoom, col=col, row=row):
+            return TileOutOfRange(ogc_request=self.ogc_request)
+
+        meta_col, meta_row, cols, rows = tile_matrix_set.get_metatile(
+            zoom=zoom, col=col, row=row, meta_size=settings.PROXY_TILE_METATILE_SIZE)
+        # the security decisions are taken for the GetMap request of the metatile
+        self.ogc_request = OGCRequest(
+            method="GET",
+            url=self.request.build_absolute_uri(
+                reverse("wms-operation", args=[self.kwargs.get("pk")])),
+            params=get_map_params(
+                version=self.service_version or "1.3.0",
+                layer=layer,
+                tile_matrix_set=tile_matrix_set,
+                bbox=tile_matrix_set.get_bbox(
+                    zoom=zoom, col=meta_col, row=meta_row, cols=cols, rows=rows),
+                width=cols * tile_matrix_set.tile_size,
+                height=rows * tile_matrix_set.tile_size,
+                mime_type=mime_type),
+            django_request=self.request,
+        )
+        if not self.service.is_active or self.service.is_unknown_layer:
+            return super().get_and_post(request=self.request)
+        security_key = self.get_security_key()
+        if security_key is None:
+            return ForbiddenException(ogc_request=self.ogc_request)
+
+        key = TileKey(service_pk=self.service.pk, layer=layer, security_key=security_key,
+                      tile_matrix_set=tile_matrix_set.identifier, zoom=zoom, col=col, row=row,
+                      extension=mime_type.split("/")[-1])
+        content = tile_cache.get(key=key)
+        if content is None:
+            meta_key = key.get_sibling(col=meta_col, row=meta_row)
+            self._error_response = None
+            tiles = single_flight.do(
+                key=f"tile:{meta_key}",
+                func=lambda: self.render_metatile(
+                    meta_key=meta_key, cols=cols, rows=rows, tile_size=tile_matrix_set.tile_size, mime_type=mime_type))
+            if tiles is None:
+                return self._error_response or MrMapRuntimeError(ogc_request=self.ogc_request)
+            content = tiles[(col - meta_col, row - meta_row)]
+
+        response = HttpResponse(content=content, content_type=mime_type)
+        if security_key == PUBLIC_TILES:
+            patch_cache_control(response, public=True,
+                                max_age=settings.PROXY_TILE_CACHE["TIMEOUT"] or None)
+        else:
+            patch_cache_control(response, private=True)
+        return response
+
+    def render_metatile(self, meta_key: TileKey, cols: int, rows: int, tile_size: int, mime_type: str) -> dict:
+        """Request the metatile through the wms security proxy, split it and store all tiles in the cache.
+
+        :return: the encoded tiles by their column and row offset inside the metatile or ``None`` if the wms
+                 response is not an image. The response is kept as ``_error_response`` in this case.
+        """
+        response = super().get_and_post(request=self.request)
+        if response.status_code != 200 or not response.get("Content-Type", "").startswith("image/") \
+                or response.get("Content-Encoding"):
+            self._error_response = response
+            return None
+        try:
+            content = b"".join(
+                response.streaming_content) if response.streaming else response.content
+        finally:
+            response.close()
+        try:
+            tiles = split_metatile(content=content, cols=cols,
+                                   rows=rows, tile_size=tile_size, mime_type=mime_type)
+        except OSError as e:
+            settings.ROOT_LOGGER.exception(e)
+            return None
+        tile_cache.set_many(tiles={
+            meta_key.get_sibling(col=meta_key.col + col, row=meta_key.row + row): tile
+            for (col, row), tile in tiles.items()
+        })
+        return tiles
+
+    def get_wmts_capabilities(self):
+        """Return the WMTS capabilities document with all layers the requesting user may request."""
+        self.ogc_request = OGCRequest(
+            method="GET",
+            url=self.request.build_absolute_uri(),
+            params={"SERVICE": "WMS", "VERSION": self.service_version or "1.3.0",
+                    "REQUEST": "GetMap", "LAYERS": ""},
+            django_request=self.request,
+        )
+        visible_entities = self.get_visible_entities()
+        base_url = self.request.build_absolute_uri(
+            reverse("wmts-operation", args=[self.kwargs.get("pk")]))
+        layers = []
+        for identifier, title, bbox_lat_lon in Layer.objects.filter(
+                service__pk=self.kwargs.get("pk"), identifier__isnull=False).values_list(
+                    "identifier", "title", "bbox_lat_lon"):
+            if visible_entities is not None and identifier.lower() not in visible_entities:
+                continue
+            layers.append({
+                "identifier": identifier,
+                "title": title,
+                "extent": bbox_lat_lon.extent if bbox_lat_lon else (-180, -90, 180, 90),
+                "resource_url": f"{base_url}/{quote(identifier, safe=':')}",
+            })
+        tile_matrix_sets = []
+        for tile_matrix_set in TILE_MATRIX_SETS.values():
+            tile_matrix_sets.append({
+                "tile_matrix_set": tile_matrix_set,
+                # EPSG:4326 is defined in lat/lon axis order
+                "top_left_corner": " ".join(str(value) for value in (
+                    reversed(tile_matrix_set.origin) if tile_matrix_set.crs == 4326 else tile_matrix_set.origin)),
+                "tile_matrices": [
+                    {
+                        "zoom": zoom,
+                        "scale_denominator": tile_matrix_set.get_scale_denominator(zoom=zoom),
+                        "matrix_size": tile_matrix_set.get_matrix_size(zoom=zoom),
+                    } for zoom in range(settings.PROXY_TILE_MAX_ZOOM + 1)
+                ],
+            })
+        return HttpResponse(
+            content=render_to_string(
+                template_name="registry/xml/wmts/capabilities.xml",
+                context={
+                    "service_url": base_url,
+                    "layers": layers,
+                    "formats": sorted(set(TILE_FORMATS.values())),
+                    "tile_matrix_sets": tile_matrix_sets,
+                }),
+            content_type="application/xml")
@@ -0,0 +1,344 @@
+import io
+import os
+import shutil
+import time
+from tempfile import NamedTemporaryFile
+from typing import Dict, Iterator, Tuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from PIL import Image
+from redis import Redis
+from redis.exceptions import RedisError
+from registry.proxy.cache import LRUCache
+from registry.proxy.images import get_image_format, get_save_options
+from registry.proxy.transactions import on_commit_once
+
+# security key of the tiles, which show the unrestricted content of a layer
+PUBLIC_TILES = "public"
+# file extensions of the supported tile formats
+TILE_FORMATS = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "jpg": "image/jpeg",
+    "webp": "image/webp",
+}
+
+
+class TileMatrixSet:
+    """Quad tree tile matrix set, as defined by the OGC Two Dimensional Tile Matrix Set standard.
+
+    :attr identifier: the identifier of the tile matrix set, like ``WebMercatorQuad``
+    :attr crs: the epsg code of the coordinate reference system
+    :attr origin: the upper left corner of the tile matrix set in x/y axis order
+    :attr extent: the width and height of the tile matrix set in crs units
+    :attr matrix_width_at_zero: the count of tile columns at zoom level zero
+    """
+
+    def __init__(self, identifier: str, crs: int, origin: Tuple[float, float], extent: Tuple[float, float],
+                 matrix_width_at_zero: int = 1, tile_size: int = 256, well_known_scale_set: str = None):
+        self.identifier = identifier
+        self.crs = crs
+        self.origin = origin
+        self.extent = extent
+        self.matrix_width_at_zero = matrix_width_at_zero
+        self.tile_size = tile_size
+        self.well_known_scale_set = well_known_scale_set
+
+    def get_matrix_size(self, zoom: int) -> Tuple[int, int]:
+        """Return the count of columns and rows of the given zoom level."""
+        return self.matrix_width_at_zero * 2 ** zoom, 2 ** zoom
+
+    def get_tile_span(self, zoom: int) -> float:
+        """Return the width and height of a single tile of the given zoom level in crs units."""
+        return self.extent[1] / 2 ** zoom
+
+    def get_resolution(self, zoom: int) -> float:
+        return self.get_tile_span(zoom=zoom) / self.tile_size
+
+    def get_scale_denominator(self, zoom: int) -> float:
+        # standardized rendering pixel size of 0.28mm; degrees are converted with the equatorial circumference
+        meters_per_unit = 111319.49079327358 if self.crs == 4326 else 1
+        return self.get_resolution(zoom=zoom) * meters_per_unit / 0.00028
+
+    def contains(self, zoom: int, col: int, row: int) -> bool:
+        matrix_width, matrix_height = self.get_matrix_size(zoom=zoom)
+        return 0 <= zoom <= settings.PROXY_TILE_MAX_ZOOM and 0 <= col < matrix_width and 0 <= row < matrix_height
+
+    def get_bbox(self, zoom: int, col: int, row: int, cols: int = 1, rows: int = 1) -> Tuple[float, float, float, float]:
+        """Return the bbox of the given tile range in x/y axis order."""
+        span = self.get_tile_span(zoom=zoom)
+        min_x = self.origin[0] + col * span
+        max_y = self.origin[1] - row * span
+        return (min_x, max_y - rows * span, min_x + cols * span, max_y)
+
+    def get_tile_range(self, zoom: int, bbox: Tuple[float, float, float, float]) -> Tuple[int, int, int, int]:
+        """Return the first and last column and the first and last row of the tiles, which intersect the given bbox
+        in x/y axis order."""
+        matrix_width, matrix_height = self.get_matrix_size(zoom=zoom)
+        span = self.get_tile_span(zoom=zoom)
+
+        def clip(value, size):
+            return max(0, min(size - 1, int(value)))
+
+        return (
+            clip((bbox[0] - self.origin[0]) / span, matrix_width),
+            clip((bbox[2] - self.origin[0]) / span, matrix_width),
+            clip((self.origin[1] - bbox[3]) / span, matrix_height),
+            clip((self.origin[1] - bbox[1]) / span, matrix_height),
+        )
+
+    def get_metatile(self, zoom: int, col: int, row: int, meta_size: int) -> Tuple[int, int, int, int]:
+        """Return the first column, first row, column count and row count of the metatile, which contains the given
+        tile. Metatiles at the edge of the matrix are smaller."""
+        matrix_width, matrix_height = self.get_matrix_size(zoom=zoom)
+        meta_col = col // meta_size * meta_size
+        meta_row = row // meta_size * meta_size
+        return (meta_col, meta_row, min(meta_size, matrix_width - meta_col), min(meta_size, matrix_height - meta_row))
+
+
+TILE_MATRIX_SETS = {
+    "WebMercatorQuad": TileMatrixSet(
+        identifier="WebMercatorQuad",
+        crs=3857,
+        origin=(-20037508.3427892, 20037508.3427892),
+        extent=(40075016.6855784, 40075016.6855784),
+        well_known_scale_set="http://www.opengis.net/def/wkss/OGC/1.0/GoogleMapsCompatible",
+    ),
+    "WorldCRS84Quad": TileMatrixSet(
+        identifier="WorldCRS84Quad",
+        crs=4326,
+        origin=(-180.0, 90.0),
+        extent=(360.0, 180.0),
+        matrix_width_at_zero=2,
+        well_known_scale_set="http://www.opengis.net/def/wkss/OGC/1.0/GoogleCRS84Quad",
+    ),
+}
+
+
+def get_map_params(version: str, layer: str, tile_matrix_set: TileMatrixSet, bbox: Tuple[float, float, float, float],
+                   width: int, height: int, mime_type: str) -> dict:
+    """Return the query parameters of the wms GetMap request for the given bbox in x/y axis order."""
+    if version.startswith("1.3") and tile_matrix_set.crs == 4326:
+        # wms 1.3.0 uses the lat/lon axis order of EPSG:4326
+        bbox = (bbox[1], bbox[0], bbox[3], bbox[2])
+    return {
+        "SERVICE": "WMS",
+        "VERSION": version,
+        "REQUEST": "GetMap",
+        "LAYERS": layer,
+        "STYLES": "",
+        "CRS" if version.startswith("1.3") else "SRS": f"EPSG:{tile_matrix_set.crs}",
+        "BBOX": ",".join(repr(value) for value in bbox),
+        "WIDTH": str(width),
+        "HEIGHT": str(height),
+        "FORMAT": mime_type,
+        "TRANSPARENT": "TRUE" if mime_type == "image/png" else "FALSE",
+    }
+
+
+def split_metatile(content: bytes, cols: int, rows: int, tile_size: int, mime_type: str) -> Dict[Tuple[int, int], bytes]:
+    """Split the encoded metatile image into encoded tiles.
+
+    :return: the encoded tiles by their column and row offset inside the metatile
+    """
+    image = Image.open(io.BytesIO(content))
+    image.load()
+    image_format = get_image_format(mime_type=mime_type)
+    save_options = get_save_options(image_format=image_format)
+    tiles = {}
+    for row in range(rows):
+        for col in range(cols):
+            tile = image.crop((col * tile_size, row * tile_size,
+                               (col + 1) * tile_size, (row + 1) * tile_size))
+            out_bytes_stream = io.BytesIO()
+            tile.save(out_bytes_stream, image_format, **save_options)
+            tiles[(col, row)] = out_bytes_stream.getvalue()
+    return tiles
+
+
+class TileKey:
+    """Address of a cached tile.
+
+    :attr security_key: :data:`PUBLIC_TILES` for tiles which show the unrestricted content of the layer, or the hash
+                        of the union of the allowed areas, which was applied to the tile
+    """
+    __slots__ = ("service_pk", "layer", "security_key",
+                 "tile_matrix_set", "zoom", "col", "row", "extension")
+
+    def __init__(self, service_pk, layer: str, security_key: str, tile_matrix_set: str, zoom: int, col: int, row: int,
+                 extension: str):
+        self.service_pk = service_pk
+        self.layer = layer
+        self.security_key = security_key
+        self.tile_matrix_set = tile_matrix_set
+        self.zoom = zoom
+        self.col = col
+        self.row = row
+        self.extension = extension
+
+    def __str__(self):
+        return (f"{self.service_pk}/{self.layer}/{self.security_key}/{self.tile_matrix_set}/{self.zoom}/{self.col}/"
+                f"{self.row}.{self.extension}")
+
+    def get_sibling(self, col: int, row: int) -> "TileKey":
+        return TileKey(service_pk=self.service_pk, layer=self.layer, security_key=self.security_key,
+                       tile_matrix_set=self.tile_matrix_set, zoom=self.zoom, col=col, row=row,
+                       extension=self.extension)
+
+
+class BaseTileCache:
+    """Interface of the tile cache backends."""
+
+    def __init__(self, timeout: int):
+        self.timeout = timeout
+
+    def get(self, key: TileKey) -> bytes:
+        raise NotImplementedError
+
+    def set(self, key: TileKey, content: bytes) -> None:
+        raise NotImplementedError
+
+    def set_many(self, tiles: Dict[TileKey, bytes]) -> None:
+        for key, content in tiles.items():
+            self.set(key=key, content=content)
+
+    def purge(self, service_pk, layer: str = None) -> None:
+        """Remove all tiles of the given service or only of the given layer of it."""
+        raise NotImplementedError
+
+
+class FileSystemTileCache(BaseTileCache):
+    """Stores tiles as files below ``location``.
+
+    Columns and rows are split in groups of three digits, so no directory holds more than thousand entries:
+    ``<service>/<layer>/<security key>/<tile matrix set>/<zoom>/000/001/234/000/005/678.png``
+    """
+
+    def __init__(self, timeout: int, location: str):
+        super().__init__(timeout=timeout)
+        self.location = location
+
+    def _get_layer_path(self, service_pk, layer: str) -> str:
+        # layer identifiers may contain characters, which are not allowed in paths
+        return os.path.join(self.location, str(service_pk), layer.encode("UTF-8").hex())
+
+    def get_path(self, key: TileKey) -> str:
+        col = f"{key.col:09d}"
+        row = f"{key.row:09d}"
+        return os.path.join(
+            self._get_layer_path(service_pk=key.service_pk, layer=key.layer),
+            key.security_key,
+            key.tile_matrix_set,
+            f"{key.zoom:02d}",
+            col[0:3], col[3:6], col[6:9],
+            row[0:3], row[3:6], f"{row[6:9]}.{key.extension}",
+        )
+
+    def get(self, key: TileKey) -> bytes:
+        path = self.get_path(key=key)
+        try:
+            if self.timeout and time.time() - os.path.getmtime(path) > self.timeout:
+                return None
+            with open(path, "rb") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def set(self, key: TileKey, content: bytes) -> None:
+        path = self.get_path(key=key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, so concurrent readers never see half written tiles
+        with NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as file:
+            file.write(content)
+        os.replace(file.name, path)
+
+    def purge(self, service_pk, layer: str = None) -> None:
+        path = self._get_layer_path(service_pk=service_pk, layer=layer) if layer else os.path.join(
+            self.location, str(service_pk))
+        shutil.rmtree(path, ignore_errors=True)
+
+
+class RedisTileCache(BaseTileCache):
+    """Stores tiles as redis strings, which expire after ``timeout`` seconds."""
+
+    def __init__(self, timeout: int, location: str):
+        super().__init__(timeout=timeout)
+        self.location = location
+        self._redis = None
+
+    @property
+    def redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = Redis.from_url(self.location)
+        return self._redis
+
+    def _get_prefix(self, service_pk, layer: str = None) -> str:
+        prefix = f"mrmap:tiles:{service_pk}:"
+        return f"{prefix}{layer.encode('UTF-8').hex()}:" if layer else prefix
+
+    def get_redis_key(self, key: TileKey) -> str:
+        return (f"{self._get_prefix(service_pk=key.service_pk, layer=key.layer)}{key.security_key}:"
+                f"{key.tile_matrix_set}:{key.zoom}:{key.col}:{key.row}.{key.extension}")
+
+    def get(self, key: TileKey) -> bytes:
+        try:
+            return self.redis.get(self.get_redis_key(key=key))
+        except RedisError as e:
+            settings.ROOT_LOGGER.exception(e)
+            return None
+
+    def set(self, key: TileKey, content: bytes) -> None:
+        self.set_many(tiles={key: content})
+
+    def set_many(self, tiles: Dict[TileKey, bytes]) -> None:
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            for key, content in tiles.items():
+                pipeline.set(self.get_redis_key(key=key), content,
+                             ex=self.timeout or None)
+            pipeline.execute()
+        except RedisError as e:
+            settings.ROOT_LOGGER.exception(e)
+
+    def _scan(self, match: str) -> Iterator[bytes]:
+        yield from self.redis.scan_iter(match=match, count=1000)
+
+    def purge(self, service_pk, layer: str = None) -> None:
+        batch = []
+        for redis_key in self._scan(match=f"{self._get_prefix(service_pk=service_pk, layer=layer)}*"):
+            batch.append(redis_key)
+            if len(batch) >= 1000:
+                self.redis.unlink(*batch)
+                batch = []
+        if batch:
+            self.redis.unlink(*batch)
+
+
+def get_tile_cache() -> BaseTileCache:
+    """Return the tile cache which is configured by ``settings.PROXY_TILE_CACHE``."""
+    backend_cls = import_string(settings.PROXY_TILE_CACHE["BACKEND"])
+    return backend_cls(timeout=settings.PROXY_TILE_CACHE["TIMEOUT"], location=settings.PROXY_TILE_CACHE["LOCATION"])
+
+
+tile_cache = get_tile_cache()
+# the wms version per service, which is needed to construct the GetMap request before the service is loaded
+service_version_cache = LRUCache(
+    max_size=settings.PROXY_CAPABILITIES_CACHE_SIZE)
+
+
+def _purge_tiles(service_pk) -> None:
+    from registry.tasks.security import \
+        async_purge_tiles  # to avoid circular import
+
+    async_purge_tiles.delay(service_pk=str(service_pk))
+
+
+def purge_tiles_on_commit(service_pk) -> None:
+    """Purge the cached tiles of the given service in the background after the current transaction was committed, or
+    immediately in autocommit mode.
+
+    Registering or updating a service saves thousands of layers; with that the tiles are purged only once.
+    """
+    service_version_cache.invalidate(group=service_pk)
+    on_commit_once(func=_purge_tiles, key=service_pk)
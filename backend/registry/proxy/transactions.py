@@ -0,0 +1,45 @@
+import threading
+from typing import Callable, Hashable
+
+from django.db import transaction
+
+_callbacks = threading.local()
+
+
+def on_commit_once(func: Callable[[Hashable], None], key: Hashable, using: str = None) -> None:
+    """Call ``func(key)`` once after the current transaction is committed, no matter how often it is registered for
+    the same key during the transaction.
+
+    Registering a service saves thousands of layers; with that the signal handlers of the layers invalidate the caches
+    of a service only once. Outside of atomic blocks ``func`` is called immediately. If the transaction or the
+    savepoint the callback was registered in is rolled back, django discards the callback and the next call registers
+    it again.
+    """
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        func(key)
+        return
+
+    callbacks = getattr(_callbacks, connection.alias, None)
+    if callbacks is None:
+        callbacks = {}
+        setattr(_callbacks, connection.alias, callbacks)
+    if getattr(_callbacks, f"{connection.alias}_run_on_commit", None) is not connection.run_on_commit:
+        # django replaces the list of callbacks, if it runs them or discards the callbacks of rolled back transactions
+        # or savepoints; so only then the registered callbacks need to be checked
+        registered = {id(callback) for _, callback, _ in connection.run_on_commit}
+        for callback_key in [callback_key for callback_key, callback in callbacks.items()
+                             if id(callback) not in registered]:
+            del callbacks[callback_key]
+        setattr(_callbacks, f"{connection.alias}_run_on_commit", connection.run_on_commit)
+    if (func, key) in callbacks:
+        return
+
+    def callback():
+        if callbacks.get((func, key)) is callback:
+            del callbacks[(func, key)]
+        func(key)
+
+    callbacks[(func, key)] = callback
+    # one failing callback shall not discard the invalidations of other services
+    transaction.on_commit(callback, using=using, robust=True)
@@ -0,0 +1,285 @@
+import random
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from threading import BoundedSemaphore, Lock
+from typing import AsyncIterator, Callable, Iterator
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from redis import Redis
+from redis.exceptions import RedisError
+from registry.proxy.metrics import Counters
+
+# the request is send as usual
+CLOSED = "closed"
+# the request is the single probe, which decides if an open circuit is closed again
+PROBE = "probe"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# acquire a slot of the sorted set semaphore: drop expired leases, add the lease if a slot is free
+ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1] - ARGV[2])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[3]) then
+    redis.call('ZADD', KEYS[1], ARGV[1], ARGV[4])
+    redis.call('PEXPIRE', KEYS[1], math.ceil(ARGV[2] * 1000))
+    return 1
+end
+return 0
+"""
+
+
+def is_failure(response) -> bool:
+    """Timeouts, connection errors and 5xx responses of the remote service count as failures."""
+    if isinstance(response, dict):
+        return response.get("status_code", 500) >= 500
+    return response.status_code >= 500
+
+
+def get_unavailable_response(message: str) -> dict:
+    return {
+        "status_code": 503,
+        "code": "ServiceUnavailable",
+        "content": message,
+    }
+
+
+class ConcurrencyLimiter:
+    """Limit the concurrent requests per upstream host, so a hanging remote service can't block all workers.
+
+    With ``use_redis`` the slots are shared by all processes: every request holds a lease in a redis sorted set. Leases
+    expire after ``lease_timeout`` seconds, so slots of crashed processes are freed again. Without redis, or if redis is
+    not reachable, the slots are counted per process.
+
+    Requests wait up to ``queue_timeout`` seconds for a free slot. Waiting for a redis lease polls redis with an
+    exponential backoff from ``MIN_POLL_INTERVAL`` up to ``MAX_POLL_INTERVAL`` seconds.
+    """
+    MIN_POLL_INTERVAL = 0.005
+    MAX_POLL_INTERVAL = 0.1
+
+    def __init__(self, limit: int, queue_timeout: float = 1, lease_timeout: float = 60, use_redis: bool = False):
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.lease_timeout = lease_timeout
+        self.use_redis = use_redis
+        self.counters = Counters(name="concurrency_limiter")
+        self._semaphores = {}
+        self._lock = Lock()
+        self._redis = None
+        self._acquire_script = None
+
+    def _get_redis(self) -> Redis:
+        if self._redis is None:
+            self._redis = Redis.from_url(settings.BROKER_URL)
+            self._acquire_script = self._redis.register_script(ACQUIRE_SCRIPT)
+        return self._redis
+
+    def _get_semaphore(self, host: str) -> BoundedSemaphore:
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            with self._lock:
+                semaphore = self._semaphores.setdefault(
+                    host, BoundedSemaphore(self.limit))
+        return semaphore
+
+    def _acquire_lease(self, host: str) -> str:
+        key = f"mrmap:upstream:{host}:leases"
+        lease = uuid.uuid4().hex
+        deadline = time.monotonic() + self.queue_timeout
+        interval = self.MIN_POLL_INTERVAL
+        self._get_redis()
+        while True:
+            if self._acquire_script(keys=[key], args=[time.time(), self.lease_timeout, self.limit, lease]):
+                return lease
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # the jitter keeps waiting processes from polling redis all at the same time
+            time.sleep(min(random.uniform(interval / 2, interval), remaining))
+            interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+
+    def acquire(self, host: str) -> Callable[[], None]:
+        """Take a slot of the given host, waiting up to ``queue_timeout`` seconds.
+
+        :return: the function which releases the slot again, or ``None`` if no slot was free in time
+        """
+        if not self.limit:
+            return lambda: None
+
+        if self.use_redis:
+            try:
+                lease = self._acquire_lease(host=host)
+            except RedisError as e:
+                settings.ROOT_LOGGER.warning(
+                    f"can't acquire upstream lease, falling back to process local limit: {e}")
+            else:
+                if lease is None:
+                    self.counters.increment("rejected")
+                    return None
+                return lambda: self._release_lease(host=host, lease=lease)
+
+        semaphore = self._get_semaphore(host=host)
+        if not semaphore.acquire(timeout=self.queue_timeout):
+            self.counters.increment("rejected")
+            return None
+        return semaphore.release
+
+    def _release_lease(self, host: str, lease: str) -> None:
+        try:
+            self._get_redis().zrem(f"mrmap:upstream:{host}:leases", lease)
+        except RedisError as e:
+            # the lease expires by itself
+            settings.ROOT_LOGGER.warning(f"can't release upstream lease: {e}")
+
+    @contextmanager
+    def limit_host(self, host: str) -> Iterator[bool]:
+        """Hold a slot of the given host while the context is active; yields false if no slot was free in time."""
+        release = self.acquire(host=host)
+        if release is None:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            release()
+
+    @asynccontextmanager
+    async def alimit_host(self, host: str) -> AsyncIterator[bool]:
+        """Async variant of :meth:`~ConcurrencyLimiter.limit_host`; waiting for a slot does not block the event loop."""
+        release = await sync_to_async(self.acquire, thread_sensitive=False)(host=host)
+        if release is None:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            await sync_to_async(release, thread_sensitive=False)()
+
+
+class CircuitBreaker:
+    """Stop requesting a remote service, which failed ``threshold`` times within the last ``window`` seconds.
+
+    While the circuit of a service is open, requests are answered immediately with a ``ServiceUnavailable`` exception.
+    After ``reset_timeout`` seconds the circuit is half open: one request of any process is send as probe. If it
+    succeeds the circuit is closed again; otherwise it stays open for another ``reset_timeout`` seconds.
+
+    The state is stored in the django cache, so all processes share it. Failures are counted in ten buckets per window.
+    If the cache is not reachable, all requests are send.
+    """
+    BUCKETS = 10
+
+    def __init__(self, threshold: int = 5, window: float = 30, reset_timeout: float = 30, cache_alias: str = "default"):
+        self.threshold = threshold
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.cache_alias = cache_alias
+        self.counters = Counters(name="circuit_breaker")
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _get_state_key(self, service_pk) -> str:
+        return f"mrmap:circuit:{service_pk}:state"
+
+    def _get_probe_key(self, service_pk) -> str:
+        return f"mrmap:circuit:{service_pk}:probe"
+
+    def _get_bucket_keys(self, service_pk, now: float) -> list:
+        bucket_size = self.window / self.BUCKETS
+        current = int(now // bucket_size)
+        return [f"mrmap:circuit:{service_pk}:failures:{bucket}" for bucket in range(current - self.BUCKETS + 1, current + 1)]
+
+    def allow(self, service_pk) -> str:
+        """Return :data:`CLOSED` or :data:`PROBE` if the request can be send, or ``None`` if the circuit is open."""
+        try:
+            state = self.cache.get(self._get_state_key(service_pk=service_pk))
+            if state is None:
+                return CLOSED
+            if time.time() - state["opened_at"] < self.reset_timeout:
+                self.counters.increment("rejected")
+                return None
+            if self.cache.add(self._get_probe_key(service_pk=service_pk), 1, timeout=self.reset_timeout):
+                self.counters.increment("probes")
+                return PROBE
+        except Exception as e:
+            settings.ROOT_LOGGER.warning(f"can't read circuit state: {e}")
+            return CLOSED
+        # another request is already probing the remote service
+        self.counters.increment("rejected")
+        return None
+
+    def _open(self, service_pk, failures: int) -> None:
+        self.counters.increment("opened")
+        self.cache.set(self._get_state_key(service_pk=service_pk),
+                       {"opened_at": time.time(), "failures": failures}, timeout=None)
+
+    def record(self, service_pk, mode: str, success: bool) -> None:
+        """Record the result of a request, which was allowed with the given mode."""
+        try:
+            if mode == PROBE:
+                if success:
+                    self.counters.increment("closed")
+                    self.cache.delete_many([
+                        self._get_state_key(service_pk=service_pk),
+                        self._get_probe_key(service_pk=service_pk),
+                        *self._get_bucket_keys(service_pk=service_pk, now=time.time())])
+                else:
+                    self._open(service_pk=service_pk, failures=self.threshold)
+                    self.cache.delete(
+                        self._get_probe_key(service_pk=service_pk))
+            elif not success:
+                bucket_keys = self._get_bucket_keys(
+                    service_pk=service_pk, now=time.time())
+                self.cache.add(bucket_keys[-1], 0, timeout=int(self.window) + 1)
+                self.cache.incr(bucket_keys[-1])
+                failures = sum(self.cache.get_many(bucket_keys).values())
+                if failures >= self.threshold:
+                    self._open(service_pk=service_pk, failures=failures)
+        except Exception as e:
+            settings.ROOT_LOGGER.warning(f"can't record circuit state: {e}")
+
+    def cancel(self, service_pk, mode: str) -> None:
+        """Release the probe of a request, which was not send."""
+        if mode == PROBE:
+            try:
+                self.cache.delete(self._get_probe_key(service_pk=service_pk))
+            except Exception as e:
+                settings.ROOT_LOGGER.warning(
+                    f"can't release circuit probe: {e}")
+
+    def get_state(self, service_pk) -> dict:
+        """Return the state of the circuit of the given service, like ``{"state": "open", "failures": 5, "openedAt":
+        "2024-01-01T00:00:00+00:00"}``."""
+        try:
+            now = time.time()
+            values = self.cache.get_many(
+                [self._get_state_key(service_pk=service_pk), *self._get_bucket_keys(service_pk=service_pk, now=now)])
+        except Exception as e:
+            settings.ROOT_LOGGER.warning(f"can't read circuit state: {e}")
+            return {"state": None, "failures": None, "openedAt": None}
+        state = values.pop(self._get_state_key(
+            service_pk=service_pk), None)
+        if state is None:
+            return {"state": CLOSED, "failures": sum(values.values()), "openedAt": None}
+        return {
+            "state": OPEN if now - state["opened_at"] < self.reset_timeout else HALF_OPEN,
+            "failures": state["failures"],
+            "openedAt": datetime.fromtimestamp(state["opened_at"], tz=timezone.utc).isoformat(),
+        }
+
+
+concurrency_limiter = ConcurrencyLimiter(
+    limit=settings.PROXY_UPSTREAM_CONCURRENCY_LIMIT,
+    queue_timeout=settings.PROXY_UPSTREAM_QUEUE_TIMEOUT,
+    lease_timeout=settings.PROXY_UPSTREAM_TIMEOUT * 6,
+    use_redis=settings.PROXY_UPSTREAM_CONCURRENCY_REDIS,
+)
+circuit_breaker = CircuitBreaker(
+    threshold=settings.PROXY_CIRCUIT_BREAKER_THRESHOLD,
+    window=settings.PROXY_CIRCUIT_BREAKER_WINDOW,
+    reset_timeout=settings.PROXY_CIRCUIT_BREAKER_RESET_TIMEOUT,
+)
@@ -0,0 +1,188 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from itertools import groupby
+from typing import List, Tuple
+
+from django.conf import settings
+from django.db import connection
+from django.db.models.functions import datetime
+from django.http import Http404, HttpRequest, HttpResponse
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.generic.base import View
+from ows_lib.models.ogc_request import OGCRequest
+from registry.models.mapcontext import MapContext, MapContextLayer
+from registry.proxy.images import composite_images
+from registry.proxy.ogc_exceptions import (InvalidParameterValue,
+                                           LayerNotDefined,
+                                           MissingParameterException)
+from registry.proxy.ogc_exceptions import RuntimeError as MrMapRuntimeError
+from registry.proxy.wms_proxy import WebMapServiceProxy
+
+# GetMap parameters, which are passed as they are to the GetMap request of every service
+SHARED_GET_MAP_PARAMS = ("VERSION", "CRS", "SRS", "BBOX",
+                         "WIDTH", "HEIGHT", "TIME", "ELEVATION")
+
+# one budget for the upstream requests of all virtual GetMap requests of this process
+executor = ThreadPoolExecutor(
+    max_workers=settings.PROXY_VIRTUAL_WMS_MAX_WORKERS, thread_name_prefix="virtual-wms")
+
+
+def render_service_map(request: HttpRequest, service_pk, layers: List[str], styles: List[str],
+                       params: dict) -> bytes:
+    """Request the given layers of one service through the security proxy of the service.
+
+    All security decisions, like the allowed areas of the requesting user, are taken by
+    :class:`registry.proxy.wms_proxy.WebMapServiceProxy`, so the secured map image is already masked.
+
+    :return: the encoded map image or ``None`` if the service did not respond with an image.
+    """
+    view = WebMapServiceProxy()
+    view.setup(request, pk=service_pk)
+    view.start_time = datetime.datetime.now()
+    view.ogc_request = OGCRequest(
+        method="GET",
+        url=request.build_absolute_uri(
+            reverse("wms-operation", args=[service_pk])),
+        params={
+            **params,
+            "SERVICE": "WMS",
+            "REQUEST": "GetMap",
+            "LAYERS": ",".join(layers),
+            "STYLES": ",".join(styles),
+            "FORMAT": "image/png",
+            "TRANSPARENT": "TRUE",
+        },
+        django_request=request,
+    )
+    try:
+        response = view.get_and_post(request=request)
+        if response.status_code != 200 or not response.get("Content-Type", "").startswith("image/") \
+                or response.get("Content-Encoding"):
+            return None
+        try:
+            return b"".join(response.streaming_content) if response.streaming else response.content
+        finally:
+            response.close()
+    except Http404:
+        return None
+    except Exception as e:
+        settings.ROOT_LOGGER.exception(e)
+        return None
+    finally:
+        connection.close()
+
+
+def get_contents(futures: List[Future], timeout: float) -> List[bytes]:
+    """Return the results of the given upstream requests; requests which are not done within ``timeout`` seconds are
+    cancelled and their layers are left out, like the layers of services which respond with an error."""
+    deadline = time.monotonic() + timeout
+    contents = []
+    for future in futures:
+        try:
+            contents.append(future.result(
+                timeout=max(deadline - time.monotonic(), 0)))
+        except FutureTimeoutError:
+            future.cancel()
+            contents.append(None)
+    return contents
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class VirtualWebMapServiceProxy(View):
+    """Virtual WMS, which renders the layers of a map context from several registered services as one map image.
+
+    The layers are requested with one GetMap request per service in parallel; consecutive layers of the same service
+    are requested together. The requests share one per process thread pool of ``settings.PROXY_VIRTUAL_WMS_MAX_WORKERS``
+    threads and the pooled upstream sessions of the services. The secured map images are composited in memory.
+
+    ``LAYERS`` is a list of map context layer ids, drawn from bottom to top like wms layers. Without ``LAYERS`` all
+    active rendering layers of the map context are drawn; the first layer of the map context tree is on top.
+
+    Only the ``GetMap`` operation is supported. Layers which can't be requested by the user, or which services respond
+    with an error or not within ``settings.PROXY_UPSTREAM_TIMEOUT`` and ``settings.PROXY_UPSTREAM_QUEUE_TIMEOUT``
+    seconds, are left out of the map image.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        self.start_time = datetime.datetime.now()
+        self.ogc_request = OGCRequest.from_django_request(request)
+        params = self.ogc_request.ogc_query_params
+
+        if params.get("REQUEST", "").lower() != "getmap":
+            return InvalidParameterValue(
+                ogc_request=self.ogc_request, locator="request", message="the virtual wms only supports GetMap.")
+        for param in ("VERSION", "BBOX", "WIDTH", "HEIGHT"):
+            if not params.get(param):
+                return MissingParameterException(ogc_request=self.ogc_request, locator=param.lower())
+        try:
+            width, height = int(params["WIDTH"]), int(params["HEIGHT"])
+        except ValueError:
+            return InvalidParameterValue(ogc_request=self.ogc_request, locator="width")
+
+        if not MapContext.objects.filter(pk=self.kwargs.get("pk")).exists():
+            raise Http404
+        layers = self.get_layers()
+        if layers is None:
+            return LayerNotDefined(ogc_request=self.ogc_request)
+
+        shared_params = {param: params[param]
+                         for param in SHARED_GET_MAP_PARAMS if params.get(param)}
+        # the lazy user of the request is evaluated once here, instead of concurrently by the threads of the requests
+        request.user.is_authenticated
+        futures = []
+        for service_pk, service_layers in groupby(layers, key=lambda layer: layer[0]):
+            service_layers = list(service_layers)
+            futures.append(executor.submit(
+                render_service_map,
+                request=request,
+                service_pk=service_pk,
+                layers=[identifier for _, identifier,
+                        _ in service_layers],
+                styles=[style or "" for _, _, style in service_layers],
+                params=shared_params,
+            ))
+
+        mime_type = params.get("FORMAT", "image/png")
+        try:
+            content = composite_images(
+                contents=get_contents(
+                    futures=futures,
+                    timeout=settings.PROXY_UPSTREAM_TIMEOUT + settings.PROXY_UPSTREAM_QUEUE_TIMEOUT),
+                mime_type=mime_type,
+                width=width,
+                height=height,
+                transparent=params.get(
+                    "TRANSPARENT", "FALSE").upper() == "TRUE",
+                bgcolor=params.get("BGCOLOR"),
+            )
+        except OSError as e:
+            settings.ROOT_LOGGER.exception(e)
+            return MrMapRuntimeError(ogc_request=self.ogc_request)
+        return HttpResponse(content=content, content_type=mime_type)
+
+    def get_layers(self) -> List[Tuple[str, str, str]]:
+        """Return the service pk, layer identifier and style name of the requested layers from bottom to top, or
+        ``None`` if any requested layer is not a rendering layer of the map context."""
+        map_context_layers = MapContextLayer.objects.filter(
+            map_context__pk=self.kwargs.get("pk"),
+            rendering_layer__isnull=False,
+            rendering_layer__identifier__isnull=False,
+        ).order_by("mptt_tree", "mptt_lft")
+        requested = [pk for pk in self.ogc_request.ogc_query_params.get(
+            "LAYERS", "").split(",") if pk]
+        if not requested:
+            map_context_layers = map_context_layers.filter(
+                rendering_active=True)
+        values = {
+            str(pk): (str(service_pk), identifier, style)
+            for pk, service_pk, identifier, style in map_context_layers.values_list(
+                "pk", "rendering_layer__service_id", "rendering_layer__identifier", "layer_style__name")
+        }
+        if not requested:
+            return list(reversed(values.values()))
+        if any(pk not in values for pk in requested):
+            return None
+        return [values[pk] for pk in requested]
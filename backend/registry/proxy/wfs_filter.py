@@ -0,0 +1,107 @@
+import copy
+from typing import List
+
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry
+from epsg_cache.utils import adjust_axis_order
+from lxml import etree
+from ows_lib.xml_mapper.xml_requests.wfs.get_feature import (
+    AndCondition, Filter, GetFeatureRequest, OrCondition, Query,
+    WithinCondition)
+
+
+def get_filter_geometry(geometry: GEOSGeometry, service_version: str) -> GEOSGeometry:
+    """Return a copy of the given allowed area with the axis order of the requested wfs version, simplified by
+    ``settings.PROXY_WFS_FILTER_SIMPLIFY_TOLERANCE``."""
+    geometry = geometry.clone()
+    if settings.PROXY_WFS_FILTER_SIMPLIFY_TOLERANCE:
+        geometry = geometry.simplify(
+            tolerance=settings.PROXY_WFS_FILTER_SIMPLIFY_TOLERANCE, preserve_topology=True)
+    # The given geometry object has always the x/y representation for there coordinates
+    # from geoserver docs: https://docs.geoserver.org/stable/en/user/services/wfs/axis_order.html
+    # WFS 1.0.0: Provides geographic coordinates in east/north and may not be trusted to respect the EPSG definition axis order.
+    # So for WFS 1.0.0 we don't need anything to do. It is interpreted as x/y
+    if service_version != "1.0.0":
+        # All other versions of wfs uses the epsg definition of axis ordering.
+        # WFS 1.1.0: Respects the axis order defined by the EPSG definition.
+        # WFS 2.0.0: Respects the axis order defined by the EPSG definition.
+        # So we need to request the epsg registry and adjust the axis order if needed.
+        geometry = adjust_axis_order(geometry)
+    return geometry
+
+
+class SpatialFilter:
+    """The spatial filter condition of a secured feature type, which is appended to the queries of GetFeature requests.
+
+    The fes condition with the coordinates of the allowed area is built once by
+    :meth:`ows_lib.xml_mapper.xml_requests.wfs.get_feature.GetFeatureRequest.secure_spatial` on a request with a
+    single query and serialized. Securing a request parses the serialized condition and splices it into the query,
+    instead of formatting all coordinates of the allowed area again.
+
+    :attr geometry: the axis order adjusted allowed area
+    :attr value_reference: the name of the geometry property of the feature type
+    """
+    __slots__ = ("geometry", "value_reference", "fragment")
+
+    def __init__(self, geometry: GEOSGeometry, value_reference: str):
+        self.geometry = geometry
+        self.value_reference = value_reference
+        self.fragment = None
+        if not geometry.empty:
+            self.fragment = self._serialize_condition()
+
+    def _serialize_condition(self) -> bytes:
+        get_feature_request = GetFeatureRequest()
+        query = Query()
+        query.type_names = ["secured"]
+        get_feature_request.queries.append(query)
+        get_feature_request.secure_spatial(feature_types=[{
+            "type_name": "secured", "geometry_property_name": self.value_reference,
+            "allowed_area_union": self.geometry}])
+        _filter = get_feature_request.queries[0].filter
+        condition = _filter.or_condition if _filter.or_condition else _filter.within_conditions[0]
+        node = copy.deepcopy(condition.node)
+        # the namespaces of the throwaway request are not needed by the condition
+        etree.cleanup_namespaces(node)
+        return etree.tostring(node)
+
+    def get_condition(self):
+        """Return a new :class:`WithinCondition` or :class:`OrCondition` object of the serialized condition."""
+        node = etree.fromstring(self.fragment)
+        if etree.QName(node).localname == OrCondition.ROOT_NAME:
+            return OrCondition(node=node)
+        return WithinCondition(node=node)
+
+
+def _adjust_filter_node(query: Query) -> None:
+    """Add a filter to the query, or combine the existing filter with a ``fes:And`` node, like
+    :meth:`ows_lib.xml_mapper.xml_requests.wfs.get_feature.GetFeatureRequest.secure_spatial` does it."""
+    if not query.filter:
+        query.filter = Filter()
+    elif not query.filter.and_condition:
+        old_filter = copy.deepcopy(query.filter.node)
+        query.filter = Filter()
+        query.filter.and_condition = AndCondition()
+        query.filter.and_condition.node.extend(list(old_filter))
+
+
+def secure_get_feature_request(get_feature_request: GetFeatureRequest, spatial_filters: List[dict]) -> None:
+    """Same as :meth:`ows_lib.xml_mapper.xml_requests.wfs.get_feature.GetFeatureRequest.secure_spatial`, but with
+    the pre serialized conditions of the given ``{"type_name": ..., "spatial_filter": SpatialFilter}`` dicts."""
+    lookup_dict = {spatial_filter["type_name"]: spatial_filter["spatial_filter"] for spatial_filter in spatial_filters}
+
+    query: Query
+    for query in get_feature_request.queries:
+        if len(query.type_names) > 1:
+            raise NotImplementedError(
+                "Currently we can't secure a query with multple type names in a single query node.")
+        spatial_filter: SpatialFilter = lookup_dict.get(query.type_names[0])
+        if spatial_filter is None or spatial_filter.fragment is None:
+            continue
+        _adjust_filter_node(query=query)
+        condition = spatial_filter.get_condition()
+        xml_node = query.filter.and_condition if query.filter.and_condition else query.filter
+        if isinstance(condition, WithinCondition):
+            xml_node.within_conditions.append(condition)
+        else:
+            xml_node.or_condition = condition
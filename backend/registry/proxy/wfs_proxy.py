@@ -5,14 +5,16 @@ import json
 from django.contrib.gis.geos import GEOSGeometry
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
-from epsg_cache.utils import adjust_axis_order
 from ows_lib.client.wfs.mixins import \
     WebFeatureServiceMixin as WebFeatureServiceClient
 from registry.models.service import WebFeatureService
-from registry.proxy.mixins import OgcServiceProxyView
+from registry.proxy.mixins import (AsyncOgcServiceProxyView,
+                                   OgcServiceProxyView)
 from registry.proxy.ogc_exceptions import ForbiddenException
 from registry.proxy.ogc_exceptions import \
     NotImplementedError as MrMapNotImplementedError
+from registry.proxy.wfs_filter import (SpatialFilter, get_filter_geometry,
+                                       secure_get_feature_request)
 
 
 @method_decorator(csrf_exempt, name="dispatch")
@@ -36,26 +38,26 @@ class WebFeatureServiceProxy(OgcServiceProxyView):
 
             # The security manager of server model does provide security_info_per_feature_type attribute as json encoded object.
             # To use the information in common django/python way, we convert the given json object to dict/geos objects.
+            # The security policy snapshot provides the cached spatial filters already.
             _security_info_per_feature_type = []
 
             for security_info in self._service.security_info_per_feature_type:
-                polygon_dict = security_info.get("allowed_area_union")
-                geometry = GEOSGeometry(json.dumps(polygon_dict))
-                # The given geometry object has always the x/y representation for there coordinates
-                # from geoserver docs: https://docs.geoserver.org/stable/en/user/services/wfs/axis_order.html
-                # WFS 1.0.0: Provides geographic coordinates in east/north and may not be trusted to respect the EPSG definition axis order.
-                # So for WFS 1.0.0 we don't need anything to do. It is interpreted as x/y
-                if self.ogc_request.service_version != "1.0.0":
-                    # All other versions of wfs uses the epsg definition of axis ordering.
-                    # WFS 1.1.0: Respects the axis order defined by the EPSG definition.
-                    # WFS 2.0.0: Respects the axis order defined by the EPSG definition.
-                    # So we need to request the epsg registry and adjust the axis order if needed.
-                    geometry = adjust_axis_order(geometry)
+                spatial_filter = security_info.get("spatial_filter")
+                if spatial_filter is None:
+                    allowed_area_union = security_info.get("allowed_area_union")
+                    if not isinstance(allowed_area_union, GEOSGeometry):
+                        allowed_area_union = GEOSGeometry(
+                            json.dumps(allowed_area_union))
+                    spatial_filter = SpatialFilter(
+                        geometry=get_filter_geometry(
+                            geometry=allowed_area_union, service_version=self.ogc_request.service_version),
+                        value_reference=security_info.get("geometry_property_name"))
                 _security_info_per_feature_type.append(
                     {
                         "type_name": security_info.get("type_name"),
                         "geometry_property_name": security_info.get("geometry_property_name"),
-                        "allowed_area_union": geometry
+                        "allowed_area_union": spatial_filter.geometry,
+                        "spatial_filter": spatial_filter,
                     }
                 )
 
@@ -81,15 +83,19 @@ class WebFeatureServiceProxy(OgcServiceProxyView):
         try:
             if self.ogc_request.service_version.split(".")[0] != "2":
                 return MrMapNotImplementedError(ogc_request=self.ogc_request, message="MrMap currently can only handle wfs 2.x.x GetFeature requests")
-            self.ogc_request.xml_request.secure_spatial(
-                feature_types=self.service.security_info_per_feature_type)
+            secure_get_feature_request(
+                get_feature_request=self.ogc_request.xml_request,
+                spatial_filters=self.service.security_info_per_feature_type)
         except NotImplementedError:
             return ForbiddenException(
                 ogc_request=self.ogc_request,
                 message="MrMap can't secure the given request. Maybe you request multiple typenames in a single query.")
-        response = self.remote_service.send_request(
-            self.remote_service.get_feature_request(get_feature_request=self.ogc_request.xml_request))
-        return self.return_http_response(response=response)
+        # the remote service filters the features, so the response can be passed through as it is
+        response = self.get_remote_response(
+            request=self.remote_service.get_feature_request(
+                get_feature_request=self.ogc_request.xml_request),
+            stream=True)
+        return self.return_streaming_http_response(response=response)
 
     def handle_secured_transaction(self):
         #  Transaction: Transaction operations does not contains area of interest.
@@ -100,3 +106,33 @@ class WebFeatureServiceProxy(OgcServiceProxyView):
         #       * secure on feature level per permission (update, delete)
         #       * secure on table level for insert permission
         return MrMapNotImplementedError(ogc_request=self.ogc_request, message="securing transaction is not implemented.")
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncWebFeatureServiceProxy(AsyncOgcServiceProxyView, WebFeatureServiceProxy):
+    """Asyncio variant of :class:`WebFeatureServiceProxy` for asgi deployments."""
+
+    async def asecure_request(self):
+        if self.ogc_request.is_get_feature_request:
+            return await self.ahandle_secured_get_feature()
+        elif self.ogc_request.is_transaction_request:
+            return self.handle_secured_transaction()
+
+    async def ahandle_secured_get_feature(self):
+        """Async variant of :meth:`WebFeatureServiceProxy.handle_secured_get_feature`."""
+        try:
+            if self.ogc_request.service_version.split(".")[0] != "2":
+                return MrMapNotImplementedError(ogc_request=self.ogc_request, message="MrMap currently can only handle wfs 2.x.x GetFeature requests")
+            secure_get_feature_request(
+                get_feature_request=self.ogc_request.xml_request,
+                spatial_filters=self.service.security_info_per_feature_type)
+        except NotImplementedError:
+            return ForbiddenException(
+                ogc_request=self.ogc_request,
+                message="MrMap can't secure the given request. Maybe you request multiple typenames in a single query.")
+        # the remote service filters the features, so the response can be passed through as it is
+        response = await self.aget_remote_response(
+            request=self.remote_service.get_feature_request(
+                get_feature_request=self.ogc_request.xml_request),
+            stream=True)
+        return await self.areturn_streaming_http_response(response=response)
@@ -1,8 +1,11 @@
+import asyncio
 import copy
 import io
 from queue import Queue
 from threading import Thread
+from typing import FrozenSet
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.db import connection
 from django.utils.decorators import method_decorator
@@ -10,12 +13,26 @@ from django.views.decorators.csrf import csrf_exempt
 from eulxml import xmlmap
 from extras.utils import execute_threads
 from ows_lib.client.wms.mixins import WebMapServiceMixin as WebMapServiceClient
+from ows_lib.models.ogc_request import OGCRequest
 from PIL import Image, ImageDraw, ImageFont
+from registry.enums.service import OGCOperationEnum
 from registry.models.service import WebMapService
-from registry.proxy.mixins import OgcServiceProxyView
-from registry.proxy.ogc_exceptions import ForbiddenException, LayerNotDefined
+from registry.proxy.images import get_empty_image, mask_image
+from registry.proxy.layer_filter import filter_layer_params
+from registry.proxy.metrics import get_map_counters, timed_phase
+from registry.proxy.mixins import (AsyncOgcServiceProxyView,
+                                   OgcServiceProxyView)
+from registry.proxy.ogc_exceptions import (ForbiddenException, InvalidCRS,
+                                           LayerNotDefined)
+from registry.proxy.ogc_exceptions import RuntimeError as MrMapRuntimeError
+from registry.proxy.preflight import convert_scale, get_scale
+from registry.proxy.security_mask import (MASKED, VISIBLE, create_error_mask,
+                                          fetch_security_mask_from_mapserver,
+                                          get_simplify_tolerance,
+                                          render_security_mask)
+from registry.proxy.security_policy import (get_group_pks_for_request,
+                                            security_policy_registry)
 from registry.xmlmapper.ogc.feature_collection import FeatureCollection
-from requests import Request, Session
 
 
 @method_decorator(csrf_exempt, name="dispatch")
@@ -75,67 +92,195 @@ class WebMapServiceProxy(OgcServiceProxyView):
 
         if self.service.is_unknown_layer:
             return LayerNotDefined(ogc_request=self.ogc_request)
+        return (
+            self.get_layer_filtered_response()
+            or self.get_preflight_response()
+            or super().get_and_post(request, *args, **kwargs)
+        )
+
+    def get_layer_filtered_response(self):
+        """Remove the layers, which the requesting user may not request, from GetMap and GetFeatureInfo requests.
+
+        Instead of denying the whole request, the ``LAYERS``, ``STYLES`` and ``QUERY_LAYERS`` params are reduced to the
+        allowed layers and the security attributes of the service are computed again for them. So the remote service
+        renders only the allowed layers and the spatial security applies only to them:
+
+            * if none of the requested layers is allowed, GetMap requests are answered with an empty image and
+              GetFeatureInfo requests with ``ForbiddenException``, without requesting the remote service
+
+        Enabled by ``settings.PROXY_GET_MAP_LAYER_FILTER``.
+
+        :return: the response or ``None`` if the (reduced) request shall be handled as usual
+        """
+        if (
+            not settings.PROXY_GET_MAP_LAYER_FILTER
+            or not (self.ogc_request.is_get_map_request or self.ogc_request.is_get_feature_info_request)
+            or not self.ogc_request.is_get
+            or not self.service.is_active
+            or not self.service.is_secured
+            or self.service.is_user_principle_entitled
+        ):
+            return None
+        snapshot = getattr(self.service, "security_policy", None) or security_policy_registry.get(
+            service=self.service)
+        allowed_entities = snapshot.get_allowed_entities(
+            operation=self.ogc_request.operation,
+            group_pks=get_group_pks_for_request(request=self.ogc_request))
+        # the remote service is requested with the reduced params
+        self.ogc_request = OGCRequest(
+            method=self.ogc_request.method,
+            url=self.ogc_request.url,
+            params=filter_layer_params(
+                params=self.ogc_request.params, allowed_entities=allowed_entities),
+            cookies=self.ogc_request.cookies,
+            django_request=self.request,
+        )
+
+        query_params = self.ogc_request.ogc_query_params
+        if not self.ogc_request.requested_entities or (
+                self.ogc_request.is_get_feature_info_request and not query_params.get("QUERY_LAYERS")):
+            if self.ogc_request.is_get_feature_info_request:
+                return ForbiddenException(ogc_request=self.ogc_request)
+            try:
+                response = self.get_empty_map_response()
+            except (TypeError, ValueError):
+                return ForbiddenException(ogc_request=self.ogc_request)
+            get_map_counters.increment("denied")
+            return self.return_http_response(response=response)
+
+        if getattr(self.service, "security_policy", None) is not None:
+            self.service.security_policy.apply(
+                service=self.service, request=self.ogc_request)
         else:
-            return super().get_and_post(request, *args, **kwargs)
+            # the security attributes are annotated again for the reduced request
+            self._service = None
+        if self.ogc_request.is_get_map_request:
+            get_map_counters.increment("filtered")
+        return None
+
+    def get_preflight_response(self):
+        """Answer GetMap requests, which the remote service can't render anything for, without requesting it.
 
+        The requested scale, extent and crs are checked against the inherited layer attributes of the policy snapshot,
+        so no database query is needed:
+
+            * if the crs is not supported by any requested layer, return ``InvalidCRS``
+            * if the request is outside of the scale range or the extent of all requested layers, return an empty image
+
+        Only requests of users, which may request the layers, are answered; all others get the regular security
+        decisions.
+
+        :return: the response or ``None`` if the request shall be handled as usual
+        """
+        if (
+            not settings.PROXY_GET_MAP_PREFLIGHT
+            or not self.ogc_request.is_get_map_request
+            or not self.service.is_active
+            or self.service.is_secured and not self.service.is_user_principle_entitled
+        ):
+            return None
+        snapshot = getattr(self.service, "security_policy", None) or security_policy_registry.get(
+            service=self.service)
+        layers = [snapshot.layer_attributes.get(entity.lower())
+                  for entity in self.ogc_request.requested_entities]
+        layers = [layer for layer in layers if layer is not None]
+        if not layers:
+            return None
+
+        query_params = self.ogc_request.ogc_query_params
+        crs = query_params.get("CRS") or query_params.get("SRS")
+        if crs and not all(layer.supports(crs) for layer in layers):
+            return InvalidCRS(ogc_request=self.ogc_request)
+
+        try:
+            width = int(query_params.get("WIDTH"))
+            height = int(query_params.get("HEIGHT"))
+            bbox = self.ogc_request.bbox
+            if width <= 0 or height <= 0 or bbox is None or bbox.empty or not bbox.srid:
+                return None
+            # a request may use another version than the registered capabilities, which define the scale range of
+            # the layers; like a 1.1.1 request to a service registered with 1.3.0
+            version = self.ogc_request.service_version
+            scale = convert_scale(
+                scale=get_scale(bbox=bbox, width=width,
+                                height=height, version=version),
+                from_version=version,
+                to_version=self.service.version)
+            extent = bbox.extent if bbox.srid == 4326 else bbox.transform(
+                4326, clone=True).extent
+        except Exception:
+            # the remote service shall answer requests, which we can't interpret
+            return None
+        tolerance = settings.PROXY_GET_MAP_PREFLIGHT_TOLERANCE
+        if all(
+            not layer.is_in_scale_range(scale=scale, tolerance=tolerance)
+            or not layer.intersects(extent=extent, tolerance=tolerance)
+            for layer in layers
+        ):
+            get_map_counters.increment("preflight")
+            return self.return_http_response(response=self.get_empty_map_response())
+        return None
+
+    def get_visible_entities(self) -> FrozenSet[str]:
+        """Return the layers the groups of the requesting user may request with ``GetMap``.
+
+        Only camouflaged documents of secured services are filtered; superusers see all layers.
+        """
+        if not self.service.camouflage or self.request.user.is_superuser:
+            return None
+        snapshot = security_policy_registry.get(service=self.service)
+        if not snapshot.is_secured:
+            return None
+        return snapshot.get_allowed_entities(
+            operation=OGCOperationEnum.GET_MAP.value,
+            group_pks=get_group_pks_for_request(request=self.ogc_request))
+
+    @timed_phase("mask")
     def _create_secured_service_mask(self):
-        """Creates call to local mapserver and returns the response
-        Gets a mask image, which can be used to remove restricted areas from another image
+        """Creates the security mask for the requested map image
+        Gets a mask image, which can be used to remove restricted areas from another image.
+        The backend is configured by ``settings.PROXY_SECURITY_MASK_BACKEND``.
         Returns:
              secured_image (Image)
-        # TODO: calculate the security mask without mapserver as depending subsystem
         """
-        crs_qp = "CRS" if "CRS" in self.ogc_request.ogc_query_params else "SRS"
         width = int(self.ogc_request.ogc_query_params.get("WIDTH"))
         height = int(self.ogc_request.ogc_query_params.get("HEIGHT"))
+        # the cheapest allowed area representation, which renders the same mask at the requested resolution
         try:
-            from django.db import connection
-            db_name = connection.settings_dict["NAME"]
-            query_parameters = {
-                "VERSION": self.ogc_request.ogc_query_params.get("VERSION"),
-                "REQUEST": "GetMap",
-                "SERVICE": "WMS",
-                "FORMAT": "image/png",
-                "LAYERS": "mask",
-                crs_qp: self.ogc_request.ogc_query_params.get(crs_qp),
-                "BBOX": self.ogc_request.ogc_query_params.get("BBOX"),
-                "WIDTH": width,
-                "HEIGHT": height,
-                "TRANSPARENT": "TRUE",
-                "table": settings.MAPSERVER_SECURITY_MASK_TABLE,
-                "key_column": settings.MAPSERVER_SECURITY_MASK_KEY_COLUMN,
-                "geom_column": settings.MAPSERVER_SECURITY_MASK_GEOMETRY_COLUMN,
-                "map": f"/etc/mapserver/mapfiles/security_mask{'_test_db' if 'test' in db_name else ''}.map",
-                "keys": ",".join(str(pk) for pk in self.service.allowed_area_pks)
-            }
-
-            request = Request(
-                method="GET", url=settings.MAPSERVER_URL, params=query_parameters
-            )
-            session = Session()
-            response = session.send(request.prepare())
-
-            mask = Image.open(io.BytesIO(response.content))
-
-            # Put combined mask on white background
-            background = Image.new("RGB", (width, height), (255, 255, 255))
-            background.paste(mask, mask=mask)
+            tolerance = get_simplify_tolerance(
+                bbox=self.ogc_request.bbox, width=width, height=height, srid=settings.DEFAULT_SRS)
+        except Exception as e:
+            settings.ROOT_LOGGER.exception(e)
+            tolerance = 0
+        if settings.PROXY_SECURITY_MASK_BACKEND != "mapserver":
+            try:
+                allowed_area = self.service.allowed_area_union
+                security_policy = getattr(self.service, "security_policy", None)
+                if security_policy is not None:
+                    allowed_area = security_policy.get_simplified_allowed_area_union(
+                        allowed_area_pks=self.service.allowed_area_pks, tolerance=tolerance)
+                return render_security_mask(
+                    allowed_area=allowed_area,
+                    bbox=self.ogc_request.bbox,
+                    width=width,
+                    height=height)
+            except Exception as e:
+                settings.ROOT_LOGGER.exception(e)
+                if not settings.MAPSERVER_URL:
+                    return create_error_mask(width=width, height=height)
+        try:
+            return fetch_security_mask_from_mapserver(
+                query_params=self.ogc_request.ogc_query_params,
+                allowed_area_pks=self.service.allowed_area_pks,
+                width=width,
+                height=height,
+                tolerance=tolerance)
         except Exception as e:
             settings.ROOT_LOGGER.exception(e)
             # If anything occurs during the mask creation, we have to make sure the response won't contain any
             # information at all.
             # So create an error mask
-            background = Image.new(
-                "RGB",
-                (width, height),
-                (
-                    settings.ERROR_MASK_VAL,
-                    settings.ERROR_MASK_VAL,
-                    settings.ERROR_MASK_VAL,
-                ),
-            )
-
-        return background
+            return create_error_mask(width=width, height=height)
 
     def _create_image_with_text(self, w: int, h: int, txt: str):
         """Renders text on an empty image
@@ -158,72 +303,38 @@ class WebMapServiceProxy(OgcServiceProxyView):
 
         return text_img
 
-    def _create_masked_image(self, img: bytes, mask: bytes):
-        """Creates a masked image from two image byte object
+    @timed_phase("encode")
+    def _create_secured_image(self, img: bytes, mask) -> bytes:
+        """Creates the masked image from the image bytes and the mask
         Args:
             img (byte): The bytes of the image
-            mask (byte): The bytes of the mask
+            mask (Image): The mask image; ``None`` if nothing shall be masked
         Returns:
-             img (Image): The masked image
+             img (byte): The bytes of the masked image in the format of the given image
         """
-        # Transform byte-image to PIL-image object
-        img = Image.open(io.BytesIO(img))
-
-        # Create an alpha layer, which is needed for the compositing of image and mask
-        alpha_layer = Image.new("RGBA", img.size, (255, 0, 0, 0))
-
-        # Make sure we have any kind of mask
+        overlay = None
         if mask is None:
             # No bounding geometry for masking exist, so we just create a mask that does not mask anything
-            mask = Image.new("RGB", img.size, (0, 0, 0))
+            mask = Image.new("L", (1, 1), VISIBLE)
         else:
-            # There is a mask ...
             if isinstance(mask, bytes):
-                # ... but it is in bytes, so we need to transform it to a PIL-image object as well
                 mask = Image.open(io.BytesIO(mask))
 
             # Check if the mask is fine or indicates an error
-            is_error_mask = mask.getpixel(
-                (0, 0))[0] == settings.ERROR_MASK_VAL
+            pixel = mask.getpixel((0, 0))
+            # rgb masks provide a tuple per pixel; grayscale masks a single value
+            if isinstance(pixel, tuple):
+                pixel = pixel[0]
+            is_error_mask = pixel == settings.ERROR_MASK_VAL
             if is_error_mask:
                 # Create full-masking mask and create an access_denied_img
-                mask = Image.new("RGB", img.size, (255, 255, 255))
+                mask = Image.new("L", mask.size, MASKED)
                 self.access_denied_img = self._create_image_with_text(
-                    img.width, img.height, settings.ERROR_MASK_TXT
+                    mask.width, mask.height, settings.ERROR_MASK_TXT
                 )
+                overlay = self.access_denied_img
 
-        # Make sure mask is in grayscale and has the exact same size as the requested image
-        mask = mask.convert("L").resize(img.size)
-
-        # save image format for restoring a few steps later
-        img_format = img.format
-        img = Image.composite(alpha_layer, img, mask)
-        img.format = img_format
-
-        # Add access_denied_img image
-        # (contains info about which layers are restricted or if there was an error during mask creation)
-        if self.access_denied_img is not None:
-            old_format = img.format
-            # FIXME: for alpha_composite both images needs to be RGBA!
-            # img = Image.alpha_composite(img, self.access_denied_img)
-            img = Image.composite(img, img, self.access_denied_img)
-            img.format = old_format
-
-        return img
-
-    def _image_to_bytes(self, image):
-        out_bytes_stream = io.BytesIO()
-        try:
-            image.save(out_bytes_stream, image.format, quality=80)
-            image = out_bytes_stream.getvalue()
-        except IOError:
-            # happens if a non-alpha channel format is requested, such as jpeg
-            # replace alpha channel with white background
-            bg = Image.new("RGB", image.size, (255, 255, 255))
-            bg.paste(image, mask=image.split()[3])
-            bg.save(out_bytes_stream, image.format, quality=80)
-            image = out_bytes_stream.getvalue()
-        return image
+        return mask_image(content=img, mask=mask, overlay=overlay)
 
     def handle_secured_get_map(self):
         """Compute the secured get map response if the requested bbox intersects any allowed area.
@@ -255,27 +366,25 @@ class WebMapServiceProxy(OgcServiceProxyView):
 
               Result: bbox intersects allowed area
 
-            :return: The cropped map image with status code 200 or an error message with status code 403 (Forbidden) if
-                     the bbox doesn't intersects any allowed area.
+        **Fast paths**
+            If the bbox is covered by the allowed area, the remote response is streamed without masking. If the bbox
+            is disjoint from the allowed area, an empty image is returned without requesting the remote service.
+
+            :return: The cropped map image with status code 200 or an empty image if the bbox doesn't intersects any
+                     allowed area.
             :rtype: dict
         """
 
-        # if not self.service.is_spatial_secured_and_intersects:
-        #     # TODO: return transparent image
-        #     get_params = self.remote_service.get_get_params(
-        #         query_params=self.request.query_parameters
-        #     )
-        #     width = int(get_params.get(self.remote_service.WIDTH_QP))
-        #     height = int(get_params.get(self.remote_service.HEIGHT_QP))
-        #     image = Image.new("RGBA", (width, height), (0, 0, 0))
-        #     image.format = 'png'
-        #     return self.return_http_response(
-        #         {
-        #             "status_code": 200,
-        #             "content": self._image_to_bytes(image=image),
-        #             "content-type": "image/png"
-        #         }
-        #     )
+        if self.service.is_spatial_secured_and_covers:
+            # nothing needs to be masked, so the remote response can be passed through
+            get_map_counters.increment("covered")
+            return self.return_streaming_http_response(
+                response=self.get_remote_response(stream=True))
+        elif not self.service.is_spatial_secured_and_intersects:
+            # everything would be masked, so we don't need to request the remote service at all
+            get_map_counters.increment("disjoint")
+            return self.return_http_response(response=self.get_empty_map_response())
+        get_map_counters.increment("masked")
 
         # we fetch the map image as it is and mask it, using our secured operations geometry.
         # To improve the performance here, we use a multithreaded approach, where the original map image and the
@@ -314,10 +423,10 @@ class WebMapServiceProxy(OgcServiceProxyView):
         if isinstance(remote_response, dict):
             return self.return_http_response(response=remote_response)
         try:
-            secured_image = self._create_masked_image(
+            secured_image = self._create_secured_image(
                 remote_response.content, mask)
         except OSError:
-            return RuntimeError()
+            return MrMapRuntimeError(ogc_request=self.ogc_request)
         return self.return_http_response(
             response={
                 "status_code": 200,
@@ -325,11 +434,29 @@ class WebMapServiceProxy(OgcServiceProxyView):
                 "elapsed": remote_response.elapsed,
                 "headers": dict(remote_response.headers),
                 "url": remote_response.url,
-                "content": self._image_to_bytes(secured_image),
+                "content": secured_image,
                 "content_type": remote_response.headers.get("content-type"),
             }
         )
 
+    @timed_phase("encode")
+    def get_empty_map_response(self) -> dict:
+        """Return the response with an empty map image of the requested size and format."""
+        query_params = self.ogc_request.ogc_query_params
+        content_type = query_params.get("FORMAT", "image/png")
+        return {
+            "status_code": 200,
+            "content": get_empty_image(
+                mime_type=content_type,
+                width=int(query_params.get("WIDTH")),
+                height=int(query_params.get("HEIGHT")),
+                transparent=query_params.get(
+                    "TRANSPARENT", "FALSE").upper() == "TRUE",
+                bgcolor=query_params.get("BGCOLOR"),
+            ),
+            "content_type": content_type,
+        }
+
     def handle_get_feature_info_with_multithreading(self):
         """We use multithreading to send two requests at the same time to speed up the response time."""
         request = self.remote_service.bypass_request(request=self.ogc_request)
@@ -386,7 +513,8 @@ class WebMapServiceProxy(OgcServiceProxyView):
         """
 
         if self.service.is_spatial_secured_and_covers:
-            return self.return_http_response(response=self.get_remote_response())
+            return self.return_streaming_http_response(
+                response=self.get_remote_response(stream=True))
         else:
             try:
                 request = self.remote_service.bypass_request(
@@ -424,3 +552,98 @@ class WebMapServiceProxy(OgcServiceProxyView):
             return self.handle_secured_get_map()
         elif self.ogc_request.is_get_feature_info_request:
             return self.handle_secured_get_feature_info()
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncWebMapServiceProxy(AsyncOgcServiceProxyView, WebMapServiceProxy):
+    """Asyncio variant of :class:`WebMapServiceProxy` for asgi deployments.
+
+    The remote map image and the security mask are computed concurrently with :func:`asyncio.gather` instead of
+    threads.
+    """
+
+    async def get_and_post(self, request, *args, **kwargs):
+        await sync_to_async(self.load_service)()
+        if self.service.is_unknown_layer:
+            return LayerNotDefined(ogc_request=self.ogc_request)
+        return (
+            await sync_to_async(self.get_layer_filtered_response)()
+            or await sync_to_async(self.get_preflight_response)()
+            or await super().get_and_post(request, *args, **kwargs)
+        )
+
+    async def ahandle_secured_get_map(self):
+        """Async variant of :meth:`WebMapServiceProxy.handle_secured_get_map`."""
+        if self.service.is_spatial_secured_and_covers:
+            get_map_counters.increment("covered")
+            return await self.areturn_streaming_http_response(
+                response=await self.aget_remote_response(stream=True))
+        elif not self.service.is_spatial_secured_and_intersects:
+            get_map_counters.increment("disjoint")
+            return await self.areturn_http_response(response=self.get_empty_map_response())
+        get_map_counters.increment("masked")
+
+        remote_response, mask = await asyncio.gather(
+            self.aget_remote_response(),
+            sync_to_async(self._create_secured_service_mask,
+                          thread_sensitive=False)(),
+        )
+        if isinstance(remote_response, dict):
+            return await self.areturn_http_response(response=remote_response)
+        try:
+            content = await sync_to_async(self._create_secured_image, thread_sensitive=False)(
+                remote_response.content, mask)
+        except OSError:
+            return MrMapRuntimeError(ogc_request=self.ogc_request)
+        return await self.areturn_http_response(
+            response={
+                "status_code": 200,
+                "reason": remote_response.reason,
+                "elapsed": remote_response.elapsed,
+                "headers": dict(remote_response.headers),
+                "url": remote_response.url,
+                "content": content,
+                "content_type": remote_response.headers.get("content-type"),
+            }
+        )
+
+    async def ahandle_secured_get_feature_info(self):
+        """Async variant of :meth:`WebMapServiceProxy.handle_secured_get_feature_info`."""
+        if self.service.is_spatial_secured_and_covers:
+            return await self.areturn_streaming_http_response(
+                response=await self.aget_remote_response(stream=True))
+        else:
+            try:
+                request = self.remote_service.bypass_request(
+                    request=self.ogc_request)
+                if request.params[self.remote_service.INFO_FORMAT_QP] != "text/xml":
+                    xml_request = copy.deepcopy(request)
+                    xml_request.params[self.remote_service.INFO_FORMAT_QP] = "text/xml"
+                    xml_response, requested_response = await asyncio.gather(
+                        self.aget_remote_response(request=xml_request),
+                        self.aget_remote_response(request=request),
+                    )
+                else:
+                    xml_response = await self.aget_remote_response(request=request)
+                    requested_response = xml_response
+                feature_collection = xmlmap.load_xmlobject_from_string(
+                    xml_response.content, xmlclass=FeatureCollection
+                )
+                # FIXME: depends on xml wms version not on the registered service version
+                axis_order_correction = (
+                    True if self.service.major_service_version >= 2 else False
+                )
+                polygon = feature_collection.bounded_by.get_geometry(
+                    axis_order_correction
+                )
+                if self.service.allowed_area_union.contains(polygon.convex_hull):
+                    return await self.areturn_http_response(response=requested_response)
+            except Exception:
+                pass
+        return ForbiddenException(ogc_request=self.ogc_request)
+
+    async def asecure_request(self):
+        if self.ogc_request.is_get_map_request:
+            return await self.ahandle_secured_get_map()
+        elif self.ogc_request.is_get_feature_info_request:
+            return await self.ahandle_secured_get_feature_info()
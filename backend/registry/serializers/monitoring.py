@@ -8,7 +8,8 @@ from registry.models.monitoring import (GetCapabilitiesProbe,
                                         WebMapServiceMonitoringRun,
                                         WebMapServiceMonitoringSetting)
 from registry.models.service import Layer, WebMapService
-from rest_framework.fields import IntegerField
+from registry.proxy.upstream_guard import circuit_breaker
+from rest_framework.fields import IntegerField, SerializerMethodField
 from rest_framework.utils import model_meta
 from rest_framework_json_api.relations import ResourceRelatedField
 from rest_framework_json_api.serializers import (BooleanField,
@@ -107,11 +108,18 @@ class WebMapServiceMonitoringSettingSerializer(
         required=False,
         read_only=True,
     )
+    circuit_breaker = SerializerMethodField(
+        label=_("circuit breaker"),
+        help_text=_("the current state of the circuit breaker of the security proxy for this service."),
+    )
 
     class Meta:
         model = WebMapServiceMonitoringSetting
         fields = ('url', 'name', 'service', 'crontab',
-                  "get_capabilitites_probes", "get_map_probes")
+                  "get_capabilitites_probes", "get_map_probes", "circuit_breaker")
+
+    def get_circuit_breaker(self, obj):
+        return circuit_breaker.get_state(service_pk=obj.service_id)
 
 
 class WebMapServiceMonitoringRunSerializer(
@@ -0,0 +1,2 @@
+from . import proxy  # noqa
+from . import security  # noqa
@@ -0,0 +1,205 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from registry.models.metadata import Keyword, MetadataRelation
+from registry.models.security import (AllowedOperation,
+                                      AllowedWebFeatureServiceOperation,
+                                      AllowedWebMapServiceOperation,
+                                      CatalogueServiceAuthentication,
+                                      WebFeatureServiceAuthentication,
+                                      WebFeatureServiceProxySetting,
+                                      WebMapServiceAuthentication,
+                                      WebMapServiceProxySetting)
+from registry.models.service import (CatalogueService,
+                                     CatalogueServiceOperationUrl,
+                                     FeatureType, FeatureTypeProperty, Layer,
+                                     WebFeatureService,
+                                     WebFeatureServiceOperationUrl,
+                                     WebMapService, WebMapServiceOperationUrl)
+from registry.proxy.cache import (capabilities_cache, client_cache,
+                                  credentials_cache)
+from registry.proxy.capabilities import capabilities_render_cache
+from registry.proxy.security_policy import security_policy_registry
+from registry.proxy.tiles import purge_tiles_on_commit
+
+
+@receiver([post_save, post_delete], sender=WebMapService, dispatch_uid="invalidate_client_cache_on_wms_change")
+@receiver([post_save, post_delete], sender=WebFeatureService, dispatch_uid="invalidate_client_cache_on_wfs_change")
+@receiver([post_save, post_delete], sender=CatalogueService, dispatch_uid="invalidate_client_cache_on_csw_change")
+def invalidate_client_cache_on_service_change(instance, **kwargs):
+    capabilities_cache.invalidate(group=instance.pk)
+    client_cache.invalidate(group=instance.pk)
+
+
+@receiver([post_save, post_delete], sender=WebMapServiceAuthentication, dispatch_uid="invalidate_client_cache_on_wms_auth_change")
+@receiver([post_save, post_delete], sender=WebFeatureServiceAuthentication, dispatch_uid="invalidate_client_cache_on_wfs_auth_change")
+@receiver([post_save, post_delete], sender=CatalogueServiceAuthentication, dispatch_uid="invalidate_client_cache_on_csw_auth_change")
+def invalidate_client_cache_on_auth_change(instance, **kwargs):
+    # the session of a cached client holds the credentials of the service
+    client_cache.invalidate(group=instance.service_id)
+    credentials_cache.invalidate(group=instance.service_id)
+
+
+@receiver([post_save, post_delete], sender=WebMapServiceProxySetting, dispatch_uid="invalidate_client_cache_on_wms_proxy_setting_change")
+@receiver([post_save, post_delete], sender=WebFeatureServiceProxySetting, dispatch_uid="invalidate_client_cache_on_wfs_proxy_setting_change")
+def invalidate_client_cache_on_proxy_setting_change(instance, **kwargs):
+    # the session of a cached client is configured with the connection limit and timeout of the proxy setting
+    client_cache.invalidate(group=instance.secured_service_id)
+
+
+@receiver([post_save, post_delete], sender=AllowedWebMapServiceOperation, dispatch_uid="invalidate_policy_on_allowed_wms_operation_change")
+@receiver([post_save, post_delete], sender=AllowedWebFeatureServiceOperation, dispatch_uid="invalidate_policy_on_allowed_wfs_operation_change")
+def invalidate_security_policy_on_allowed_operation_change(instance, **kwargs):
+    security_policy_registry.publish_invalidation_on_commit(
+        service_pk=instance.secured_service_id)
+
+
+@receiver(m2m_changed, sender=AllowedWebMapServiceOperation.operations.through, dispatch_uid="invalidate_policy_on_allowed_wms_operation_operations_change")
+@receiver(m2m_changed, sender=AllowedWebMapServiceOperation.allowed_groups.through, dispatch_uid="invalidate_policy_on_allowed_wms_operation_groups_change")
+@receiver(m2m_changed, sender=AllowedWebMapServiceOperation.secured_layers.through, dispatch_uid="invalidate_policy_on_allowed_wms_operation_layers_change")
+@receiver(m2m_changed, sender=AllowedWebFeatureServiceOperation.operations.through, dispatch_uid="invalidate_policy_on_allowed_wfs_operation_operations_change")
+@receiver(m2m_changed, sender=AllowedWebFeatureServiceOperation.allowed_groups.through, dispatch_uid="invalidate_policy_on_allowed_wfs_operation_groups_change")
+@receiver(m2m_changed, sender=AllowedWebFeatureServiceOperation.secured_feature_types.through, dispatch_uid="invalidate_policy_on_allowed_wfs_operation_feature_types_change")
+def invalidate_security_policy_on_allowed_operation_relation_change(instance, action, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if isinstance(instance, AllowedOperation):
+        security_policy_registry.publish_invalidation_on_commit(
+            service_pk=instance.secured_service_id)
+    else:
+        # the relation was changed from the other side (group, layer...); the affected services are unknown here
+        security_policy_registry.publish_invalidation_on_commit()
+
+
+@receiver(m2m_changed, sender=get_user_model().groups.through, dispatch_uid="invalidate_policy_on_group_membership_change")
+def invalidate_security_policy_on_group_membership_change(action, **kwargs):
+    if action.startswith("post_"):
+        security_policy_registry.publish_invalidation_on_commit()
+
+
+@receiver(post_delete, sender=Group, dispatch_uid="invalidate_policy_on_group_delete")
+def invalidate_security_policy_on_group_delete(**kwargs):
+    security_policy_registry.publish_invalidation_on_commit()
+
+
+@receiver([post_save, post_delete], sender=Layer, dispatch_uid="invalidate_policy_on_layer_change")
+@receiver([post_save, post_delete], sender=FeatureType, dispatch_uid="invalidate_policy_on_feature_type_change")
+def invalidate_security_policy_on_service_element_change(instance, **kwargs):
+    security_policy_registry.publish_invalidation_on_commit(
+        service_pk=instance.service_id)
+
+
+@receiver(m2m_changed, sender=Layer.reference_systems.through, dispatch_uid="invalidate_policy_on_layer_reference_systems_change")
+def invalidate_security_policy_on_reference_systems_change(instance, action, **kwargs):
+    # the policy snapshot holds the inherited reference systems of the layers for the GetMap preflight
+    if not action.startswith("post_"):
+        return
+    if isinstance(instance, Layer):
+        security_policy_registry.publish_invalidation_on_commit(
+            service_pk=instance.service_id)
+    else:
+        security_policy_registry.publish_invalidation_on_commit()
+
+
+@receiver([post_save, post_delete], sender=FeatureTypeProperty, dispatch_uid="invalidate_policy_on_feature_type_property_change")
+def invalidate_security_policy_on_feature_type_property_change(instance, **kwargs):
+    security_policy_registry.publish_invalidation_on_commit(
+        service_pk=FeatureType.objects.values_list("service_id", flat=True).filter(pk=instance.feature_type_id).first())
+
+
+@receiver(post_delete, sender=WebMapService, dispatch_uid="invalidate_policy_on_wms_delete")
+@receiver(post_delete, sender=WebFeatureService, dispatch_uid="invalidate_policy_on_wfs_delete")
+def invalidate_security_policy_on_service_delete(instance, **kwargs):
+    security_policy_registry.publish_invalidation_on_commit(
+        service_pk=instance.pk)
+
+
+@receiver([post_save, post_delete], sender=WebMapService, dispatch_uid="invalidate_rendered_capabilities_on_wms_change")
+@receiver([post_save, post_delete], sender=WebFeatureService, dispatch_uid="invalidate_rendered_capabilities_on_wfs_change")
+@receiver([post_save, post_delete], sender=CatalogueService, dispatch_uid="invalidate_rendered_capabilities_on_csw_change")
+def invalidate_rendered_capabilities_on_service_change(instance, **kwargs):
+    capabilities_render_cache.invalidate_on_commit(service_pk=instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Layer, dispatch_uid="invalidate_rendered_capabilities_on_layer_change")
+@receiver([post_save, post_delete], sender=FeatureType, dispatch_uid="invalidate_rendered_capabilities_on_feature_type_change")
+@receiver([post_save, post_delete], sender=WebMapServiceOperationUrl, dispatch_uid="invalidate_rendered_capabilities_on_wms_operation_url_change")
+@receiver([post_save, post_delete], sender=WebFeatureServiceOperationUrl, dispatch_uid="invalidate_rendered_capabilities_on_wfs_operation_url_change")
+@receiver([post_save, post_delete], sender=CatalogueServiceOperationUrl, dispatch_uid="invalidate_rendered_capabilities_on_csw_operation_url_change")
+def invalidate_rendered_capabilities_on_service_element_change(instance, **kwargs):
+    capabilities_render_cache.invalidate_on_commit(
+        service_pk=instance.service_id)
+
+
+@receiver([post_save, post_delete], sender=WebMapServiceProxySetting, dispatch_uid="invalidate_rendered_capabilities_on_wms_proxy_setting_change")
+@receiver([post_save, post_delete], sender=WebFeatureServiceProxySetting, dispatch_uid="invalidate_rendered_capabilities_on_wfs_proxy_setting_change")
+def invalidate_rendered_capabilities_on_proxy_setting_change(instance, **kwargs):
+    # the camouflage setting decides if the urls of the document are rewritten
+    capabilities_render_cache.invalidate_on_commit(
+        service_pk=instance.secured_service_id)
+
+
+@receiver([post_save, post_delete], sender=MetadataRelation, dispatch_uid="invalidate_rendered_capabilities_on_metadata_relation_change")
+def invalidate_rendered_capabilities_on_metadata_relation_change(instance, **kwargs):
+    if instance.wms_id or instance.wfs_id or instance.csw_id:
+        capabilities_render_cache.invalidate_on_commit(
+            service_pk=instance.wms_id or instance.wfs_id or instance.csw_id)
+    elif instance.layer_id or instance.feature_type_id:
+        element_cls, element_pk = (Layer, instance.layer_id) if instance.layer_id else (
+            FeatureType, instance.feature_type_id)
+        capabilities_render_cache.invalidate_on_commit(
+            service_pk=element_cls.objects.values_list("service_id", flat=True).filter(pk=element_pk).first())
+
+
+@receiver(m2m_changed, sender=WebMapService.keywords.through, dispatch_uid="invalidate_rendered_capabilities_on_wms_keywords_change")
+@receiver(m2m_changed, sender=WebFeatureService.keywords.through, dispatch_uid="invalidate_rendered_capabilities_on_wfs_keywords_change")
+@receiver(m2m_changed, sender=CatalogueService.keywords.through, dispatch_uid="invalidate_rendered_capabilities_on_csw_keywords_change")
+@receiver(m2m_changed, sender=Layer.keywords.through, dispatch_uid="invalidate_rendered_capabilities_on_layer_keywords_change")
+@receiver(m2m_changed, sender=FeatureType.keywords.through, dispatch_uid="invalidate_rendered_capabilities_on_feature_type_keywords_change")
+def invalidate_rendered_capabilities_on_keywords_change(instance, action, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if isinstance(instance, (Layer, FeatureType)):
+        capabilities_render_cache.invalidate_on_commit(
+            service_pk=instance.service_id)
+    elif isinstance(instance, (WebMapService, WebFeatureService, CatalogueService)):
+        capabilities_render_cache.invalidate_on_commit(service_pk=instance.pk)
+    else:
+        # the relation was changed from the keyword side; the affected services are unknown here
+        capabilities_render_cache.invalidate_on_commit()
+
+
+@receiver([post_save, post_delete], sender=Keyword, dispatch_uid="invalidate_rendered_capabilities_on_keyword_change")
+def invalidate_rendered_capabilities_on_keyword_change(**kwargs):
+    capabilities_render_cache.invalidate_on_commit()
+
+
+@receiver([post_save, post_delete], sender=WebMapService, dispatch_uid="purge_tiles_on_wms_change")
+def purge_tiles_on_service_change(instance, **kwargs):
+    purge_tiles_on_commit(service_pk=instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Layer, dispatch_uid="purge_tiles_on_layer_change")
+def purge_tiles_on_layer_change(instance, **kwargs):
+    purge_tiles_on_commit(service_pk=instance.service_id)
+
+
+@receiver([post_save, post_delete], sender=AllowedWebMapServiceOperation, dispatch_uid="purge_tiles_on_allowed_wms_operation_change")
+def purge_tiles_on_allowed_operation_change(instance, **kwargs):
+    purge_tiles_on_commit(service_pk=instance.secured_service_id)
+
+
+@receiver(m2m_changed, sender=AllowedWebMapServiceOperation.operations.through, dispatch_uid="purge_tiles_on_allowed_wms_operation_operations_change")
+@receiver(m2m_changed, sender=AllowedWebMapServiceOperation.allowed_groups.through, dispatch_uid="purge_tiles_on_allowed_wms_operation_groups_change")
+@receiver(m2m_changed, sender=AllowedWebMapServiceOperation.secured_layers.through, dispatch_uid="purge_tiles_on_allowed_wms_operation_layers_change")
+def purge_tiles_on_allowed_operation_relation_change(instance, action, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if isinstance(instance, AllowedOperation):
+        purge_tiles_on_commit(service_pk=instance.secured_service_id)
+    elif pk_set:
+        # the relation was changed from the other side (group, layer...); the pks are the ones of the allowed operations
+        for service_pk in AllowedWebMapServiceOperation.objects.filter(
+                pk__in=pk_set).values_list("secured_service_id", flat=True).distinct():
+            purge_tiles_on_commit(service_pk=service_pk)
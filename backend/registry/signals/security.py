@@ -0,0 +1,72 @@
+from django.db.models.signals import m2m_changed, post_save
+from django.dispatch import receiver
+from registry.models.security import (
+    AllowedWebFeatureServiceOperation,
+    AllowedWebFeatureServiceOperationAreaPart, AllowedWebMapServiceOperation,
+    AllowedWebMapServiceOperationAreaPart, AllowedWebMapServiceOperationLayer)
+from registry.models.service import Layer
+from registry.proxy.security_policy import security_policy_registry
+from registry.proxy.transactions import on_commit_once
+
+
+@receiver(post_save, sender=AllowedWebMapServiceOperation, dispatch_uid="rebuild_area_parts_on_allowed_wms_operation_save")
+@receiver(post_save, sender=AllowedWebFeatureServiceOperation, dispatch_uid="rebuild_area_parts_on_allowed_wfs_operation_save")
+def rebuild_area_parts_on_allowed_operation_save(sender, instance, **kwargs):
+    # also on raw saves of fixtures, because only the saved row is read; parts of deleted allowed operations are
+    # deleted by cascade
+    area_part_model = AllowedWebMapServiceOperationAreaPart if sender is AllowedWebMapServiceOperation \
+        else AllowedWebFeatureServiceOperationAreaPart
+    area_part_model.objects.rebuild(allowed_operation_pks=[instance.pk])
+
+
+@receiver(m2m_changed, sender=AllowedWebMapServiceOperation.secured_layers.through, dispatch_uid="update_effective_layers_on_secured_layers_change")
+def update_effective_layers_on_secured_layers_change(instance, action, reverse, pk_set, **kwargs):
+    effective_layers = AllowedWebMapServiceOperationLayer.objects
+    if not reverse:
+        # the secured layers of an allowed operation are changed; pk_set holds layer pks
+        if action == "post_add":
+            effective_layers.add(
+                allowed_operation_pk=instance.pk, secured_layer_pks=pk_set)
+        elif action == "post_remove":
+            effective_layers.filter(
+                allowed_operation=instance, derived_from__pk__in=pk_set).delete()
+        elif action == "post_clear":
+            effective_layers.filter(allowed_operation=instance).delete()
+    else:
+        # the allowed operations of a layer are changed; pk_set holds allowed operation pks
+        if action == "post_add":
+            for allowed_operation_pk in pk_set:
+                effective_layers.add(
+                    allowed_operation_pk=allowed_operation_pk, secured_layer_pks=[instance.pk])
+        elif action == "post_remove":
+            effective_layers.filter(
+                allowed_operation__pk__in=pk_set, derived_from=instance).delete()
+        elif action == "post_clear":
+            effective_layers.filter(derived_from=instance).delete()
+
+
+def rebuild_effective_layers(service_pk) -> None:
+    """Rebuild the effective layers of all allowed operations of the given service."""
+    AllowedWebMapServiceOperationLayer.objects.rebuild(
+        allowed_operation_pks=list(AllowedWebMapServiceOperation.objects.filter(
+            secured_service__pk=service_pk).values_list("pk", flat=True)))
+    # the snapshots may be compiled again between the invalidation on commit and this rebuild
+    security_policy_registry.publish_invalidation(service_pk=service_pk)
+
+
+def rebuild_effective_layers_on_commit(service_pk) -> None:
+    """Rebuild the effective layers of all allowed operations of the given service once after commit, or immediately
+    in autocommit mode.
+
+    Updating a service saves many layers; with that the effective layers are rebuilt once per service.
+    """
+    on_commit_once(func=rebuild_effective_layers, key=service_pk)
+
+
+@receiver(post_save, sender=Layer, dispatch_uid="rebuild_effective_layers_on_layer_save")
+def rebuild_effective_layers_on_layer_save(instance, raw=False, **kwargs):
+    # a saved layer can be new, moved in the tree or renamed; deleted layers are deleted by cascade. The layers of new
+    # services are bulk created without signals, but there are no allowed operations for them yet.
+    if raw:
+        return
+    rebuild_effective_layers_on_commit(service_pk=instance.service_id)
@@ -9,3 +9,33 @@ def async_analyze_log(http_response_log_id, **kwargs):
     analyzed_response_log.analyze_response()
     analyzed_response_log.save()
     return True
+
+
+@shared_task(name="async_analyze_logs")
+def async_analyze_logs(http_response_log_ids, model_name, **kwargs):
+    """Analyze a batch of response logs of the given concrete response log model."""
+    from django.apps import apps
+    from django.conf import settings
+    from django.db import transaction
+    response_log_cls = apps.get_model("registry", model_name)
+    analyzed_response_log_cls = response_log_cls._meta.get_field(
+        "analyzed_response").related_model
+    with transaction.atomic():
+        for http_response_log in response_log_cls.objects.filter(pk__in=http_response_log_ids):
+            analyzed_response_log = analyzed_response_log_cls(
+                response=http_response_log)
+            try:
+                analyzed_response_log.analyze_response()
+            except Exception as e:
+                settings.ROOT_LOGGER.exception(e)
+                continue
+            analyzed_response_log.save()
+    return True
+
+
+@shared_task(name="async_purge_tiles")
+def async_purge_tiles(service_pk, layer=None, **kwargs):
+    """Remove the cached tiles of the given service or only of the given layer of it."""
+    from registry.proxy.tiles import tile_cache
+    tile_cache.purge(service_pk=service_pk, layer=layer)
+    return True
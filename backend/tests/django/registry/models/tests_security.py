@@ -1,9 +1,17 @@
 
-from django.contrib.gis.geos import GEOSGeometry
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.contrib.gis.geos import GEOSGeometry, MultiPolygon
 from django.db.utils import IntegrityError
-from django.test import TestCase
-from registry.models.security import AllowedWebMapServiceOperation
-from registry.models.service import WebMapService
+from django.test import TestCase, override_settings
+from registry.enums.service import AuthTypeEnum
+from registry.managers.security import AllowedWebMapServiceOperationQuerySet
+from registry.models.security import (AllowedWebMapServiceOperation,
+                                      AllowedWebMapServiceOperationAreaPart,
+                                      AllowedWebMapServiceOperationLayer,
+                                      WebMapServiceAuthentication)
+from registry.models.service import Layer, WebMapService
 
 
 class AllowedWebMapServiceOperationModelTest(TestCase):
@@ -23,3 +31,117 @@ class AllowedWebMapServiceOperationModelTest(TestCase):
             secured_service=WebMapService.objects.get(
                 pk='cd16cc1f-3abb-4625-bb96-fbe80dbe23e3'),
             allowed_area=GEOSGeometry("MULTIPOLYGON EMPTY"))
+
+    @override_settings(PROXY_ALLOWED_AREA_TOLERANCES=[0.001], PROXY_ALLOWED_AREA_SUBDIVIDE_MAX_VERTICES=8)
+    def test_allowed_area_is_subdivided_on_save(self):
+        circle = GEOSGeometry("SRID=4326;POINT(7 50)").buffer(1, quadsegs=64)
+        allowed_wms_operation = AllowedWebMapServiceOperation.objects.create(
+            secured_service=WebMapService.objects.get(
+                pk='cd16cc1f-3abb-4625-bb96-fbe80dbe23e3'),
+            allowed_area=MultiPolygon(circle, srid=4326))
+
+        parts = AllowedWebMapServiceOperationAreaPart.objects.filter(
+            allowed_operation=allowed_wms_operation)
+        self.assertEqual({0, 0.001}, set(
+            parts.values_list("tolerance", flat=True)))
+        full_resolution = parts.filter(tolerance=0)
+        self.assertGreater(full_resolution.count(), 1)
+        self.assertAlmostEqual(
+            circle.area, sum(part.geom.area for part in full_resolution), places=6)
+
+        allowed_wms_operation.allowed_area = None
+        allowed_wms_operation.save()
+        self.assertFalse(parts.exists())
+
+
+class WebMapServiceAuthenticationModelTest(TestCase):
+
+    fixtures = ['test_keywords.json', "test_wms.json"]
+
+    def setUp(self):
+        self.auth = WebMapServiceAuthentication.objects.create(
+            service=WebMapService.objects.get(
+                pk='cd16cc1f-3abb-4625-bb96-fbe80dbe23e3'),
+            username="user",
+            password="secret",
+            auth_type=AuthTypeEnum.BASIC.value)
+
+    def test_credentials_are_decrypted_once(self):
+        with patch.object(WebMapServiceAuthentication, "decrypt", autospec=True,
+                          side_effect=WebMapServiceAuthentication.decrypt) as decrypt:
+            self.assertEqual(("user", "secret"),
+                             WebMapServiceAuthentication.objects.get(pk=self.auth.pk).get_auth_for_request())
+            self.assertEqual(("user", "secret"),
+                             WebMapServiceAuthentication.objects.get(pk=self.auth.pk).get_auth_for_request())
+
+        decrypt.assert_called_once()
+
+    def test_changed_credentials_are_not_cached(self):
+        self.auth.get_auth_for_request()
+
+        auth = WebMapServiceAuthentication.objects.get(pk=self.auth.pk)
+        auth.password = "changed"
+        auth.save()
+
+        self.assertEqual(("user", "changed"),
+                         WebMapServiceAuthentication.objects.get(pk=self.auth.pk).get_auth_for_request())
+
+    def test_changed_credentials_change_the_client_cache_key(self):
+        service = WebMapService.objects.select_related("auth").get(pk=self.auth.service_id)
+        key = service.client_cache_key
+
+        self.auth.password = "changed"
+        self.auth.save()
+
+        self.assertNotEqual(key, WebMapService.objects.select_related(
+            "auth").get(pk=self.auth.service_id).client_cache_key)
+
+
+class AllowedWebMapServiceOperationLayerModelTest(TestCase):
+
+    fixtures = ['test_keywords.json', "test_wms.json"]
+
+    def setUp(self):
+        self.allowed_wms_operation = AllowedWebMapServiceOperation.objects.create(
+            secured_service=WebMapService.objects.get(
+                pk='cd16cc1f-3abb-4625-bb96-fbe80dbe23e3'))
+        # node1.1
+        self.secured_layer = Layer.objects.get(
+            pk="226e655b-b6cd-48a4-95e2-8bfe1c933790")
+        self.allowed_wms_operation.secured_layers.add(self.secured_layer)
+
+    def get_effective_identifiers(self):
+        return set(AllowedWebMapServiceOperationLayer.objects.filter(
+            allowed_operation=self.allowed_wms_operation).values_list("identifier", flat=True))
+
+    def test_subtree_is_effective(self):
+        self.assertEqual(
+            {"node1.1", "node1.1.1", "node1.1.2", "node1.1.3"}, self.get_effective_identifiers())
+
+    def test_removed_subtree_is_not_effective(self):
+        self.allowed_wms_operation.secured_layers.remove(self.secured_layer)
+
+        self.assertEqual(set(), self.get_effective_identifiers())
+
+    def test_filter_by_requested_sub_layers(self):
+        queryset = AllowedWebMapServiceOperationQuerySet(
+            model=AllowedWebMapServiceOperation)
+
+        self.assertIn(self.allowed_wms_operation, queryset.filter_by_requested_entity(
+            request=SimpleNamespace(requested_entities=["node1.1.1", "NODE1.1.2"])))
+        self.assertNotIn(self.allowed_wms_operation, queryset.filter_by_requested_entity(
+            request=SimpleNamespace(requested_entities=["node1.1.1", "node1.2"])))
+
+    def test_renamed_layer_is_effective_after_commit(self):
+        layer = Layer.objects.get(
+            service__pk='cd16cc1f-3abb-4625-bb96-fbe80dbe23e3', identifier="node1.1.1")
+        layer.identifier = "renamed"
+
+        with patch("registry.proxy.security_policy.security_policy_registry.publish_invalidation") as publish_invalidation, \
+                self.captureOnCommitCallbacks(execute=True):
+            layer.save()
+            layer.save()
+
+        self.assertEqual(
+            {"node1.1", "renamed", "node1.1.2", "node1.1.3"}, self.get_effective_identifiers())
+        publish_invalidation.assert_any_call(service_pk=layer.service_id)
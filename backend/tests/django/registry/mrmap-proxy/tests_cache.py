@@ -0,0 +1,72 @@
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+from registry.proxy.cache import LRUCache
+
+
+class LRUCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.cache = LRUCache(max_size=2)
+
+    def test_hit_and_miss_counters(self):
+        self.assertIsNone(self.cache.get(key=("service", 1)))
+        self.cache.set(key=("service", 1), value="parsed")
+        self.assertEqual("parsed", self.cache.get(key=("service", 1)))
+
+        self.assertEqual(1, self.cache.stats["hits"])
+        self.assertEqual(1, self.cache.stats["misses"])
+
+    def test_least_recently_used_entry_is_dropped(self):
+        self.cache.set(key=("a", 1), value="a")
+        self.cache.set(key=("b", 1), value="b")
+        # touch a, so that b is the least recently used entry
+        self.cache.get(key=("a", 1))
+        self.cache.set(key=("c", 1), value="c")
+
+        self.assertEqual("a", self.cache.get(key=("a", 1)))
+        self.assertIsNone(self.cache.get(key=("b", 1)))
+        self.assertEqual(2, self.cache.stats["size"])
+
+    def test_get_or_set_constructs_only_once(self):
+        calls = []
+
+        def construct():
+            calls.append(1)
+            return "client"
+
+        self.cache.get_or_set(key=("service", 1), default=construct)
+        self.cache.get_or_set(key=("service", 1), default=construct)
+
+        self.assertEqual(1, len(calls))
+
+    def test_invalidate_group(self):
+        self.cache.set(key=("service", "v1"), value="old")
+        self.cache.set(key=("other", "v1"), value="other")
+        self.cache.invalidate(group="service")
+
+        self.assertIsNone(self.cache.get(key=("service", "v1")))
+        self.assertEqual("other", self.cache.get(key=("other", "v1")))
+
+    def test_expired_entry_is_dropped(self):
+        cache = LRUCache(max_size=2, timeout=60)
+        with patch("registry.proxy.cache.time.monotonic", return_value=100):
+            cache.set(key=("service", 1), value="auth")
+        with patch("registry.proxy.cache.time.monotonic", return_value=159):
+            self.assertEqual("auth", cache.get(key=("service", 1)))
+        with patch("registry.proxy.cache.time.monotonic", return_value=160):
+            self.assertIsNone(cache.get(key=("service", 1)))
+
+        self.assertEqual(0, cache.stats["size"])
+
+    def test_evicted_values_are_released(self):
+        evicted = []
+        cache = LRUCache(max_size=2, on_evict=evicted.append)
+        cache.set(key=("a", 1), value="a")
+        cache.set(key=("b", 1), value="b")
+        cache.set(key=("c", 1), value="c")
+        cache.invalidate(group="b")
+        cache.set(key=("c", 1), value="new c")
+        cache.get_or_set(key=("c", 1), default=lambda: "unused")
+
+        self.assertEqual(["a", "b", "c"], evicted)
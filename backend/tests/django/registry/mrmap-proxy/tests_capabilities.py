@@ -0,0 +1,87 @@
+import gzip
+from unittest.mock import MagicMock
+
+from django.test import RequestFactory, SimpleTestCase
+from registry.proxy.capabilities import CapabilitiesRenderCache
+
+
+class CapabilitiesRenderCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.render_cache = CapabilitiesRenderCache(
+            max_size=8, timeout=60, cache_alias="local-memory")
+        self.render_cache.cache.clear()
+        self.service = MagicMock(pk="service", camouflage=True)
+        self.service.get_capabilitites_for_request.return_value = "<capabilities/>"
+        self.request = RequestFactory().get(
+            "/mrmap-proxy/wms/service", HTTP_HOST="mrmap.example.com")
+
+    def test_document_is_rendered_once(self):
+        first = self.render_cache.get_or_render(
+            service=self.service, request=self.request)
+        second = self.render_cache.get_or_render(
+            service=self.service, request=self.request)
+
+        self.assertIs(first, second)
+        self.assertEqual(
+            1, self.service.get_capabilitites_for_request.call_count)
+        self.assertTrue(first.etag.startswith('"'))
+
+    def test_document_is_rendered_per_host(self):
+        self.render_cache.get_or_render(
+            service=self.service, request=self.request)
+        self.render_cache.get_or_render(service=self.service, request=RequestFactory().get(
+            "/mrmap-proxy/wms/service", HTTP_HOST="other.example.com"))
+
+        self.assertEqual(
+            2, self.service.get_capabilitites_for_request.call_count)
+
+    def test_invalidate(self):
+        self.render_cache.get_or_render(
+            service=self.service, request=self.request)
+        self.render_cache.invalidate(service_pk=self.service.pk)
+        self.render_cache.get_or_render(
+            service=self.service, request=self.request)
+
+        self.assertEqual(
+            2, self.service.get_capabilitites_for_request.call_count)
+
+    def test_invalidate_all_services(self):
+        self.render_cache.get_or_render(
+            service=self.service, request=self.request)
+        self.render_cache.invalidate()
+        self.render_cache.get_or_render(
+            service=self.service, request=self.request)
+
+        self.assertEqual(
+            2, self.service.get_capabilitites_for_request.call_count)
+
+    def test_invalidate_on_commit_in_autocommit_mode(self):
+        self.render_cache.get_or_render(
+            service=self.service, request=self.request)
+        self.render_cache.invalidate_on_commit(service_pk=self.service.pk)
+        self.render_cache.get_or_render(
+            service=self.service, request=self.request)
+
+        self.assertEqual(
+            2, self.service.get_capabilitites_for_request.call_count)
+
+    def test_document_is_rendered_per_visible_layers(self):
+        self.render_cache.get_or_render(
+            service=self.service, request=self.request, visible_layer_identifiers=frozenset(["node1", "node2"]))
+        self.render_cache.get_or_render(
+            service=self.service, request=self.request, visible_layer_identifiers=frozenset(["node2", "node1"]))
+        self.render_cache.get_or_render(
+            service=self.service, request=self.request, visible_layer_identifiers=frozenset(["node2"]))
+
+        self.assertEqual(
+            2, self.service.get_capabilitites_for_request.call_count)
+
+    def test_compressed_variant_is_compressed_once(self):
+        rendered = self.render_cache.get_or_render(
+            service=self.service, request=self.request)
+
+        encoded = rendered.get_encoded(encoding="gzip")
+
+        self.assertIs(encoded, rendered.get_encoded(encoding="gzip"))
+        self.assertEqual(b"<capabilities/>", gzip.decompress(encoded))
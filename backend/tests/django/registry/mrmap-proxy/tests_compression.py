@@ -0,0 +1,80 @@
+import gzip
+
+import brotli
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from registry.proxy.compression import (CompressionMiddleware,
+                                        get_accepted_encoding)
+
+CONTENT = b"<wfs:FeatureCollection>" + b"<gml:featureMember/>" * 100 + b"</wfs:FeatureCollection>"
+
+
+@override_settings(
+    PROXY_COMPRESSION=True,
+    PROXY_COMPRESSION_ENCODINGS=["zstd", "br", "gzip"],
+    PROXY_COMPRESSION_PATHS=["/mrmap-proxy/"],
+    PROXY_COMPRESSION_MIN_SIZE=1024,
+)
+class CompressionMiddlewareTest(SimpleTestCase):
+
+    def get_response(self, response, path="/mrmap-proxy/wfs/1", accept_encoding="gzip"):
+        request = RequestFactory().get(path, HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(get_response=lambda request: response)(request)
+
+    def test_accepted_encoding(self):
+        for accept_encoding, expected in (
+            ("gzip, deflate, br", "br"),
+            ("gzip;q=1.0, br;q=0.5", "gzip"),
+            ("zstd, br, gzip", "zstd"),
+            ("*", "zstd"),
+            ("*, zstd;q=0", "br"),
+            ("identity", None),
+            ("", None),
+        ):
+            request = RequestFactory().get(
+                "/", HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertEqual(expected, get_accepted_encoding(
+                request=request), accept_encoding)
+
+    def test_xml_is_compressed(self):
+        response = self.get_response(response=HttpResponse(
+            content=CONTENT, content_type="text/xml; subtype=gml/3.2.1"))
+
+        self.assertEqual("gzip", response["Content-Encoding"])
+        self.assertEqual(CONTENT, gzip.decompress(response.content))
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_brotli(self):
+        response = self.get_response(response=HttpResponse(
+            content=CONTENT, content_type="application/xml"), accept_encoding="br")
+
+        self.assertEqual("br", response["Content-Encoding"])
+        self.assertEqual(CONTENT, brotli.decompress(response.content))
+
+    def test_streaming_response_is_compressed(self):
+        response = self.get_response(response=StreamingHttpResponse(
+            streaming_content=iter([CONTENT[:100], CONTENT[100:]]), content_type="application/gml+xml"))
+
+        self.assertEqual("gzip", response["Content-Encoding"])
+        self.assertEqual(CONTENT, gzip.decompress(
+            b"".join(response.streaming_content)))
+
+    def test_strong_etag_is_weakened(self):
+        response = HttpResponse(content=CONTENT, content_type="application/xml")
+        response["ETag"] = '"abc"'
+
+        self.assertEqual('W/"abc"', self.get_response(response=response)["ETag"])
+
+    def test_not_compressed(self):
+        encoded = HttpResponse(content=CONTENT, content_type="application/xml")
+        encoded["Content-Encoding"] = "gzip"
+        for response, kwargs in (
+            (HttpResponse(content=b"<small/>", content_type="application/xml"), {}),
+            (HttpResponse(content=CONTENT, content_type="image/png"), {}),
+            (HttpResponse(content=CONTENT, content_type="application/xml"), {"path": "/api/registry/wms"}),
+            (HttpResponse(content=CONTENT, content_type="application/xml"), {"accept_encoding": "identity"}),
+            (encoded, {}),
+        ):
+            content = response.content
+            response = self.get_response(response=response, **kwargs)
+            self.assertEqual(content, response.content)
@@ -0,0 +1,129 @@
+import asyncio
+from threading import Event, current_thread
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+from registry.proxy.hedging import Hedger
+
+
+class MockResponse:
+
+    def __init__(self, name):
+        self.name = name
+        self.closed = Event()
+
+    def close(self):
+        self.closed.set()
+
+
+class HedgerTest(SimpleTestCase):
+
+    def setUp(self):
+        self.hedger = Hedger(percentile=90, budget=0.5, burst=1,
+                             min_samples=10, min_delay=0.01)
+        for _ in range(10):
+            self.hedger.record(key="key", latency=0.01)
+
+    def test_no_hedging_without_enough_samples(self):
+        calls = []
+        response = self.hedger.do(
+            key="other", func=lambda: calls.append(1) or "response")
+
+        self.assertEqual("response", response)
+        self.assertEqual(1, len(calls))
+        self.assertIsNone(self.hedger.get_delay(key="other"))
+
+    def test_delay_is_the_percentile_of_recent_latencies(self):
+        for latency in range(10):
+            self.hedger.record(key="percentile", latency=latency)
+
+        self.assertEqual(9, self.hedger.get_delay(key="percentile"))
+
+    def test_slow_request_is_hedged(self):
+        release = Event()
+        slow = MockResponse(name="slow")
+        fast = MockResponse(name="fast")
+        calls = []
+
+        def func():
+            calls.append(1)
+            if len(calls) == 1:
+                release.wait(timeout=5)
+                return slow
+            return fast
+
+        response = self.hedger.do(key="key", func=func)
+        release.set()
+
+        self.assertIs(fast, response)
+        self.assertTrue(slow.closed.wait(timeout=5))
+        self.assertFalse(fast.closed.is_set())
+        self.assertEqual(1, self.hedger.counters.get("hedged"))
+        self.assertEqual(1, self.hedger.counters.get("hedge_won"))
+
+    def test_failed_hedge_does_not_win(self):
+        release = Event()
+        slow = MockResponse(name="slow")
+        calls = []
+
+        def func():
+            calls.append(1)
+            if len(calls) == 1:
+                release.wait(timeout=0.2)
+                return slow
+            return {"status_code": 502}
+
+        self.assertIs(slow, self.hedger.do(key="key", func=func))
+
+    def test_hedging_is_limited_by_budget(self):
+        self.hedger.burst = 0
+        self.hedger._get_upstream(key="key").tokens = 0
+        calls = []
+
+        def func():
+            calls.append(1)
+            Event().wait(timeout=0.05)
+            return "response"
+
+        self.assertEqual("response", self.hedger.do(key="key", func=func))
+        self.assertEqual(1, len(calls))
+        self.assertEqual(1, self.hedger.counters.get("budget_exhausted"))
+
+    def test_request_which_can_not_be_hedged_is_sent_on_the_calling_thread(self):
+        self.hedger.burst = 0
+        self.hedger._get_upstream(key="key").tokens = 0
+        threads = []
+
+        self.hedger.do(key="key", func=lambda: threads.append(current_thread()))
+
+        self.assertEqual([current_thread()], threads)
+
+    def test_no_hedging_without_free_workers(self):
+        threads = []
+
+        with patch.object(self.hedger, "_submit", return_value=None):
+            response = self.hedger.do(
+                key="key", func=lambda: threads.append(current_thread()) or "response")
+
+        self.assertEqual("response", response)
+        self.assertEqual([current_thread()], threads)
+        self.assertEqual(1, self.hedger.counters.get("workers_exhausted"))
+
+    def test_async_loser_is_cancelled(self):
+        cancelled = []
+        fast = MockResponse(name="fast")
+
+        async def func():
+            if not cancelled:
+                cancelled.append(False)
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled[0] = True
+                    raise
+            return fast
+
+        response = asyncio.run(self.hedger.ado(key="key", func=func))
+
+        self.assertIs(fast, response)
+        self.assertEqual([True], cancelled)
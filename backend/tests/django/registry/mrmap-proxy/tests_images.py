@@ -0,0 +1,108 @@
+from io import BytesIO
+
+from django.test import SimpleTestCase
+from PIL import Image
+from registry.proxy.images import (composite_images, get_bgcolor,
+                                   get_empty_image, get_image_format,
+                                   mask_image)
+
+
+class EmptyImageTest(SimpleTestCase):
+
+    def test_image_format(self):
+        self.assertEqual("PNG", get_image_format("image/png; mode=8bit"))
+        self.assertEqual("JPEG", get_image_format("image/jpeg"))
+        self.assertEqual("PNG", get_image_format("application/unknown"))
+
+    def test_bgcolor(self):
+        self.assertEqual((255, 0, 16), get_bgcolor("0xFF0010"))
+        self.assertEqual((255, 255, 255), get_bgcolor(None))
+
+    def test_transparent_png(self):
+        content = get_empty_image(mime_type="image/png", width=30, height=20)
+        image = Image.open(BytesIO(content))
+
+        self.assertEqual((30, 20), image.size)
+        self.assertEqual((0, 0, 0, 0), image.getpixel((0, 0)))
+        # the image is encoded only once per size and format
+        self.assertIs(content, get_empty_image(
+            mime_type="image/png", width=30, height=20))
+
+    def test_jpeg_is_filled_with_bgcolor(self):
+        content = get_empty_image(
+            mime_type="image/jpeg", width=30, height=20, bgcolor="0x000000")
+        image = Image.open(BytesIO(content))
+
+        self.assertEqual("JPEG", image.format)
+        self.assertEqual((0, 0, 0), image.getpixel((0, 0)))
+
+
+class MaskImageTest(SimpleTestCase):
+
+    def setUp(self):
+        # left half visible, right half hidden
+        self.mask = Image.new("L", (20, 10), 255)
+        self.mask.paste(0, (0, 0, 10, 10))
+
+    def encode(self, image, image_format):
+        out = BytesIO()
+        image.save(out, image_format)
+        return out.getvalue()
+
+    def test_png_alpha_is_masked(self):
+        content = self.encode(Image.new("RGB", (20, 10), (10, 20, 30)), "PNG")
+        image = Image.open(BytesIO(mask_image(content=content, mask=self.mask)))
+
+        self.assertEqual("PNG", image.format)
+        self.assertEqual((10, 20, 30, 255), image.getpixel((5, 5)))
+        self.assertEqual(0, image.getpixel((15, 5))[3])
+
+    def test_jpeg_is_blended_with_white(self):
+        content = self.encode(Image.new("RGB", (20, 10), (0, 0, 0)), "JPEG")
+        image = Image.open(BytesIO(mask_image(content=content, mask=self.mask)))
+
+        self.assertEqual("JPEG", image.format)
+        self.assertLess(sum(image.getpixel((3, 5))), 30)
+        self.assertGreater(sum(image.getpixel((17, 5))), 735)
+
+    def test_palette_is_preserved(self):
+        palette_image = Image.new("P", (20, 10), 1)
+        palette_image.putpalette([0, 0, 0, 255, 0, 0])
+        content = self.encode(palette_image, "PNG")
+        image = Image.open(BytesIO(mask_image(content=content, mask=self.mask)))
+
+        self.assertEqual("P", image.mode)
+        self.assertEqual(1, image.getpixel((5, 5)))
+        self.assertEqual(image.info["transparency"], image.getpixel((15, 5)))
+
+
+class CompositeImagesTest(SimpleTestCase):
+
+    def encode(self, image):
+        out = BytesIO()
+        image.save(out, "PNG")
+        return out.getvalue()
+
+    def setUp(self):
+        # red bottom image; blue top image, which covers only the left half
+        self.bottom = self.encode(Image.new("RGBA", (20, 10), (255, 0, 0, 255)))
+        top = Image.new("RGBA", (20, 10), (0, 0, 0, 0))
+        top.paste((0, 0, 255, 255), (0, 0, 10, 10))
+        self.top = self.encode(top)
+
+    def test_images_are_drawn_from_bottom_to_top(self):
+        image = Image.open(BytesIO(composite_images(
+            contents=[self.bottom, None, self.top], mime_type="image/png", width=20, height=10)))
+
+        self.assertEqual("PNG", image.format)
+        self.assertEqual((0, 0, 255, 255), image.getpixel((5, 5)))
+        self.assertEqual((255, 0, 0, 255), image.getpixel((15, 5)))
+
+    def test_jpeg_is_filled_with_bgcolor(self):
+        image = Image.open(BytesIO(composite_images(
+            contents=[self.top], mime_type="image/jpeg", width=20, height=10, bgcolor="0x00FF00")))
+
+        self.assertEqual("JPEG", image.format)
+        red, green, blue = image.getpixel((17, 5))
+        self.assertGreater(green, 240)
+        self.assertLess(red + blue, 30)
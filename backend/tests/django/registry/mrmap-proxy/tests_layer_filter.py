@@ -0,0 +1,48 @@
+from django.test import SimpleTestCase
+from registry.proxy.layer_filter import filter_layer_params
+
+
+class FilterLayerParamsTest(SimpleTestCase):
+
+    def test_styles_are_kept_in_line(self):
+        params = filter_layer_params(
+            params={"REQUEST": "GetMap", "LAYERS": "roads,Parcels,rivers", "STYLES": "default,red,blue"},
+            allowed_entities=frozenset(["parcels", "rivers"]))
+
+        self.assertEqual("Parcels,rivers", params["LAYERS"])
+        self.assertEqual("red,blue", params["STYLES"])
+        self.assertEqual("GetMap", params["REQUEST"])
+
+    def test_default_styles_are_not_changed(self):
+        params = filter_layer_params(
+            params={"layers": "roads,parcels", "styles": ""},
+            allowed_entities=frozenset(["parcels"]))
+
+        self.assertEqual("parcels", params["layers"])
+        self.assertEqual("", params["styles"])
+
+    def test_default_styles_are_requested_if_styles_do_not_match(self):
+        params = filter_layer_params(
+            params={"LAYERS": "roads,parcels,rivers", "STYLES": "default,red"},
+            allowed_entities=frozenset(["parcels", "rivers"]))
+
+        self.assertEqual("parcels,rivers", params["LAYERS"])
+        self.assertEqual("", params["STYLES"])
+
+    def test_query_layers(self):
+        params = filter_layer_params(
+            params={"LAYERS": "roads,parcels", "QUERY_LAYERS": "roads,parcels"},
+            allowed_entities=frozenset(["roads"]))
+
+        self.assertEqual("roads", params["LAYERS"])
+        self.assertEqual("roads", params["QUERY_LAYERS"])
+
+    def test_nothing_allowed(self):
+        original = {"LAYERS": "roads,parcels", "STYLES": ","}
+
+        params = filter_layer_params(params=original, allowed_entities=frozenset())
+
+        self.assertEqual("", params["LAYERS"])
+        self.assertEqual("", params["STYLES"])
+        # the given params are not changed
+        self.assertEqual("roads,parcels", original["LAYERS"])
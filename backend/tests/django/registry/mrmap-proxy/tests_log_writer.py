@@ -0,0 +1,116 @@
+import shutil
+from datetime import timedelta
+from tempfile import mkdtemp
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from registry.models.security import (WebMapServiceHttpRequestLog,
+                                      WebMapServiceHttpResponseLog)
+from registry.models.service import WebMapService
+from registry.proxy.log_writer import ProxyLogEntry, ProxyLogWriter
+
+
+class ProxyLogWriterTest(SimpleTestCase):
+
+    def test_drop_policy(self):
+        writer = ProxyLogWriter(max_size=1, batch_size=10, flush_interval=1)
+        content = ContentFile(b"dropped")
+        with patch.object(writer, "_ensure_thread"):
+            writer.log(ProxyLogEntry())
+            writer.log(ProxyLogEntry(response_content=content))
+
+        self.assertEqual(1, writer.counters.get("enqueued"))
+        self.assertEqual(1, writer.counters.get("dropped"))
+        # the content of dropped entries is released immediately
+        self.assertTrue(content.closed)
+
+    def test_block_policy_waits_up_to_timeout(self):
+        writer = ProxyLogWriter(
+            max_size=1, batch_size=10, flush_interval=1, policy="block", put_timeout=0.01)
+        with patch.object(writer, "_ensure_thread"):
+            writer.log(ProxyLogEntry())
+            writer.log(ProxyLogEntry())
+
+        self.assertEqual(1, writer.counters.get("dropped"))
+
+    def test_failed_flush_is_counted(self):
+        writer = ProxyLogWriter(max_size=0, batch_size=10, flush_interval=1)
+        with patch.object(writer, "flush", side_effect=ValueError):
+            writer.log(ProxyLogEntry())
+
+        self.assertEqual(1, writer.counters.get("failed"))
+
+
+class ProxyLogWriterFlushTest(TestCase):
+
+    fixtures = ["test_keywords.json", "test_wms.json"]
+
+    def setUp(self):
+        self.media_root = mkdtemp()
+        self.media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_settings.enable()
+        self.user = get_user_model().objects.create(username="User1")
+        self.system_user = get_user_model().objects.get_or_create(username="system")[0]
+        get_user_model().objects.get_or_create(username="AnonymousUser")
+        self.writer = ProxyLogWriter(max_size=0, batch_size=10, flush_interval=1)
+
+    def tearDown(self):
+        self.media_settings.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def get_entry(self, **kwargs):
+        return ProxyLogEntry(**{
+            "service_cls": WebMapService,
+            "service_pk": "cd16cc1f-3abb-4625-bb96-fbe80dbe23e3",
+            "timestamp": timezone.now(),
+            "elapsed": timedelta(seconds=1),
+            "method": "GET",
+            "url": "http://testserver/mrmap-proxy/wms/cd16cc1f-3abb-4625-bb96-fbe80dbe23e3",
+            "headers": {"HOST": "testserver"},
+            "status_code": 200,
+            **kwargs,
+        })
+
+    @patch("registry.tasks.security.async_analyze_logs.apply_async")
+    def test_flush(self, analyze_logs):
+        content = ContentFile(b"<FeatureCollection/>")
+        entries = [
+            self.get_entry(
+                user_pk=self.user.pk, request_body=b"<GetMap/>", request_content_type="application/xml",
+                reason="OK", response_elapsed=timedelta(seconds=0.5), response_headers={"Content-Type": "text/xml"},
+                response_url="http://example.com/wms", response_content=content,
+                response_content_type="text/xml"),
+            # an error response of the proxy itself
+            self.get_entry(status_code=503),
+        ]
+
+        self.writer.flush(entries=entries)
+
+        request_logs = WebMapServiceHttpRequestLog.objects.order_by("user__username")
+        self.assertEqual(["AnonymousUser", "User1"], [
+            request_log.user.username for request_log in request_logs])
+        anonymous_request_log, request_log = request_logs
+        self.assertFalse(anonymous_request_log.body)
+        with request_log.body.open("rb") as body:
+            self.assertEqual(b"<GetMap/>", body.read())
+
+        response_log = WebMapServiceHttpResponseLog.objects.get(request=request_log)
+        self.assertEqual("http://example.com/wms", response_log.url)
+        with response_log.content.open("rb") as response_content:
+            self.assertEqual(b"<FeatureCollection/>", response_content.read())
+        anonymous_response_log = WebMapServiceHttpResponseLog.objects.get(request=anonymous_request_log)
+        self.assertEqual(503, anonymous_response_log.status_code)
+        self.assertFalse(anonymous_response_log.content)
+
+        # the request logs of both entries are inserted with one bulk insert; their keys are set on the response logs
+        self.assertEqual(
+            {request_log.pk for request_log in request_logs},
+            set(WebMapServiceHttpResponseLog.objects.values_list("request_id", flat=True)))
+
+        # only responses with content are analyzed
+        analyze_logs.assert_called_once_with(
+            args=([response_log.pk], "webmapservicehttpresponselog"),
+            kwargs={"created_by_user_pk": self.system_user.pk})
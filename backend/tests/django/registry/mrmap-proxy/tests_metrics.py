@@ -0,0 +1,82 @@
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+from registry.proxy.metrics import (Counters, Histogram, RequestTimer,
+                                    get_outcome, render_samples, timed_phase)
+
+
+class HistogramTest(SimpleTestCase):
+
+    def setUp(self):
+        self.histogram = Histogram(
+            name="test_seconds", documentation="test", label_names=("phase",), buckets=(0.1, 1))
+
+    def test_samples_are_cumulative(self):
+        for value in (0.05, 0.5, 0.5, 5):
+            self.histogram.observe(labels=("parse",), value=value)
+
+        samples = self.histogram.get_samples()
+
+        labels = (("phase", "parse"),)
+        self.assertEqual(1, samples[("test_seconds_bucket", (*labels, ("le", "0.1")))])
+        self.assertEqual(3, samples[("test_seconds_bucket", (*labels, ("le", "1")))])
+        self.assertEqual(4, samples[("test_seconds_bucket", (*labels, ("le", "+Inf")))])
+        self.assertEqual(4, samples[("test_seconds_count", labels)])
+        self.assertAlmostEqual(6.05, samples[("test_seconds_sum", labels)])
+
+    def test_render(self):
+        self.histogram.observe(labels=('a "quoted" phase',), value=2)
+        counters = Counters(name="test")
+        counters.increment("hits")
+
+        content = render_samples(
+            samples={**self.histogram.get_samples(), **counters.get_samples()})
+
+        self.assertIn("# TYPE test_seconds histogram", content)
+        self.assertIn('test_seconds_bucket{phase="a \\"quoted\\" phase",le="+Inf"} 1', content)
+        self.assertIn("# TYPE mrmap_proxy_test_total counter", content)
+        self.assertIn('mrmap_proxy_test_total{key="hits"} 1', content)
+        lines = content.splitlines()
+        self.assertLess(
+            lines.index('test_seconds_bucket{phase="a \\"quoted\\" phase",le="1"} 0'),
+            lines.index('test_seconds_bucket{phase="a \\"quoted\\" phase",le="+Inf"} 1'))
+
+
+class RequestTimerTest(SimpleTestCase):
+
+    def test_phases_are_added(self):
+        timer = RequestTimer()
+        timer.add(phase="upstream_ttfb", seconds=0.1)
+        timer.add(phase="upstream_ttfb", seconds=0.2)
+
+        self.assertAlmostEqual(0.3, timer.durations["upstream_ttfb"])
+        self.assertTrue(timer.get_server_timing().startswith(
+            "upstream_ttfb;dur=300.0, total;dur="))
+
+    def test_timed_phase(self):
+        class View:
+            timer = RequestTimer()
+
+            @timed_phase("mask")
+            def create_mask(self):
+                return "mask"
+
+        view = View()
+
+        self.assertEqual("mask", view.create_mask())
+        self.assertIn("mask", view.timer.durations)
+
+    def test_observe(self):
+        timer = RequestTimer()
+        timer.add(phase="parse", seconds=0.001)
+
+        with patch("registry.proxy.metrics.phase_histogram.observe") as observe_phase, \
+                patch("registry.proxy.metrics.request_histogram.observe") as observe_request, \
+                patch("registry.proxy.metrics.metrics_publisher.ensure_thread"):
+            timer.observe(service="1", operation="getmap",
+                          outcome=get_outcome(status_code=200))
+
+        observe_phase.assert_called_once_with(
+            labels=("1", "getmap", "2xx", "parse"), value=0.001)
+        self.assertEqual(("1", "getmap", "2xx"),
+                         observe_request.call_args.kwargs["labels"])
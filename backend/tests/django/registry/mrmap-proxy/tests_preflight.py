@@ -0,0 +1,153 @@
+from unittest.mock import Mock, patch
+
+from django.contrib.gis.geos import Polygon
+from django.test import SimpleTestCase, override_settings
+from ows_lib.models.ogc_request import OGCRequest
+from registry.proxy.preflight import (LayerAttributes,
+                                      compile_layer_attributes,
+                                      convert_scale, get_scale,
+                                      get_scale_denominator, get_scale_hint,
+                                      normalize_crs)
+from registry.proxy.wms_proxy import WebMapServiceProxy
+
+
+class ScaleTest(SimpleTestCase):
+
+    def test_scale_denominator_of_projected_crs(self):
+        bbox = Polygon.from_bbox((0, 0, 2800, 2800))
+        bbox.srid = 3857
+
+        self.assertAlmostEqual(10000, get_scale_denominator(
+            bbox=bbox, width=1000, height=1000))
+
+    def test_scale_denominator_of_geographic_crs(self):
+        bbox = Polygon.from_bbox((0, 0, 1, 1))
+        bbox.srid = 4326
+
+        self.assertAlmostEqual(111319.49079327358 / 0.00028, get_scale_denominator(
+            bbox=bbox, width=1, height=1))
+
+    def test_scale_hint(self):
+        bbox = Polygon.from_bbox((0, 0, 300, 400))
+        bbox.srid = 3857
+
+        self.assertAlmostEqual(5, get_scale_hint(
+            bbox=bbox, width=100, height=100))
+
+    def test_scale_of_version(self):
+        bbox = Polygon.from_bbox((0, 0, 300, 400))
+        bbox.srid = 3857
+
+        self.assertAlmostEqual(5, get_scale(
+            bbox=bbox, width=100, height=100, version="1.1.1"))
+        self.assertAlmostEqual(3 / 0.00028, get_scale(
+            bbox=bbox, width=100, height=100, version="1.3.0"))
+
+    def test_convert_scale(self):
+        hint = convert_scale(scale=10000, from_version="1.3.0", to_version="1.1.1")
+
+        self.assertAlmostEqual(10000 * 0.00028 * 2 ** 0.5, hint)
+        self.assertAlmostEqual(10000, convert_scale(
+            scale=hint, from_version="1.1.1", to_version="1.3.0"))
+        self.assertEqual(10000, convert_scale(
+            scale=10000, from_version="1.3.0", to_version="1.3.0"))
+
+
+class LayerAttributesTest(SimpleTestCase):
+
+    def setUp(self):
+        root_bbox = Polygon.from_bbox((5, 47, 15, 55))
+        node_bbox = Polygon.from_bbox((6, 49, 8, 51))
+        layers = [
+            ("node1.1", "node1.1", 1, 3, 4, None, None, None),
+            ("root", "root", 1, 1, 8, None, 50000, root_bbox),
+            ("node1", "node1", 1, 2, 5, 1000, None, node_bbox),
+            ("node2", "node2", 1, 6, 7, None, None, None),
+        ]
+        reference_systems = [
+            ("root", "EPSG", "4326"),
+            ("node1", "EPSG", "25832"),
+        ]
+        self.layers = compile_layer_attributes(
+            layers=layers, reference_systems=reference_systems)
+
+    def test_scale_range_is_inherited(self):
+        self.assertEqual((1000, 50000), (
+            self.layers["node1.1"].scale_min, self.layers["node1.1"].scale_max))
+        self.assertEqual((None, 50000), (
+            self.layers["node2"].scale_min, self.layers["node2"].scale_max))
+
+    def test_nearest_bbox_is_inherited(self):
+        self.assertEqual((6, 49, 8, 51), self.layers["node1.1"].extent)
+        self.assertEqual((5, 47, 15, 55), self.layers["node2"].extent)
+
+    def test_reference_systems_are_added(self):
+        self.assertTrue(self.layers["node1.1"].supports("epsg:25832"))
+        self.assertTrue(self.layers["node1.1"].supports(
+            "urn:ogc:def:crs:EPSG::4326"))
+        self.assertFalse(self.layers["node2"].supports("EPSG:25832"))
+
+    def test_scale_range(self):
+        layer = LayerAttributes(scale_min=1000, scale_max=50000)
+
+        self.assertTrue(layer.is_in_scale_range(scale=1000))
+        self.assertFalse(layer.is_in_scale_range(scale=999))
+        self.assertFalse(layer.is_in_scale_range(scale=50001))
+
+    def test_extent(self):
+        self.assertTrue(self.layers["node1"].intersects(extent=(7, 50, 20, 60)))
+        self.assertFalse(self.layers["node1"].intersects(extent=(9, 50, 20, 60)))
+
+    def test_scale_range_with_tolerance(self):
+        layer = LayerAttributes(scale_min=1000, scale_max=50000)
+
+        self.assertTrue(layer.is_in_scale_range(scale=800, tolerance=0.3))
+        self.assertTrue(layer.is_in_scale_range(scale=60000, tolerance=0.3))
+        self.assertFalse(layer.is_in_scale_range(scale=650000, tolerance=0.3))
+
+    def test_extent_with_tolerance(self):
+        # the extent of node1 is (6, 49, 8, 51)
+        self.assertTrue(self.layers["node1"].intersects(extent=(8.5, 50, 20, 60), tolerance=0.3))
+        self.assertFalse(self.layers["node1"].intersects(extent=(9, 50, 20, 60), tolerance=0.3))
+
+    def test_layers_without_reference_systems_support_every_crs(self):
+        self.assertTrue(LayerAttributes().supports("EPSG:3857"))
+
+    def test_normalize_crs(self):
+        self.assertEqual("EPSG:4326", normalize_crs("epsg:4326"))
+        self.assertEqual("CRS:84", normalize_crs("CRS:84"))
+        self.assertEqual("EPSG:4326", normalize_crs(
+            "urn:ogc:def:crs:EPSG::4326"))
+
+
+@override_settings(PROXY_GET_MAP_PREFLIGHT=True, PROXY_GET_MAP_PREFLIGHT_TOLERANCE=0.3)
+class GetMapPreflightTest(SimpleTestCase):
+
+    def get_preflight_response(self, version: str, bbox: str):
+        proxy = WebMapServiceProxy()
+        proxy.ogc_request = OGCRequest(method="GET", url="http://example.com/wms", params={
+            "SERVICE": "WMS", "REQUEST": "GetMap", "VERSION": version, "LAYERS": "roads", "STYLES": "",
+            "SRS" if version.startswith("1.1") else "CRS": "EPSG:3857", "BBOX": bbox,
+            "WIDTH": "1000", "HEIGHT": "1000", "FORMAT": "image/png"})
+        # the scale range is a max scale denominator, like wms 1.3.0 defines it
+        proxy._service = Mock(version="1.3.0", is_active=True, is_secured=False, security_policy=Mock(
+            layer_attributes={"roads": LayerAttributes(scale_max=10000)}))
+        with patch.object(proxy, "get_empty_map_response", return_value="empty"), \
+                patch.object(proxy, "return_http_response", side_effect=lambda response: response):
+            return proxy.get_preflight_response()
+
+    def test_request_in_scale_range(self):
+        self.assertIsNone(self.get_preflight_response(
+            version="1.3.0", bbox="0,0,2800,2800"))
+
+    def test_request_out_of_scale_range(self):
+        self.assertEqual("empty", self.get_preflight_response(
+            version="1.3.0", bbox="0,0,28000,28000"))
+
+    def test_request_of_other_version_in_scale_range(self):
+        self.assertIsNone(self.get_preflight_response(
+            version="1.1.1", bbox="0,0,2800,2800"))
+
+    def test_request_of_other_version_out_of_scale_range(self):
+        self.assertEqual("empty", self.get_preflight_response(
+            version="1.1.1", bbox="0,0,28000,28000"))
@@ -0,0 +1,69 @@
+from django.contrib.gis.geos import GEOSGeometry, Polygon
+from django.test import SimpleTestCase, override_settings
+from registry.proxy.security_mask import (MASKED, VISIBLE,
+                                          get_simplify_tolerance,
+                                          render_security_mask)
+
+
+class RenderSecurityMaskTest(SimpleTestCase):
+
+    def setUp(self):
+        self.allowed_area = GEOSGeometry(
+            "SRID=4326;MULTIPOLYGON(((0 0, 0 10, 10 10, 10 0, 0 0), (4 4, 4 6, 6 6, 6 4, 4 4)))")
+
+    def test_mask_in_same_reference_system(self):
+        bbox = Polygon.from_bbox((0, 0, 20, 10))
+        bbox.srid = 4326
+        mask = render_security_mask(
+            allowed_area=self.allowed_area, bbox=bbox, width=200, height=100)
+
+        self.assertEqual("L", mask.mode)
+        self.assertEqual((200, 100), mask.size)
+        self.assertEqual(VISIBLE, mask.getpixel((20, 20)))
+        # the hole of the allowed area
+        self.assertEqual(MASKED, mask.getpixel((50, 50)))
+        # outside of the allowed area
+        self.assertEqual(MASKED, mask.getpixel((150, 50)))
+
+    def test_mask_is_transformed_to_requested_reference_system(self):
+        bbox = Polygon.from_bbox((0, 0, 2226389.8158654715, 1118889.9748579597))
+        bbox.srid = 3857
+        mask = render_security_mask(
+            allowed_area=self.allowed_area, bbox=bbox, width=200, height=100)
+
+        self.assertEqual(VISIBLE, mask.getpixel((20, 80)))
+        self.assertEqual(MASKED, mask.getpixel((150, 50)))
+
+    def test_mask_without_allowed_area(self):
+        bbox = Polygon.from_bbox((0, 0, 20, 10))
+        bbox.srid = 4326
+        mask = render_security_mask(
+            allowed_area=None, bbox=bbox, width=20, height=10)
+
+        self.assertEqual((MASKED, MASKED), mask.getextrema())
+
+
+@override_settings(PROXY_ALLOWED_AREA_TOLERANCES=[0.00001, 0.0001, 0.001, 0.01])
+class SimplifyToleranceTest(SimpleTestCase):
+
+    def test_tolerance_is_at_most_half_a_pixel(self):
+        for extent, expected in (
+            # 0.05 degree per pixel
+            ((0, 0, 50, 50), 0.01),
+            # 0.0005 degree per pixel
+            ((0, 0, 0.5, 0.5), 0.0001),
+            # 0.000001 degree per pixel
+            ((0, 0, 0.001, 0.001), 0),
+        ):
+            bbox = Polygon.from_bbox(extent)
+            bbox.srid = 4326
+            self.assertEqual(expected, get_simplify_tolerance(
+                bbox=bbox, width=1000, height=1000, srid=4326), extent)
+
+    def test_bbox_is_transformed(self):
+        # about 0.02 degree per pixel
+        bbox = Polygon.from_bbox((0, 0, 2226389.8158654715, 1118889.9748579597))
+        bbox.srid = 3857
+
+        self.assertEqual(0.01, get_simplify_tolerance(
+            bbox=bbox, width=900, height=450, srid=4326))
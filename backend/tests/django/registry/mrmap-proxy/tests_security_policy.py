@@ -0,0 +1,85 @@
+from django.contrib.gis.geos import GEOSGeometry
+from django.test import SimpleTestCase
+from registry.proxy.security_policy import (AllowedOperationPolicy,
+                                            SecurityPolicySnapshot)
+
+
+class SecurityPolicySnapshotTest(SimpleTestCase):
+
+    def setUp(self):
+        self.west = AllowedOperationPolicy(
+            pk=1,
+            operations=["GetMap", "GetFeatureInfo"],
+            group_pks=[1],
+            entity_identifiers=["root", "node1", "node1.1"],
+            allowed_area=GEOSGeometry("SRID=4326;MULTIPOLYGON(((0 0, 0 10, 10 10, 10 0, 0 0)))"))
+        self.east = AllowedOperationPolicy(
+            pk=2,
+            operations=["GetMap"],
+            group_pks=[2],
+            entity_identifiers=["node1"],
+            allowed_area=GEOSGeometry("SRID=4326;MULTIPOLYGON(((10 0, 10 10, 20 10, 20 0, 10 0)))"))
+        self.public = AllowedOperationPolicy(
+            pk=3,
+            operations=["GetMap"],
+            group_pks=[],
+            entity_identifiers=["node2"])
+        self.snapshot = SecurityPolicySnapshot(
+            service_pk="cd16cc1f-3abb-4625-bb96-fbe80dbe23e3",
+            known_entities=["root", "node1", "node1.1", "node2"],
+            policies=[self.west, self.east, self.public])
+
+    def test_policy_matches_operation_group_and_entities(self):
+        self.assertTrue(self.west.matches(
+            "getmap", frozenset([1]), ["NODE1", "node1.1"]))
+        self.assertFalse(self.west.matches(
+            "GetLegendGraphic", frozenset([1]), ["node1"]))
+        self.assertFalse(self.west.matches("GetMap", frozenset([2]), ["node1"]))
+        self.assertFalse(self.west.matches(
+            "GetMap", frozenset([1]), ["node1", "node2"]))
+
+    def test_policy_without_groups_matches_all_users(self):
+        self.assertTrue(self.public.matches("GetMap", frozenset(), ["node2"]))
+
+    def test_allowed_area_union_of_user_policies(self):
+        policies = self.snapshot.get_policies(
+            operation="GetMap", group_pks=frozenset([1, 2]), entities=["node1"])
+        self.assertEqual([self.west, self.east], policies)
+
+        union = self.snapshot.get_allowed_area_union(policies=policies)
+        prepared = self.snapshot.get_prepared_allowed_area_union(
+            policies=policies)
+        self.assertEqual(200, union.area)
+        self.assertTrue(prepared.covers(GEOSGeometry(
+            "SRID=4326;POLYGON((5 5, 5 8, 15 8, 15 5, 5 5))")))
+        # the union is computed only once per set of policies
+        self.assertIs(union, self.snapshot.get_allowed_area_union(
+            policies=policies))
+
+    def test_simplified_allowed_area_union(self):
+        self.assertIs(
+            self.snapshot.get_allowed_area_union(policies=[self.west]),
+            self.snapshot.get_simplified_allowed_area_union(allowed_area_pks=[1], tolerance=0))
+
+        simplified = self.snapshot.get_simplified_allowed_area_union(
+            allowed_area_pks=[1, 2], tolerance=0.01)
+
+        self.assertEqual(200, simplified.area)
+        # the union is simplified only once per tolerance
+        self.assertIs(simplified, self.snapshot.get_simplified_allowed_area_union(
+            allowed_area_pks=[2, 1], tolerance=0.01))
+
+    def test_allowed_entities_of_groups(self):
+        self.assertEqual(
+            frozenset(["root", "node1", "node1.1", "node2"]),
+            self.snapshot.get_allowed_entities(operation="GetMap", group_pks=frozenset([1])))
+        self.assertEqual(
+            frozenset(["node1", "node2"]),
+            self.snapshot.get_allowed_entities(operation="GetMap", group_pks=frozenset([2])))
+        self.assertEqual(
+            frozenset(["node2"]),
+            self.snapshot.get_allowed_entities(operation="GetMap", group_pks=frozenset()))
+
+    def test_unknown_entity(self):
+        self.assertFalse(self.snapshot.is_unknown_entity(["Node1", "foo"]))
+        self.assertTrue(self.snapshot.is_unknown_entity(["foo"]))
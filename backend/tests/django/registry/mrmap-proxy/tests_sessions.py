@@ -0,0 +1,94 @@
+import asyncio
+from unittest.mock import patch
+
+import httpx
+from django.test import SimpleTestCase
+from registry.proxy.sessions import (AsyncUpstreamClientRegistry,
+                                     UpstreamSessionRegistry)
+from requests.auth import HTTPDigestAuth
+
+
+class UpstreamSessionRegistryTest(SimpleTestCase):
+
+    def setUp(self):
+        self.registry = UpstreamSessionRegistry(max_size=10)
+
+    def test_session_is_shared_per_host_and_credentials(self):
+        session = self.registry.get_session(
+            url="https://example.com/wms?SERVICE=WMS", auth=("user", "secret"))
+
+        self.assertIs(session, self.registry.get_session(
+            url="https://EXAMPLE.com/other/path", auth=("user", "secret")))
+        self.assertIsNot(session, self.registry.get_session(
+            url="https://example.com/wms", auth=("user", "other")))
+        self.assertIsNot(session, self.registry.get_session(
+            url="http://example.com/wms", auth=("user", "secret")))
+        self.assertEqual(("user", "secret"), session.auth)
+
+    def test_session_is_configured_by_limits(self):
+        session = self.registry.get_session(
+            url="https://example.com/wms", max_connections=3, timeout=5)
+
+        self.assertEqual(3, session.max_connections)
+        self.assertEqual(5, session.timeout)
+        self.assertEqual(3, session.get_adapter(
+            "https://example.com/wms")._pool_maxsize)
+        self.assertIsNot(session, self.registry.get_session(
+            url="https://example.com/wms", max_connections=4, timeout=5))
+
+    def test_credentials_key_does_not_contain_password(self):
+        key = self.registry.get_credentials_key(
+            auth=HTTPDigestAuth(username="user", password="secret"))
+
+        self.assertNotIn("secret", key)
+        self.assertEqual(key, self.registry.get_credentials_key(
+            auth=HTTPDigestAuth(username="user", password="secret")))
+
+    def test_stats_without_requests(self):
+        self.registry.get_session(url="https://example.com/wms")
+
+        self.assertEqual(
+            [{
+                "host": "https://example.com",
+                "max_connections": 20,
+                "requests": 0,
+                "connections": 0,
+                "reuse_rate": 0.0,
+            }],
+            self.registry.stats)
+
+    def test_dropped_session_is_closed(self):
+        session = self.registry.get_session(url="https://example.com/wms")
+
+        with patch.object(session, "close") as close:
+            self.registry.invalidate(url="https://example.com/wms")
+
+        close.assert_called_once()
+
+
+class AsyncUpstreamClientRegistryTest(SimpleTestCase):
+
+    async def test_client_is_shared_per_session(self):
+        registry = AsyncUpstreamClientRegistry(max_size=10)
+        session = UpstreamSessionRegistry().get_session(
+            url="https://example.com/wms", auth=HTTPDigestAuth(username="user", password="secret"), timeout=5)
+
+        client = registry.get_client(session=session)
+
+        self.assertIs(client, registry.get_client(session=session))
+        self.assertIsInstance(client.auth, httpx.DigestAuth)
+        self.assertEqual(5, client.timeout.read)
+        await client.aclose()
+
+    def test_clients_of_closed_loops_are_dropped(self):
+        registry = AsyncUpstreamClientRegistry(max_size=10)
+        session = UpstreamSessionRegistry().get_session(url="https://example.com/wms")
+
+        async def get_client():
+            return registry.get_client(session=session)
+
+        first = asyncio.run(get_client())
+        second = asyncio.run(get_client())
+
+        self.assertIsNot(first, second)
+        self.assertEqual(1, registry._clients.stats["size"])
@@ -0,0 +1,101 @@
+from threading import Event, Thread
+from unittest.mock import Mock, patch
+
+from django.test import SimpleTestCase, override_settings
+from registry.proxy.single_flight import SingleFlight, single_flight
+from registry.proxy.wms_proxy import WebMapServiceProxy
+from requests import Request
+
+
+class SingleFlightTest(SimpleTestCase):
+
+    def test_concurrent_calls_are_coalesced(self):
+        single_flight = SingleFlight()
+        started = Event()
+        release = Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            started.set()
+            release.wait(timeout=5)
+            return "response"
+
+        results = []
+        leader = Thread(target=lambda: results.append(
+            single_flight.do(key="key", func=func)))
+        leader.start()
+        started.wait(timeout=5)
+        followers = [Thread(target=lambda: results.append(single_flight.do(key="key", func=func)))
+                     for _ in range(3)]
+        for follower in followers:
+            follower.start()
+        # give the followers the chance to join the call of the leader
+        release.wait(timeout=0.1)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(timeout=5)
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual(["response"] * 4, results)
+        self.assertEqual(1, single_flight.counters.get("issued"))
+        self.assertEqual(3, single_flight.counters.get("coalesced"))
+
+    def test_sequential_calls_are_not_coalesced(self):
+        single_flight = SingleFlight()
+        single_flight.do(key="key", func=lambda: 1)
+        single_flight.do(key="key", func=lambda: 2)
+
+        self.assertEqual(2, single_flight.counters.get("issued"))
+        self.assertEqual(0, single_flight.counters.get("coalesced"))
+
+    def test_error_is_raised_for_all_callers(self):
+        single_flight = SingleFlight()
+
+        def func():
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            single_flight.do(key="key", func=func)
+
+    def test_key_is_normalized(self):
+        first = Request(
+            method="GET", url="http://example.com/wms?SERVICE=WMS&request=GetMap").prepare()
+        second = Request(
+            method="GET", url="http://example.com/wms?REQUEST=GetMap&service=WMS").prepare()
+
+        self.assertEqual(
+            SingleFlight.get_key(service_pk=1, request=first),
+            SingleFlight.get_key(service_pk=1, request=second))
+        self.assertNotEqual(
+            SingleFlight.get_key(service_pk=1, request=first),
+            SingleFlight.get_key(service_pk=2, request=first))
+        self.assertNotEqual(
+            SingleFlight.get_key(service_pk=1, request=first),
+            SingleFlight.get_key(service_pk=1, request=first, security_context=(1,)))
+
+
+@override_settings(PROXY_SINGLE_FLIGHT=True, PROXY_SINGLE_FLIGHT_OPERATIONS=["getmap"])
+class SingleFlightRequestTest(SimpleTestCase):
+
+    def setUp(self):
+        self.proxy = WebMapServiceProxy()
+        self.proxy.ogc_request = Mock(operation="GetMap")
+        self.proxy._service = Mock(pk=1, allowed_area_pks=None)
+        self.request = Request(
+            method="GET", url="http://example.com/wms?SERVICE=WMS&REQUEST=GetMap")
+
+    def test_read_responses_are_coalesced(self):
+        with patch.object(self.proxy, "_send_hedged_request", return_value="response") as send:
+            self.assertEqual("response", self.proxy.get_remote_response(request=self.request))
+
+        self.assertTrue(send.call_args.kwargs["shared"])
+        self.assertFalse(send.call_args.kwargs["stream"])
+
+    def test_streamed_responses_are_not_coalesced(self):
+        with patch.object(single_flight, "do") as do, \
+                patch.object(self.proxy, "_send_hedged_request", return_value="response") as send:
+            self.assertEqual("response", self.proxy.get_remote_response(request=self.request, stream=True))
+
+        do.assert_not_called()
+        self.assertTrue(send.call_args.kwargs["stream"])
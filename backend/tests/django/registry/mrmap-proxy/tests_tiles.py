@@ -0,0 +1,186 @@
+import io
+import shutil
+from tempfile import mkdtemp
+from unittest.mock import patch
+
+from django.contrib.auth.models import AnonymousUser, Group
+from django.contrib.gis.geos import GEOSGeometry
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from ows_lib.models.ogc_request import OGCRequest
+from PIL import Image
+from registry.models.security import AllowedWebMapServiceOperation
+from registry.proxy.security_policy import security_policy_registry
+from registry.proxy.tile_proxy import WebMapTileServiceProxy
+from registry.proxy.tiles import (PUBLIC_TILES, TILE_MATRIX_SETS,
+                                  FileSystemTileCache, TileKey,
+                                  get_map_params, purge_tiles_on_commit,
+                                  split_metatile)
+
+
+class TileMatrixSetTest(SimpleTestCase):
+
+    def test_web_mercator_quad(self):
+        tile_matrix_set = TILE_MATRIX_SETS["WebMercatorQuad"]
+
+        self.assertEqual((4, 4), tile_matrix_set.get_matrix_size(zoom=2))
+        self.assertEqual((-20037508.3427892, 0.0, 0.0, 20037508.3427892),
+                         tile_matrix_set.get_bbox(zoom=1, col=0, row=0))
+        self.assertFalse(tile_matrix_set.contains(zoom=1, col=2, row=0))
+
+    def test_world_crs84_quad(self):
+        tile_matrix_set = TILE_MATRIX_SETS["WorldCRS84Quad"]
+
+        self.assertEqual((2, 1), tile_matrix_set.get_matrix_size(zoom=0))
+        self.assertEqual((0.0, -90.0, 180.0, 90.0),
+                         tile_matrix_set.get_bbox(zoom=0, col=1, row=0))
+
+    def test_metatile_at_the_edge_of_the_matrix(self):
+        tile_matrix_set = TILE_MATRIX_SETS["WebMercatorQuad"]
+
+        self.assertEqual((4, 0, 4, 4), tile_matrix_set.get_metatile(
+            zoom=3, col=5, row=2, meta_size=4))
+        self.assertEqual((0, 0, 2, 2), tile_matrix_set.get_metatile(
+            zoom=1, col=1, row=1, meta_size=4))
+
+    def test_tile_range(self):
+        tile_matrix_set = TILE_MATRIX_SETS["WorldCRS84Quad"]
+
+        self.assertEqual((2, 2, 0, 1), tile_matrix_set.get_tile_range(
+            zoom=1, bbox=(5, -10, 15, 10)))
+        self.assertEqual((0, 3, 0, 1), tile_matrix_set.get_tile_range(
+            zoom=1, bbox=(-200, -100, 200, 100)))
+
+
+class GetMapParamsTest(SimpleTestCase):
+
+    def test_axis_order_of_wms_1_3_0(self):
+        params = get_map_params(version="1.3.0", layer="node1", tile_matrix_set=TILE_MATRIX_SETS["WorldCRS84Quad"],
+                                bbox=(0.0, -90.0, 180.0, 90.0), width=256, height=256, mime_type="image/png")
+
+        self.assertEqual("EPSG:4326", params["CRS"])
+        self.assertEqual("-90.0,0.0,90.0,180.0", params["BBOX"])
+
+    def test_axis_order_of_wms_1_1_1(self):
+        params = get_map_params(version="1.1.1", layer="node1", tile_matrix_set=TILE_MATRIX_SETS["WorldCRS84Quad"],
+                                bbox=(0.0, -90.0, 180.0, 90.0), width=256, height=256, mime_type="image/jpeg")
+
+        self.assertEqual("EPSG:4326", params["SRS"])
+        self.assertEqual("0.0,-90.0,180.0,90.0", params["BBOX"])
+        self.assertEqual("FALSE", params["TRANSPARENT"])
+
+
+class SplitMetatileTest(SimpleTestCase):
+
+    def test_split(self):
+        metatile = Image.new("RGBA", (512, 256), (255, 0, 0, 255))
+        metatile.paste((0, 0, 255, 255), (256, 0, 512, 256))
+        out_bytes_stream = io.BytesIO()
+        metatile.save(out_bytes_stream, "PNG")
+
+        tiles = split_metatile(content=out_bytes_stream.getvalue(), cols=2, rows=1, tile_size=256,
+                               mime_type="image/png")
+
+        self.assertEqual({(0, 0), (1, 0)}, set(tiles.keys()))
+        tile = Image.open(io.BytesIO(tiles[(1, 0)])).convert("RGBA")
+        self.assertEqual((256, 256), tile.size)
+        self.assertEqual((0, 0, 255, 255), tile.getpixel((0, 0)))
+
+
+class FileSystemTileCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.location = mkdtemp()
+        self.tile_cache = FileSystemTileCache(timeout=60, location=self.location)
+        self.key = TileKey(service_pk="service", layer="ns:node1", security_key=PUBLIC_TILES,
+                           tile_matrix_set="WebMercatorQuad", zoom=12, col=2200, row=1343, extension="png")
+
+    def tearDown(self):
+        shutil.rmtree(self.location, ignore_errors=True)
+
+    def test_set_and_get(self):
+        self.assertIsNone(self.tile_cache.get(key=self.key))
+
+        self.tile_cache.set(key=self.key, content=b"tile")
+
+        self.assertEqual(b"tile", self.tile_cache.get(key=self.key))
+        self.assertIsNone(self.tile_cache.get(
+            key=self.key.get_sibling(col=2201, row=1343)))
+
+    def test_purge_layer(self):
+        other_key = TileKey(service_pk="service", layer="node2", security_key=PUBLIC_TILES,
+                            tile_matrix_set="WebMercatorQuad", zoom=0, col=0, row=0, extension="png")
+        self.tile_cache.set_many(tiles={self.key: b"tile", other_key: b"other"})
+
+        self.tile_cache.purge(service_pk="service", layer="ns:node1")
+
+        self.assertIsNone(self.tile_cache.get(key=self.key))
+        self.assertEqual(b"other", self.tile_cache.get(key=other_key))
+
+    def test_purge_service(self):
+        self.tile_cache.set(key=self.key, content=b"tile")
+
+        self.tile_cache.purge(service_pk="service")
+
+        self.assertIsNone(self.tile_cache.get(key=self.key))
+
+
+class PurgeTilesOnCommitTest(SimpleTestCase):
+
+    def test_autocommit(self):
+        with patch("registry.tasks.security.async_purge_tiles.delay") as delay:
+            purge_tiles_on_commit(service_pk="service")
+
+        delay.assert_called_once_with(service_pk="service")
+
+
+class TileSecurityKeyTest(TestCase):
+
+    fixtures = ["test_keywords.json", "test_wms.json",
+                "test_allowed_wms_operation.json"]
+
+    def setUp(self):
+        self.service_pk = "cd16cc1f-3abb-4625-bb96-fbe80dbe23e3"
+        self.location = mkdtemp()
+        self.tile_cache = FileSystemTileCache(timeout=60, location=self.location)
+        # allowed operation 1237 grants GetMap on node1.1 to everyone inside its allowed area
+        self.allowed_operation = AllowedWebMapServiceOperation.objects.get(pk=1237)
+
+    def tearDown(self):
+        shutil.rmtree(self.location, ignore_errors=True)
+
+    def get_tile_key(self) -> TileKey:
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        proxy = WebMapTileServiceProxy()
+        proxy.request = request
+        proxy.kwargs = {"pk": self.service_pk}
+        proxy.ogc_request = OGCRequest(method="GET", url="http://testserver/wms", params=get_map_params(
+            version="1.3.0", layer="node1.1", tile_matrix_set=TILE_MATRIX_SETS["WebMercatorQuad"],
+            bbox=(0, 0, 1000, 1000), width=256, height=256, mime_type="image/png"), django_request=request)
+        return TileKey(service_pk=self.service_pk, layer="node1.1", security_key=proxy.get_security_key(),
+                       tile_matrix_set="WebMercatorQuad", zoom=12, col=2200, row=1343, extension="png")
+
+    def test_narrowed_area_is_not_served_from_stale_tiles(self):
+        stale_key = self.get_tile_key()
+        self.assertNotIn(stale_key.security_key, (None, PUBLIC_TILES))
+        self.tile_cache.set(key=stale_key, content=b"stale")
+
+        self.allowed_operation.allowed_area = GEOSGeometry(
+            "SRID=4326;MULTIPOLYGON(((7.59 50.375, 7.59 50.376, 7.591 50.376, 7.591 50.375, 7.59 50.375)))")
+        with patch.object(security_policy_registry, "_get_redis"), \
+                patch("registry.tasks.security.async_purge_tiles.delay") as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.allowed_operation.save()
+
+        delay.assert_called_once_with(service_pk=self.service_pk)
+        key = self.get_tile_key()
+        self.assertNotEqual(stale_key.security_key, key.security_key)
+        self.assertIsNone(self.tile_cache.get(key=key))
+
+    def test_changed_groups_purge_tiles(self):
+        with patch.object(security_policy_registry, "_get_redis"), \
+                patch("registry.tasks.security.async_purge_tiles.delay") as delay, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.allowed_operation.allowed_groups.add(Group.objects.create(name="editors"))
+
+        delay.assert_called_once_with(service_pk=self.service_pk)
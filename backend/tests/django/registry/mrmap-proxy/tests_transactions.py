@@ -0,0 +1,93 @@
+from unittest.mock import patch
+
+from django.db import transaction
+from django.test import TransactionTestCase
+from registry.proxy.security_policy import SecurityPolicyRegistry
+from registry.proxy.transactions import on_commit_once
+
+
+class OnCommitOnceTest(TransactionTestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    def func(self, key):
+        self.calls.append(key)
+
+    def test_autocommit(self):
+        on_commit_once(func=self.func, key=1)
+        on_commit_once(func=self.func, key=1)
+
+        self.assertEqual([1, 1], self.calls)
+
+    def test_called_once_per_key_after_commit(self):
+        with transaction.atomic():
+            on_commit_once(func=self.func, key=1)
+            on_commit_once(func=self.func, key=2)
+            on_commit_once(func=self.func, key=1)
+            self.assertEqual([], self.calls)
+
+        self.assertEqual([1, 2], self.calls)
+
+        with transaction.atomic():
+            on_commit_once(func=self.func, key=1)
+
+        self.assertEqual([1, 2, 1], self.calls)
+
+    def test_rollback(self):
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                on_commit_once(func=self.func, key=1)
+                raise ValueError()
+
+        with transaction.atomic():
+            on_commit_once(func=self.func, key=1)
+
+        self.assertEqual([1], self.calls)
+
+    def test_savepoint_rollback(self):
+        with transaction.atomic():
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    on_commit_once(func=self.func, key=1)
+                    raise ValueError()
+            on_commit_once(func=self.func, key=1)
+
+        self.assertEqual([1], self.calls)
+
+    def test_failing_callback(self):
+        def fail(key):
+            raise ValueError()
+
+        with transaction.atomic():
+            on_commit_once(func=fail, key=1)
+            on_commit_once(func=self.func, key=2)
+
+        self.assertEqual([2], self.calls)
+
+
+class PublishInvalidationOnCommitTest(TransactionTestCase):
+
+    def setUp(self):
+        self.registry = SecurityPolicyRegistry()
+
+    def test_autocommit(self):
+        with patch.object(self.registry, "_get_redis") as get_redis:
+            self.registry.publish_invalidation_on_commit(service_pk="1")
+
+        get_redis.return_value.publish.assert_called_once()
+        self.assertEqual("1", get_redis.return_value.publish.call_args.args[1])
+
+    def test_published_after_rollback(self):
+        with patch.object(self.registry, "_get_redis") as get_redis:
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    self.registry.publish_invalidation_on_commit(service_pk="1")
+                    raise ValueError()
+            get_redis.return_value.publish.assert_not_called()
+
+            with transaction.atomic():
+                self.registry.publish_invalidation_on_commit(service_pk="1")
+                self.registry.publish_invalidation_on_commit(service_pk="1")
+
+        get_redis.return_value.publish.assert_called_once()
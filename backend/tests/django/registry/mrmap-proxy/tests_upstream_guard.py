@@ -0,0 +1,119 @@
+from threading import Event, Thread
+from unittest.mock import patch
+
+from django.core.cache import caches
+from django.test import SimpleTestCase
+from registry.proxy.upstream_guard import (CLOSED, HALF_OPEN, OPEN, PROBE,
+                                           CircuitBreaker, ConcurrencyLimiter,
+                                           is_failure)
+
+
+class CircuitBreakerTest(SimpleTestCase):
+
+    def setUp(self):
+        caches["local-memory"].clear()
+        self.breaker = CircuitBreaker(
+            threshold=3, window=30, reset_timeout=10, cache_alias="local-memory")
+
+    def fail(self, times):
+        for _ in range(times):
+            self.breaker.record(service_pk=1, mode=CLOSED, success=False)
+
+    def test_closed_below_threshold(self):
+        self.fail(times=2)
+
+        self.assertEqual(CLOSED, self.breaker.allow(service_pk=1))
+        self.assertEqual(CLOSED, self.breaker.get_state(service_pk=1)["state"])
+        self.assertEqual(2, self.breaker.get_state(service_pk=1)["failures"])
+
+    def test_opens_after_threshold(self):
+        self.fail(times=3)
+
+        self.assertIsNone(self.breaker.allow(service_pk=1))
+        self.assertEqual(OPEN, self.breaker.get_state(service_pk=1)["state"])
+        # other services are not affected
+        self.assertEqual(CLOSED, self.breaker.allow(service_pk=2))
+
+    def test_single_probe_after_reset_timeout(self):
+        self.fail(times=3)
+
+        with patch("registry.proxy.upstream_guard.time.time", return_value=9999999999):
+            self.assertEqual(HALF_OPEN, self.breaker.get_state(service_pk=1)["state"])
+            self.assertEqual(PROBE, self.breaker.allow(service_pk=1))
+            self.assertIsNone(self.breaker.allow(service_pk=1))
+
+    def test_successful_probe_closes_circuit(self):
+        self.fail(times=3)
+
+        with patch("registry.proxy.upstream_guard.time.time", return_value=9999999999):
+            mode = self.breaker.allow(service_pk=1)
+            self.breaker.record(service_pk=1, mode=mode, success=True)
+
+            self.assertEqual(CLOSED, self.breaker.allow(service_pk=1))
+
+    def test_failed_probe_opens_circuit_again(self):
+        self.fail(times=3)
+
+        with patch("registry.proxy.upstream_guard.time.time", return_value=9999999999):
+            mode = self.breaker.allow(service_pk=1)
+            self.breaker.record(service_pk=1, mode=mode, success=False)
+
+            self.assertIsNone(self.breaker.allow(service_pk=1))
+            self.assertEqual(OPEN, self.breaker.get_state(service_pk=1)["state"])
+
+    def test_is_failure(self):
+        self.assertTrue(is_failure(response={"status_code": 504}))
+        self.assertFalse(is_failure(response={"status_code": 404}))
+
+
+class ConcurrencyLimiterTest(SimpleTestCase):
+
+    def test_rejects_if_host_is_busy(self):
+        limiter = ConcurrencyLimiter(limit=1, queue_timeout=0.01)
+
+        with limiter.limit_host(host="example.com") as acquired:
+            self.assertTrue(acquired)
+            with limiter.limit_host(host="example.com") as second:
+                self.assertFalse(second)
+            with limiter.limit_host(host="other.example.com") as other:
+                self.assertTrue(other)
+        with limiter.limit_host(host="example.com") as acquired:
+            self.assertTrue(acquired)
+
+    def test_waits_for_free_slot(self):
+        limiter = ConcurrencyLimiter(limit=1, queue_timeout=5)
+        holding, released = Event(), Event()
+
+        def hold():
+            with limiter.limit_host(host="example.com"):
+                holding.set()
+                released.wait()
+
+        thread = Thread(target=hold)
+        thread.start()
+        holding.wait()
+        released.set()
+        with limiter.limit_host(host="example.com") as acquired:
+            self.assertTrue(acquired)
+        thread.join()
+
+    def test_disabled_limit(self):
+        limiter = ConcurrencyLimiter(limit=0)
+
+        with limiter.limit_host(host="example.com") as acquired:
+            self.assertTrue(acquired)
+
+    def test_lease_polling_backs_off(self):
+        limiter = ConcurrencyLimiter(limit=1, queue_timeout=1, use_redis=True)
+        limiter._redis = object()
+        limiter._acquire_script = lambda keys, args: 0
+
+        with patch("registry.proxy.upstream_guard.time.sleep") as sleep, \
+                patch("registry.proxy.upstream_guard.time.monotonic", side_effect=[0] + [0.1] * 6 + [1]):
+            self.assertIsNone(limiter._acquire_lease(host="example.com"))
+
+        intervals = [call.args[0] for call in sleep.call_args_list]
+        self.assertEqual(6, len(intervals))
+        self.assertLessEqual(intervals[0], ConcurrencyLimiter.MIN_POLL_INTERVAL)
+        self.assertGreaterEqual(intervals[-1], ConcurrencyLimiter.MAX_POLL_INTERVAL / 2)
+        self.assertTrue(all(interval <= ConcurrencyLimiter.MAX_POLL_INTERVAL for interval in intervals))
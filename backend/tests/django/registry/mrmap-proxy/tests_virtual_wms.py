@@ -0,0 +1,146 @@
+from io import BytesIO
+from threading import Event
+from unittest.mock import patch
+
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.urls import reverse
+from lxml import objectify
+from PIL import Image
+from registry.models.mapcontext import MapContextLayer
+from registry.proxy.virtual_wms_proxy import render_service_map
+from registry.proxy.wms_proxy import WebMapServiceProxy
+
+SERVICE = "cd16cc1f-3abb-4625-bb96-fbe80dbe23e3"
+OTHER_SERVICE = "1b195589-dcfa-403f-9e66-e7e1c0a67024"
+
+
+def encode(color) -> bytes:
+    out = BytesIO()
+    Image.new("RGBA", (20, 10), color).save(out, "PNG")
+    return out.getvalue()
+
+
+class VirtualWebMapServiceProxyTest(TestCase):
+
+    fixtures = ["test_keywords.json", "test_wms.json", "test_mapcontext.json"]
+
+    def setUp(self):
+        # map context 1: node1.1 of the first service is already the rendering layer of layer 1
+        for pk, rendering_layer in (
+            (3, "c4ecdb87-31f4-4f30-8559-f577c8c59d08"),  # node1.1.1 of the first service
+            (4, "05977f90-3bd9-4017-95e1-5252735d213f"),  # node1 of the other service
+            (5, "d6e47039-b08a-4183-ae51-667083b8a803"),  # node1.2 of the first service
+        ):
+            MapContextLayer.objects.filter(pk=pk).update(
+                rendering_layer_id=rendering_layer, rendering_active=True)
+        self.url = reverse("virtual-wms-operation", args=[1])
+        self.query_params = {
+            "SERVICE": "WMS",
+            "REQUEST": "GetMap",
+            "VERSION": "1.3.0",
+            "CRS": "EPSG:4326",
+            "BBOX": "50,7,51,8",
+            "WIDTH": "20",
+            "HEIGHT": "10",
+            "FORMAT": "image/png",
+        }
+
+    def get_calls(self, render):
+        return [(call.kwargs["service_pk"], call.kwargs["layers"]) for call in render.call_args_list]
+
+    @patch("registry.proxy.virtual_wms_proxy.composite_images", return_value=b"png")
+    @patch("registry.proxy.virtual_wms_proxy.render_service_map", side_effect=lambda service_pk, layers, **kwargs: (service_pk, tuple(layers)))
+    def test_active_layers_are_grouped_per_service(self, render, composite):
+        response = self.client.get(self.url, self.query_params)
+
+        self.assertEqual(200, response.status_code)
+        # the first layer of the map context tree is on top; consecutive layers of the same service are requested
+        # together
+        expected = [
+            (SERVICE, ("node1.2",)),
+            (OTHER_SERVICE, ("node1",)),
+            (SERVICE, ("node1.1.1", "node1.1")),
+        ]
+        self.assertEqual(expected, self.get_calls(render=render))
+        self.assertEqual(expected, composite.call_args.kwargs["contents"])
+
+    @patch("registry.proxy.virtual_wms_proxy.composite_images", return_value=b"png")
+    @patch("registry.proxy.virtual_wms_proxy.render_service_map", side_effect=lambda service_pk, layers, **kwargs: (service_pk, tuple(layers)))
+    def test_requested_layers_are_drawn_from_bottom_to_top(self, render, composite):
+        self.query_params.update({"LAYERS": "4,1,3"})
+
+        self.client.get(self.url, self.query_params)
+
+        self.assertEqual(
+            [(OTHER_SERVICE, ("node1",)), (SERVICE, ("node1.1", "node1.1.1"))], self.get_calls(render=render))
+
+    @patch("registry.proxy.virtual_wms_proxy.render_service_map")
+    def test_unknown_layer(self, render):
+        # layer 2 is part of the map context, but has no rendering layer
+        for layers in ("1,999", "2"):
+            self.query_params.update({"LAYERS": layers})
+
+            response = self.client.get(self.url, self.query_params)
+
+            response_xml = objectify.fromstring(response.content)
+            self.assertEqual("LayerNotDefined", response_xml.ServiceException.get("code"))
+        render.assert_not_called()
+
+    def test_forbidden_service_is_left_out(self):
+        def render(service_pk, **kwargs):
+            # the security proxy of the other service answers with an exception report
+            return encode((255, 0, 0, 255)) if service_pk == SERVICE else None
+
+        self.query_params.update({"LAYERS": "1,4"})
+        with patch("registry.proxy.virtual_wms_proxy.render_service_map", side_effect=render):
+            response = self.client.get(self.url, self.query_params)
+
+        self.assertEqual("image/png", response["Content-Type"])
+        image = Image.open(BytesIO(response.content)).convert("RGBA")
+        self.assertEqual((255, 0, 0, 255), image.getpixel((10, 5)))
+
+    @override_settings(PROXY_UPSTREAM_TIMEOUT=0, PROXY_UPSTREAM_QUEUE_TIMEOUT=0.1)
+    def test_slow_service_is_left_out(self):
+        release = Event()
+
+        def render(service_pk, **kwargs):
+            if service_pk == OTHER_SERVICE:
+                release.wait(timeout=5)
+                return encode((0, 0, 255, 255))
+            return encode((255, 0, 0, 255))
+
+        self.query_params.update({"LAYERS": "1,4"})
+        try:
+            with patch("registry.proxy.virtual_wms_proxy.render_service_map", side_effect=render):
+                response = self.client.get(self.url, self.query_params)
+        finally:
+            release.set()
+
+        image = Image.open(BytesIO(response.content)).convert("RGBA")
+        self.assertEqual((255, 0, 0, 255), image.getpixel((10, 5)))
+
+
+class RenderServiceMapTest(SimpleTestCase):
+
+    def setUp(self):
+        self.request = RequestFactory().get("/mrmap-proxy/mapcontext/1/wms")
+
+    def render(self):
+        return render_service_map(request=self.request, service_pk=SERVICE, layers=["node1.1"], styles=[""],
+                                  params={"VERSION": "1.3.0", "CRS": "EPSG:4326", "BBOX": "50,7,51,8",
+                                          "WIDTH": "20", "HEIGHT": "10"})
+
+    def test_secured_map_image(self):
+        masked = encode((255, 0, 0, 128))
+        with patch.object(WebMapServiceProxy, "get_and_post",
+                          return_value=HttpResponse(content=masked, content_type="image/png")) as get_and_post:
+            self.assertEqual(masked, self.render())
+
+        self.assertIs(self.request, get_and_post.call_args.kwargs["request"])
+
+    def test_exception_report_is_left_out(self):
+        with patch.object(WebMapServiceProxy, "get_and_post",
+                          return_value=HttpResponse(content=b"<ServiceExceptionReport/>", content_type="text/xml")):
+            self.assertIsNone(self.render())
@@ -0,0 +1,85 @@
+from unittest.mock import patch
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.test import SimpleTestCase
+from eulxml.xmlmap import load_xmlobject_from_file
+from MrMap.settings import BASE_DIR
+from ows_lib.xml_mapper.xml_requests.wfs.get_feature import GetFeatureRequest
+from registry.proxy.security_policy import (AllowedOperationPolicy,
+                                            SecurityPolicySnapshot)
+from registry.proxy.wfs_filter import (SpatialFilter, get_filter_geometry,
+                                       secure_get_feature_request)
+
+
+class SpatialFilterTest(SimpleTestCase):
+
+    def get_request(self) -> GetFeatureRequest:
+        return load_xmlobject_from_file(
+            f"{BASE_DIR}/tests/django/test_data/xml_requests/get_feature_2.0.0.xml", xmlclass=GetFeatureRequest)
+
+    def test_spliced_filter_equals_secure_spatial(self):
+        for geometry in (
+            GEOSGeometry("SRID=4326;MULTIPOLYGON(((0 0, 0 10, 10 10, 10 0, 0 0)))"),
+            GEOSGeometry("SRID=4326;MULTIPOLYGON(((0 0, 0 10, 10 10, 10 0, 0 0)),((20 0, 20 10, 30 10, 30 0, 20 0)))"),
+        ):
+            expected = self.get_request()
+            expected.secure_spatial(feature_types=[{
+                "type_name": "ms:Countries", "geometry_property_name": "ms:Geometry", "allowed_area_union": geometry}])
+            secured = self.get_request()
+            secure_get_feature_request(get_feature_request=secured, spatial_filters=[{
+                "type_name": "ms:Countries",
+                "spatial_filter": SpatialFilter(geometry=geometry, value_reference="ms:Geometry")}])
+
+            self.assertEqual(expected.serialize(), secured.serialize())
+
+    def test_spatial_filter_of_version_equals_secure_spatial(self):
+        allowed_area = GEOSGeometry("SRID=4326;MULTIPOLYGON(((0 0, 0 10, 20 10, 20 0, 0 0)))")
+        # the axis order of wfs 1.1.0 and 2.0.0 requests follows the epsg definition
+        swapped = GEOSGeometry("SRID=4326;MULTIPOLYGON(((0 0, 10 0, 10 20, 0 20, 0 0)))")
+        for service_version in ("1.1.0", "2.0.0"):
+            policy = AllowedOperationPolicy(
+                pk=1, operations=["GetFeature"], group_pks=[], entity_identifiers=["ms:countries"],
+                allowed_area=allowed_area)
+            snapshot = SecurityPolicySnapshot(
+                service_pk="73cf78c9-6605-47fd-ac4f-1be59265df65", known_entities=["ms:Countries"], policies=[policy])
+            with patch("registry.proxy.wfs_filter.adjust_axis_order", return_value=swapped):
+                spatial_filter = snapshot.get_spatial_filter(
+                    policies=[policy], value_reference="ms:Geometry", service_version=service_version)
+                expected = self.get_request()
+                expected.secure_spatial(feature_types=[{
+                    "type_name": "ms:Countries", "geometry_property_name": "ms:Geometry",
+                    "allowed_area_union": get_filter_geometry(geometry=allowed_area, service_version=service_version)}])
+            secured = self.get_request()
+            secure_get_feature_request(get_feature_request=secured, spatial_filters=[{
+                "type_name": "ms:Countries", "spatial_filter": spatial_filter}])
+
+            self.assertEqual(swapped, spatial_filter.geometry)
+            self.assertEqual(expected.serialize(), secured.serialize())
+
+    def test_multiple_type_names_are_not_secured(self):
+        request = self.get_request()
+        request.queries[0].type_names = ["ms:Countries", "ms:Cities"]
+
+        with self.assertRaises(NotImplementedError):
+            secure_get_feature_request(get_feature_request=request, spatial_filters=[])
+
+    def test_spatial_filter_is_cached_per_snapshot(self):
+        policy = AllowedOperationPolicy(
+            pk=1,
+            operations=["GetFeature"],
+            group_pks=[],
+            entity_identifiers=["ms:countries"],
+            allowed_area=GEOSGeometry("SRID=4326;MULTIPOLYGON(((0 0, 0 10, 10 10, 10 0, 0 0)))"))
+        snapshot = SecurityPolicySnapshot(
+            service_pk="73cf78c9-6605-47fd-ac4f-1be59265df65",
+            known_entities=["ms:Countries"],
+            policies=[policy])
+
+        spatial_filter = snapshot.get_spatial_filter(
+            policies=[policy], value_reference="ms:Geometry", service_version="1.0.0")
+
+        self.assertIs(spatial_filter, snapshot.get_spatial_filter(
+            policies=[policy], value_reference="ms:Geometry", service_version="1.0.0"))
+        self.assertIsNot(spatial_filter, snapshot.get_spatial_filter(
+            policies=[policy], value_reference="ms:Shape", service_version="1.0.0"))
+        self.assertEqual(policy.allowed_area, spatial_filter.geometry)
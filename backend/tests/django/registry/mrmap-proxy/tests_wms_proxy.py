@@ -1,12 +1,15 @@
+import asyncio
+from datetime import timedelta
 from io import BytesIO
 from pathlib import Path
-from unittest.mock import patch
+from unittest.mock import AsyncMock, Mock, PropertyMock, patch
 
+import httpx
 from accounts.models.users import User
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.management import call_command
 from django.db.models.query_utils import Q
-from django.test import Client, TestCase
+from django.test import Client, SimpleTestCase, TestCase, override_settings
 from epsg_cache.models import Origin, SpatialReference
 from epsg_cache.registry import Registry
 from lxml import etree, objectify
@@ -14,7 +17,11 @@ from MrMap.settings import BASE_DIR
 from PIL import Image, ImageChops
 from registry.models.security import AllowedWebMapServiceOperation
 from registry.models.service import WebMapService
-from registry.proxy.wms_proxy import WebMapServiceProxy
+from registry.proxy.sessions import RemoteResponse
+from registry.proxy.wms_proxy import (AsyncWebMapServiceProxy,
+                                      WebMapServiceProxy)
+from requests import Request
+from requests.exceptions import ReadTimeout
 from rest_framework import status
 
 
@@ -170,6 +177,32 @@ class WebMapServiceProxyTest(TestCase):
         self.assertEqual(etree.tostring(response_xml),
                          etree.tostring(expected_xml))
 
+    @override_settings(PROXY_GET_MAP_PREFLIGHT=True)
+    @patch.object(
+        target=WebMapServiceProxy,
+        attribute="get_remote_response",
+    )
+    def test_preflight_invalid_crs_exception(self, mocked_remote_response):
+        self.client.login(username="User1", password="User1")
+        self.query_params.update({"LAYERS": "node1"})
+        response = self.client.get(
+            self.wms_url,
+            self.query_params
+        )
+
+        self.assertEqual(200, response.status_code)
+
+        response_xml = objectify.fromstring(response.content)
+        expected_xml = objectify.fromstring(b'<?xml version="1.0" encoding="UTF-8"?>'
+                                            b'<ServiceExceptionReport version="1.3.0" xmlns="http://www.opengis.net/ogc" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.opengis.net/ogc">'
+                                            b'<ServiceException code="InvalidCRS" locator="crs">'
+                                            b'the requested crs is not supported by the requested layers.'
+                                            b'</ServiceException>'
+                                            b'</ServiceExceptionReport>')
+        self.assertEqual(etree.tostring(response_xml),
+                         etree.tostring(expected_xml))
+        mocked_remote_response.assert_not_called()
+
     def test_forbidden_exception_if_one_requested_layer_is_not_enabled(self):
         self.query_params.update({"LAYERS": "node1"})
         response = self.client.get(
@@ -208,3 +241,54 @@ class WebMapServiceProxyTest(TestCase):
 
         self.assertEqual(200, response.status_code)
         # TODO: check the response picture
+
+
+class RemoteRequestTimeoutTest(SimpleTestCase):
+
+    def setUp(self):
+        self.request = Request(method="GET", url="http://example.com/wms").prepare()
+
+    def test_read_timeout_is_gateway_timeout(self):
+        proxy = WebMapServiceProxy()
+        proxy._remote_service = Mock()
+        proxy._remote_service.session.send.side_effect = ReadTimeout()
+
+        response = proxy._send_remote_request(request=self.request)
+
+        self.assertEqual(504, response["status_code"])
+        self.assertEqual("MaxResponseTimeExceeded", response["code"])
+
+    async def test_async_read_timeout_is_gateway_timeout(self):
+        client = Mock()
+        client.send = AsyncMock(side_effect=httpx.ReadTimeout("timed out"))
+        proxy = AsyncWebMapServiceProxy()
+
+        with patch.object(AsyncWebMapServiceProxy, "async_client", new_callable=PropertyMock, return_value=client):
+            response = await proxy._asend_remote_request(request=self.request)
+
+        self.assertEqual(504, response["status_code"])
+        self.assertEqual("MaxResponseTimeExceeded", response["code"])
+
+
+class AsyncStreamingResponseTest(SimpleTestCase):
+
+    async def test_shared_response_is_logged_outside_of_the_event_loop(self):
+        proxy = AsyncWebMapServiceProxy()
+        proxy._service = Mock(log_response=True)
+        response = RemoteResponse(
+            status_code=200, reason="OK", headers=httpx.Headers({"content-type": "image/png"}),
+            url="http://example.com/wms", elapsed=timedelta(seconds=1), content=b"png")
+        loops = []
+
+        def log_response(response, content=None):
+            try:
+                loops.append(asyncio.get_running_loop())
+            except RuntimeError:
+                loops.append(None)
+
+        with patch.object(proxy, "_log_response", side_effect=log_response):
+            streaming_response = await proxy.areturn_streaming_http_response(response=response)
+
+        self.assertEqual([None], loops)
+        self.assertEqual(200, streaming_response.status_code)
+        self.assertEqual(b"png", b"".join(streaming_response.streaming_content))